@@ -0,0 +1,171 @@
+#! /usr/bin/env python3
+#
+# psv benchmark: generate synthetic steps, measure generation and psql runs.
+#
+# Results are appended as JSON lines, one per configuration, so that runs
+# from different versions can be compared.
+#
+
+import os
+import sys
+import json
+import time
+import shlex
+import argparse
+import tempfile
+import subprocess
+import datetime as dt
+
+# all benchmark objects, including the psv infra, live in this schema
+SCHEMA = "psv_bench"
+
+def gen_steps(dir: str, steps: int, apps: int, body: int, reverse: bool) -> list[str]:
+    """Generate synthetic forward and possibly reverse steps for several applications."""
+    files = []
+    padding = "-- " + "x" * 76 + "\n"
+    for a in range(1, apps + 1):
+        app = f"bench{a}"
+        for v in range(1, steps + 1):
+            filename = os.path.join(dir, f"{app}_{v:06d}.sql")
+            with open(filename, "w") as f:
+                f.write(f"-- psv: {app} +{v} {app} step {v}\n")
+                f.write(f"CREATE TABLE {SCHEMA}.{app}_t{v}(id SERIAL PRIMARY KEY, data TEXT);\n")
+                f.write(padding * (body // len(padding)))
+            files.append(filename)
+            if reverse:
+                filename = os.path.join(dir, f"{app}_r{v:06d}.sql")
+                with open(filename, "w") as f:
+                    f.write(f"-- psv: {app} -{v} {app} step {v - 1}\n")
+                    f.write(f"DROP TABLE {SCHEMA}.{app}_t{v};\n")
+                files.append(filename)
+    return files
+
+def run(cmd: list[str], stdin=None) -> tuple[float, int]:
+    """Run a command, return elapsed seconds and peak memory in KiB."""
+    with tempfile.TemporaryFile() as errors:
+        t0 = time.monotonic()
+        proc = subprocess.Popen(cmd, stdin=stdin, stdout=subprocess.DEVNULL, stderr=errors)
+        # per-process resource usage
+        _, status, rusage = os.wait4(proc.pid, 0)
+        elapsed = time.monotonic() - t0
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        errors.seek(0)
+        stderr = errors.read().decode("UTF-8", "replace")
+    # psv scripts report errors on stderr and quit "successfully"
+    if proc.returncode != 0 or "ERROR" in stderr:
+        raise Exception(f"command failed ({proc.returncode}): {shlex.join(cmd)}\n{stderr}")
+    # linux reports KiB, macos bytes
+    maxrss = rusage.ru_maxrss // 1024 if sys.platform == "darwin" else rusage.ru_maxrss
+    return elapsed, maxrss
+
+def bench(args, steps: int, apps: int, body: int) -> dict:
+    """Run one benchmark configuration."""
+
+    result = {
+        "psv_bench": 1,
+        "label": args.label,
+        "timestamp": dt.datetime.now(dt.timezone.utc).isoformat(timespec="seconds"),
+        "steps": steps,
+        "apps": apps,
+        "body": body,
+        "reverse": args.reverse,
+        "options": args.psv_opts,
+    }
+
+    with tempfile.TemporaryDirectory(prefix="psv_bench_") as dir:
+
+        files = gen_steps(dir, steps, apps, body, args.reverse)
+        output = os.path.join(dir, "bench.sql")
+        psv = shlex.split(args.psv) + ["-s", SCHEMA] + shlex.split(args.psv_opts)
+        if apps > 1:
+            psv.append("--multi")
+        psv += ["-o", output] + files
+
+        times, sizes = [], []
+        for _ in range(args.repeat):
+            if os.path.exists(output):
+                os.remove(output)
+            times.append(run(psv))
+            sizes.append(os.path.getsize(output))
+
+        result["generation"] = {
+            "seconds": min(t for t, _ in times),
+            "maxrss_kib": max(m for _, m in times),
+            "output_bytes": sizes[-1],
+        }
+
+        if args.db:
+            psql = shlex.split(args.psql) + ["-X", "-q", "-v", "ON_ERROR_STOP=1", "-d", args.db]
+
+            def psql_run(command: str) -> float:
+                with open(output) as f:
+                    return run(psql + ["-v", f"psv={command}"], stdin=f)[0]
+
+            def reset():
+                subprocess.run(psql + ["-c", f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE",
+                                       "-c", f"CREATE SCHEMA {SCHEMA}"],
+                               check=True, stdout=subprocess.DEVNULL)
+
+            runs: dict[str, list[float]] = {"dry": [], "wet": [], "noop": []}
+            for _ in range(args.repeat):
+                reset()
+                # dry runs need the infra and registered applications to go through all steps
+                psql_run("init:wet")
+                psql_run("register:wet")
+                runs["dry"].append(psql_run("apply"))
+                runs["wet"].append(psql_run("apply:wet"))
+                runs["noop"].append(psql_run("apply:wet"))
+            subprocess.run(psql + ["-c", f"DROP SCHEMA {SCHEMA} CASCADE"], check=True, stdout=subprocess.DEVNULL)
+
+            result["psql"] = {phase: min(times) for phase, times in runs.items()}
+
+    return result
+
+def ints(s: str) -> list[int]:
+    """Parse comma-separated integers."""
+    return [int(i) for i in s.split(",")]
+
+def main():
+
+    ap = argparse.ArgumentParser(
+            prog="psv_bench.py",
+            description="Benchmark pg-schema-version generation and psql runs on synthetic steps.")
+    ap.add_argument("-n", "--steps", type=ints, default=[10, 100, 1000],
+                    help="comma-separated numbers of steps per application, default is 10,100,1000")
+    ap.add_argument("-m", "--apps", type=ints, default=[1],
+                    help="comma-separated numbers of applications, default is 1")
+    ap.add_argument("-b", "--body", type=ints, default=[100],
+                    help="comma-separated approximate step body sizes in bytes, default is 100")
+    ap.add_argument("-r", "--reverse", default=False, action="store_true",
+                    help="generate reverse steps as well")
+    ap.add_argument("-R", "--repeat", type=int, default=3,
+                    help="number of runs per configuration, best time is kept, default is 3")
+    ap.add_argument("--psv", type=str, default="pg-schema-version",
+                    help="psv command, default is 'pg-schema-version'")
+    ap.add_argument("--psv-opts", type=str, default="",
+                    help="additional psv generation options, e.g. '--functions'")
+    ap.add_argument("--psql", type=str, default="psql",
+                    help="psql command with options, default is 'psql'")
+    ap.add_argument("-d", "--db", type=str, default=None,
+                    help="database for psql runs, WILL have its psv_bench schema dropped, default is no runs")
+    ap.add_argument("-l", "--label", type=str, default=None,
+                    help="label for results, e.g. a version or commit")
+    ap.add_argument("-o", "--out", type=str, default="psv_bench.jsonl",
+                    help="JSON lines results file, appended, default is 'psv_bench.jsonl'")
+    args = ap.parse_args()
+
+    with open(args.out, "a") as out:
+        for apps in args.apps:
+            for steps in args.steps:
+                for body in args.body:
+                    result = bench(args, steps, apps, body)
+                    print(json.dumps(result), file=out, flush=True)
+                    gen = result["generation"]
+                    psql = " ".join(f"{k}={v:.3f}" for k, v in result.get("psql", {}).items())
+                    print(f"apps={apps} steps={steps} body={body}: "
+                          f"gen={gen['seconds']:.3f} s {gen['maxrss_kib']} KiB {gen['output_bytes']} B {psql}")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
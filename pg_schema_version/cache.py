@@ -0,0 +1,73 @@
+import json
+import os
+import threading
+import time
+
+from .utils import log
+
+
+class ScriptCache:
+    """Persistent cache of script headers, signatures and checks.
+
+    Entries are keyed by real path and only valid for the same inode, size,
+    modification time, hash algorithm and encoding.
+    """
+
+    VERSION = 8
+
+    # files modified more recently may still change within the same mtime
+    RACY_DELAY = 2.0
+
+    def __init__(self, path: str, size: int = 10000):
+        self._path = path
+        self._size = size
+        self._lock = threading.Lock()
+        self._entries: dict[str, dict] = {}
+        self._changed = False
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                if data["psv_cache"] != self.VERSION:
+                    raise ValueError(f"unexpected version {data['psv_cache']}")
+                self._entries = data["entries"]
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                log.warning(f"ignoring invalid cache {path}: {e}")
+                self._changed = True
+
+    def get(self, filename: str, stat, hasher: str, encoding: str) -> dict|None:
+        """Get valid cached fields for a file, if any."""
+        with self._lock:
+            entry = self._entries.get(os.path.realpath(filename))
+            if (entry is None or entry["stat"] != list(stat) or
+                entry["hash"] != hasher or entry["encoding"] != encoding):
+                return None
+            # hits only refresh the eviction order, which is saved on the next change
+            entry["used"] = time.time()
+            return entry["fields"]
+
+    def put(self, filename: str, stat, hasher: str, encoding: str, fields: dict):
+        """Store fields for a file."""
+        now = time.time()
+        if now - stat[2] / 1e9 < self.RACY_DELAY:
+            log.debug(f"not caching recently modified {filename}")
+            return
+        with self._lock:
+            self._entries[os.path.realpath(filename)] = {
+                "stat": list(stat), "hash": hasher, "encoding": encoding,
+                "fields": fields, "used": now,
+            }
+            self._changed = True
+
+    def save(self):
+        """Write cache if changed or too large, evicting least recently used entries."""
+        if not self._changed and len(self._entries) <= self._size:
+            return
+        if len(self._entries) > self._size:
+            kept = sorted(self._entries.items(), key=lambda i: i[1]["used"], reverse=True)
+            self._entries = dict(kept[:self._size])
+        tmp = f"{self._path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"psv_cache": self.VERSION, "entries": self._entries}, f)
+        os.replace(tmp, self._path)
+        self._changed = False
@@ -0,0 +1,215 @@
+import re
+from collections.abc import Callable
+
+# characters which may start a token of interest to the lexer or to psql
+SPECIAL = re.compile(r"""[-/'"$;\\]""")
+# identifier characters, which prevent E-strings and dollar quotes
+WORD = re.compile(r"[\w$]")
+
+# complete tokens, matched at once when available in the buffer
+COMPLETE = {
+    "line": re.compile(r"--[^\n]*\n"),
+    "block": re.compile(r"/\*[^*/]*(?:(?:\*+(?!/)|/(?!\*))[^*/]*)*\*+/"),
+    "string": re.compile(r"'[^']*(?:''[^']*)*'(?!')"),
+    "estring": re.compile(r"[eE]'[^'\\]*(?:(?:\\.|'')[^'\\]*)*'(?!')", re.DOTALL),
+    "ident": re.compile(r'"[^"]*(?:""[^"]*)*"(?!")'),
+    "dollar": re.compile(r"\$((?:[^\W\d]\w*)?)\$.*?\$\1\$", re.DOTALL),
+}
+DOLLAR_TAG = re.compile(r"\$(?:[^\W\d]\w*)?\$")
+
+# closing tokens within comments, strings and identifiers spanning chunks
+BLOCK = re.compile(r"/\*|\*/")
+STRING = re.compile(r"''|'")
+ESTRING = re.compile(r"\\.|''|'", re.DOTALL)
+IDENT = re.compile(r'""|"')
+
+# opening token length
+OPENING = {"line": 2, "block": 2, "string": 1, "estring": 2, "ident": 1}
+
+# unconsumed input kept between chunks, longer than any opening token, including dollar tags
+GUARD = 128
+# statement prefix kept for checks
+STATEMENT_PREFIX = 1024
+
+class Lexer:
+    """Streaming SQL lexer which reports statements and psql backslash commands.
+
+    Comments, string literals with their escapes, quoted identifiers and
+    dollar-quoted bodies are skipped, so that their contents are ignored.
+    Statements are reported with their starting line and a normalized prefix
+    where comments and literals are replaced by a space.
+    """
+
+    def __init__(self, statement: Callable[[str, int], None], backslash: Callable[[int], None]):
+        self._statement = statement
+        self._backslash = backslash
+        self._buf = ""
+        self._pos = 0
+        # lines are counted lazily up to _counted
+        self._line = 1
+        self._counted = 0
+        # code, line, block, string, estring, ident or dollar
+        self._state = "code"
+        self._depth = 0
+        self._tag = ""
+        # current statement prefix and starting line
+        self._stmt: list[str] = []
+        self._stmt_len = 0
+        self._stmt_line = 0
+
+    def _lineno(self) -> int:
+        """Line at the current position."""
+        self._line += self._buf.count("\n", self._counted, self._pos)
+        self._counted = self._pos
+        return self._line
+
+    def _code(self, end: int):
+        """Keep code up to end in the current statement prefix."""
+        if end <= self._pos:
+            return
+        if self._stmt_len < STATEMENT_PREFIX:
+            text = self._buf[self._pos:end]
+            if not self._stmt:
+                stripped = text.lstrip()
+                if not stripped:
+                    self._pos = end
+                    return
+                self._pos = end - len(stripped)
+                self._stmt_line = self._lineno()
+                text = stripped
+            self._stmt.append(text)
+            self._stmt_len += len(text)
+        self._pos = end
+
+    def _blank(self, end: int):
+        """Skip to end, with a placeholder in the current statement prefix, if started."""
+        if self._stmt and self._stmt_len < STATEMENT_PREFIX:
+            self._stmt.append(" ")
+            self._stmt_len += 1
+        self._pos = end
+
+    def _end_statement(self):
+        """Report the current statement, if any."""
+        if self._stmt:
+            self._statement(" ".join("".join(self._stmt)[:STATEMENT_PREFIX].split()), self._stmt_line)
+        self._stmt, self._stmt_len = [], 0
+
+    def _token(self, start: int, final: bool):
+        """Process code from a special character at start."""
+        buf = self._buf
+        char = buf[start]
+        # token beginning, before start for E-strings
+        begin, kind, tag = start, None, None
+        if char == "-":
+            kind = "line" if buf.startswith("--", start) else None
+        elif char == "/":
+            kind = "block" if buf.startswith("/*", start) else None
+        elif char == "'":
+            if start > 0 and buf[start - 1] in "eE" and (start < 2 or not WORD.match(buf, start - 2)):
+                begin, kind = start - 1, "estring"
+            else:
+                kind = "string"
+        elif char == '"':
+            kind = "ident"
+        elif char == "$" and (start == 0 or not WORD.match(buf, start - 1)):
+            tag = DOLLAR_TAG.match(buf, start)
+            kind = "dollar" if tag else None
+        self._code(start)
+        if char == ";":
+            self._pos = start + 1
+            self._end_statement()
+            return
+        if char == "\\":
+            self._backslash(self._lineno())
+            self._code(start + 1)
+            return
+        if kind is None:
+            self._code(start + 1)
+            return
+        m = COMPLETE[kind].match(buf, begin)
+        # a closing quote may be doubled in the next chunk
+        if m and (final or m.end() < len(buf)):
+            if kind == "ident":
+                # identifiers are kept for checks
+                self._code(m.end())
+            else:
+                self._blank(m.end())
+            return
+        self._state = kind
+        if tag:
+            self._tag = tag.group(0)
+            end = start + len(self._tag)
+        else:
+            end = begin + OPENING[kind]
+        if kind == "block":
+            self._depth = 1
+        if kind == "ident":
+            self._code(end)
+        else:
+            self._blank(end)
+
+    def _run(self, final: bool):
+        """Process buffered input, up to the guard unless final."""
+        buf = self._buf
+        limit = len(buf) if final else len(buf) - GUARD
+        while self._pos < limit:
+            state = self._state
+            if state == "code":
+                m = SPECIAL.search(buf, self._pos, limit)
+                if not m:
+                    self._code(limit)
+                    break
+                self._token(m.start(), final)
+            elif state == "line":
+                end = buf.find("\n", self._pos, limit)
+                if end < 0:
+                    self._pos = limit
+                    break
+                self._state = "code"
+                self._pos = end + 1
+            elif state == "block":
+                m = BLOCK.search(buf, self._pos)
+                if not m or m.start() >= limit:
+                    self._pos = limit
+                    break
+                self._depth += 1 if m.group(0) == "/*" else -1
+                if self._depth == 0:
+                    self._state = "code"
+                self._pos = m.end()
+            elif state == "dollar":
+                end = buf.find(self._tag, self._pos)
+                if end < 0 or end >= limit:
+                    self._pos = limit
+                    break
+                self._state = "code"
+                self._pos = end + len(self._tag)
+            else:
+                pattern = STRING if state == "string" else ESTRING if state == "estring" else IDENT
+                m = pattern.search(buf, self._pos)
+                if m and m.start() < limit:
+                    end = m.end()
+                    if len(m.group(0)) == 1:
+                        self._state = "code"
+                else:
+                    end = limit
+                if state == "ident":
+                    self._code(end)
+                else:
+                    self._pos = end
+        # keep two more characters for look-behinds
+        self._lineno()
+        keep = max(self._pos - 2, 0)
+        self._buf = buf[keep:]
+        self._pos -= keep
+        self._counted = self._pos
+
+    def feed(self, text: str):
+        """Process a chunk of input."""
+        self._buf += text
+        self._run(False)
+
+    def end(self) -> str|None:
+        """Process remaining input, return the unterminated state, if any."""
+        self._run(True)
+        self._end_statement()
+        return None if self._state in ("code", "line") else self._state
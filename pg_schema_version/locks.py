@@ -0,0 +1,216 @@
+import json
+import re
+import sys
+
+# postgres table lock modes, from weakest to strongest
+LOCKS = [
+    "ACCESS SHARE", "ROW SHARE", "ROW EXCLUSIVE", "SHARE UPDATE EXCLUSIVE",
+    "SHARE", "SHARE ROW EXCLUSIVE", "EXCLUSIVE", "ACCESS EXCLUSIVE",
+]
+AS, _, RE, SUE, S, SRE, E, AE = LOCKS
+# statements are reported from this lock
+REPORTED = LOCKS.index(SUE)
+# number of reported statements per step
+REPORTED_MAX = 100
+
+def lock_level(name: str) -> int:
+    """Lock level from a mode name such as 'share_update_exclusive', raise ValueError if unknown."""
+    return LOCKS.index(re.sub(r"[\s_-]+", " ", name.strip()).upper())
+
+def lock_option(level: int) -> str:
+    """Lock mode as a command line option value."""
+    return LOCKS[level].lower().replace(" ", "_")
+
+IDENT = r'(?:"(?:[^"]|"")*"|[\w$]+)'
+NAME = rf"{IDENT}(?:\.{IDENT})*"
+
+def _rule(pattern: str, lock: str, operation: str, rewrite: bool = False, warning: str|None = None):
+    """Compile a classification rule."""
+    return (re.compile(pattern.format(name=NAME), re.IGNORECASE), lock, operation, rewrite, warning)
+
+REWRITES = "rewrites the table"
+
+# statements by first matching pattern, with an optional target
+STATEMENTS = [
+    _rule(r"create (unique )?index concurrently (if not exists )?({name} )?on (only )?(?P<target>{name})",
+          SUE, "create index concurrently"),
+    _rule(r"create (unique )?index (if not exists )?({name} )?on (only )?(?P<target>{name})",
+          S, "create index", warning="blocks writes while building, use CONCURRENTLY"),
+    _rule(r"drop index concurrently\b", SUE, "drop index concurrently"),
+    _rule(r"drop index\b", AE, "drop index"),
+    _rule(r"reindex\b.*\bconcurrently\b", SUE, "reindex concurrently"),
+    _rule(r"reindex (\(.*?\) )?(index|table) (?P<target>{name})", S, "reindex",
+          warning="blocks writes while rebuilding, use CONCURRENTLY"),
+    _rule(r"vacuum (\([^)]*\bfull\b[^)]*\)|full( freeze| verbose| analyze)*)( (?P<target>{name}))?",
+          AE, "vacuum full", True, REWRITES),
+    _rule(r"vacuum\b", SUE, "vacuum"),
+    _rule(r"analy[sz]e\b", SUE, "analyze"),
+    _rule(r"cluster( verbose)?( (?P<target>{name}))?", AE, "cluster", True, REWRITES),
+    _rule(r"refresh materialized view concurrently (?P<target>{name})", E, "refresh materialized view concurrently"),
+    _rule(r"refresh materialized view (?P<target>{name})", AE, "refresh materialized view",
+          warning="blocks reads while refreshing, use CONCURRENTLY"),
+    _rule(r"truncate (table )?(only )?(?P<target>{name})", AE, "truncate"),
+    _rule(r"drop (table|view|materialized view|sequence) (if exists )?(?P<target>{name})", AE, "drop"),
+    _rule(r"create (or replace )?(constraint )?trigger \S+ .*?\bon (?P<target>{name})", SRE, "create trigger"),
+    _rule(r"drop trigger (if exists )?\S+ on (?P<target>{name})", AE, "drop trigger"),
+    _rule(r"create (or replace )?rule \S+ as on \w+ to (?P<target>{name})", AE, "create rule"),
+    _rule(r"(insert|update|delete|merge|copy|with)\b", RE, "dml"),
+    _rule(r"(select|table|values)\b", AS, "query"),
+]
+
+CREATE_TABLE = re.compile(
+    rf"create ((global |local )?(temporary |temp |unlogged ))?table (if not exists )?(?P<target>{NAME})", re.IGNORECASE)
+LOCK_TABLE = re.compile(rf"lock (table )?(only )?(?P<target>{NAME})(.*? in (?P<mode>[a-z ]+?) mode)?", re.IGNORECASE)
+ALTER_TABLE = re.compile(rf"alter table (if exists )?(only )?(?P<target>{NAME}) (?P<actions>.*)", re.IGNORECASE)
+
+# volatile column defaults which require a table rewrite, not an exhaustive list
+VOLATILE = re.compile(
+    r"\b(serial|bigserial|smallserial|generated always as \(|identity)\b|"
+    r"\bdefault\b.*\b(random|clock_timestamp|statement_timestamp|timeofday|gen_random_uuid|"
+    r"uuid_generate_v[14]|nextval)\s*\(", re.IGNORECASE)
+
+# alter table actions by first matching pattern
+ACTIONS = [
+    _rule(r"alter (column )?{name} (set data )?type\b", AE, "alter column type", True,
+          "may rewrite the table and its indexes"),
+    _rule(r"alter (column )?{name} set not null\b", AE, "set not null",
+          warning="scans the table unless a validated CHECK (column IS NOT NULL) constraint exists"),
+    _rule(r"alter (column )?{name} set (statistics|storage|compression)\b", SUE, "alter column storage"),
+    _rule(r"add (constraint {name} )?(primary key|unique)\b(?!.*\busing index\b)", AE, "add constraint",
+          warning="builds an index while blocking writes, use USING INDEX"),
+    _rule(r"add (constraint {name} )?exclude\b", AE, "add constraint",
+          warning="builds an index while blocking writes"),
+    _rule(r"add (constraint {name} )?foreign key\b(?!.*\bnot valid\b)", SRE, "add constraint",
+          warning="validates with a full scan, use NOT VALID then VALIDATE CONSTRAINT"),
+    _rule(r"add (constraint {name} )?check\b(?!.*\bnot valid\b)", AE, "add constraint",
+          warning="validates with a full scan, use NOT VALID then VALIDATE CONSTRAINT"),
+    _rule(r"add (constraint {name} )?foreign key\b", SRE, "add constraint"),
+    _rule(r"add (constraint {name} )?check\b", AE, "add constraint"),
+    _rule(r"add constraint\b|add (primary key|unique)\b", AE, "add constraint"),
+    _rule(r"add (column )?", AE, "add column"),
+    _rule(r"validate constraint\b", SUE, "validate constraint"),
+    _rule(r"set tablespace\b", AE, "set tablespace", True, REWRITES),
+    _rule(r"set (logged|unlogged)\b", AE, "set logged", True, REWRITES),
+    _rule(r"(set|reset) \(", SUE, "set storage parameters"),
+    _rule(r"cluster on\b", SUE, "cluster on"),
+    _rule(r"(enable|disable) (always |replica )?trigger\b", SRE, "enable trigger"),
+    _rule(r"attach partition\b", SUE, "attach partition"),
+    _rule(r"detach partition {name} concurrently\b", SUE, "detach partition concurrently"),
+    _rule(r"drop (column )?", AE, "drop"),
+    _rule(r"", AE, "alter table"),
+]
+
+def _normalize(name: str) -> str:
+    """Compare unquoted names case-insensitively."""
+    return name if '"' in name else name.lower()
+
+def _split(actions: str) -> list[str]:
+    """Split alter table actions on top-level commas."""
+    parts, depth, start = [], 0, 0
+    for i, c in enumerate(actions):
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "," and depth == 0:
+            parts.append(actions[start:i].strip())
+            start = i + 1
+    parts.append(actions[start:].strip())
+    return [p for p in parts if p]
+
+class LockAnalyzer:
+    """Classify the statements of a step by the table lock they take.
+
+    Statements are seen through their normalized prefix from the lexer.
+    Tables created in the same step are ignored, as nobody else uses them yet.
+    """
+
+    def __init__(self):
+        self._max = -1
+        self._statements: list[dict] = []
+        self._more = 0
+        self._created: set[str] = set()
+        self._validated: set[str] = set()
+
+    def _add(self, line: int, lock: str, operation: str, target: str|None, rewrite: bool, warning: str|None):
+        """Record a lock taken by a statement."""
+        if target and _normalize(target) in self._created:
+            return
+        level = LOCKS.index(lock)
+        self._max = max(self._max, level)
+        if level < REPORTED:
+            return
+        if len(self._statements) >= REPORTED_MAX:
+            self._more += 1
+            return
+        self._statements.append({"line": line, "lock": lock, "operation": operation, "target": target,
+                                 "rewrite": rewrite, "warning": warning})
+
+    def statement(self, statement: str, line: int):
+        """Analyze a statement."""
+        if m := CREATE_TABLE.match(statement):
+            self._created.add(_normalize(m.group("target")))
+        elif m := ALTER_TABLE.match(statement):
+            target = m.group("target")
+            for action in _split(m.group("actions")):
+                # the last catch-all rule always matches
+                _, lock, operation, rewrite, warning = next(rule for rule in ACTIONS if rule[0].match(action))
+                if operation == "add column" and VOLATILE.search(action):
+                    rewrite, warning = True, "adds a column with a volatile default, which " + REWRITES
+                elif operation == "set not null" and _normalize(target) in self._validated:
+                    warning = None
+                elif operation == "validate constraint":
+                    self._validated.add(_normalize(target))
+                self._add(line, lock, operation, target, rewrite, warning)
+        elif m := LOCK_TABLE.match(statement):
+            mode = (m.group("mode") or AE).upper()
+            self._add(line, mode if mode in LOCKS else AE, "lock table", m.group("target"), False, None)
+        else:
+            for pattern, lock, operation, rewrite, warning in STATEMENTS:
+                if m := pattern.match(statement):
+                    target = m.groupdict().get("target")
+                    self._add(line, lock, operation, target, rewrite, warning)
+                    break
+
+    def report(self) -> dict:
+        """Step lock analysis, for caching and reporting."""
+        return {"max": LOCKS[self._max] if self._max >= 0 else None,
+                "statements": self._statements, "more": self._more}
+
+def lock_report(steps: dict[str, list]) -> dict:
+    """Build lock analysis report of all steps, in order."""
+    levels = [LOCKS.index(s._locks["max"]) for app_steps in steps.values()
+              for s in app_steps if s._locks["max"]]
+    return {
+        "psv_locks": 1,
+        "max": LOCKS[max(levels)] if levels else None,
+        "steps": [{
+            "app": app,
+            "version": s._version,
+            "operation": s._operation(),
+            "filename": s._filename,
+            "transaction": not s._notx(),
+            **s._locks,
+        } for app, app_steps in steps.items() for s in app_steps],
+    }
+
+def show_locks(report: dict, out=sys.stderr):
+    """Show human-readable lock analysis."""
+    print(f"psv locks: {len(report['steps'])} steps, strongest lock {report['max'] or 'none'}", file=out)
+    for step in report["steps"]:
+        tx = "" if step["transaction"] else " (no transaction)"
+        print(f"  {step['app']} {step['operation']} {step['version']} {step['filename']}: "
+              f"{step['max'] or 'none'}{tx}", file=out)
+        for stmt in step["statements"]:
+            target = f" {stmt['target']}" if stmt["target"] else ""
+            rewrite = " REWRITE" if stmt["rewrite"] else ""
+            warning = f": {stmt['warning']}" if stmt["warning"] else ""
+            print(f"    line {stmt['line']}: {stmt['lock']} {stmt['operation']}{target}{rewrite}{warning}", file=out)
+        if step["more"]:
+            print(f"    … and {step['more']} more", file=out)
+
+def save_locks(report: dict, path: str):
+    """Write lock analysis as JSON."""
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
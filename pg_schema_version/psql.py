@@ -1,15 +1,142 @@
 # psql script parts for psv
 # programming with "if boolean_variable" without logical operators is so fun!
 
+# step bookkeeping functions, on a status table or view given as an argument
+STEP_FUNCTIONS = r"""
+    -- record an applied or caught-up step, with metrics if it was executed
+    CREATE OR REPLACE FUNCTION :"psv_fn_schema".:"psv_applied"(
+        status REGCLASS, app TEXT, version INTEGER, signature TEXT,
+        chain TEXT, filename TEXT, description TEXT, command TEXT,
+        started TIMESTAMP, lsn PG_LSN)
+      RETURNS VOID LANGUAGE plpgsql AS $psv$
+      BEGIN
+        EXECUTE format('INSERT INTO %s(app, version, signature, chain, filename, description, command, '
+                       'started, finished, wal_bytes, pid) '
+                       'VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)', status)
+          USING app, version, signature, NULLIF(chain, ''), filename, description, command,
+                started, CASE WHEN started IS NOT NULL THEN clock_timestamp() END,
+                pg_wal_lsn_diff(pg_current_wal_insert_lsn(), lsn)::BIGINT,
+                CASE WHEN started IS NOT NULL THEN pg_backend_pid() END;
+      END;
+      $psv$;
+    -- record a reversed step, the chain is ignored
+    CREATE OR REPLACE FUNCTION :"psv_fn_schema".:"psv_reversed"(
+        status REGCLASS, app TEXT, version INTEGER, signature TEXT,
+        chain TEXT, filename TEXT, description TEXT, command TEXT,
+        started TIMESTAMP, lsn PG_LSN)
+      RETURNS VOID LANGUAGE plpgsql AS $psv$
+      BEGIN
+        EXECUTE format('UPDATE %s SET active = FALSE '
+                       'WHERE app = $1 AND version = $2 AND active', status)
+          USING app, version;
+        EXECUTE format('INSERT INTO %s(app, version, signature, filename, description, command, active, '
+                       'started, finished, wal_bytes, pid) '
+                       'VALUES ($1, $2, $3, $4, $5, $6, FALSE, $7, $8, $9, $10)', status)
+          USING app, version, signature, filename, description, command,
+                started, CASE WHEN started IS NOT NULL THEN clock_timestamp() END,
+                pg_wal_lsn_diff(pg_current_wal_insert_lsn(), lsn)::BIGINT,
+                CASE WHEN started IS NOT NULL THEN pg_backend_pid() END;
+      END;
+      $psv$;
+"""
+
+# step metrics columns, added to the status and history tables
+STEP_METRICS = r"""
+        ADD COLUMN started TIMESTAMP DEFAULT NULL,
+        ADD COLUMN finished TIMESTAMP DEFAULT NULL,
+        ADD COLUMN wal_bytes BIGINT DEFAULT NULL,
+        ADD COLUMN pid INTEGER DEFAULT NULL;
+"""
+
+# batch step progress, and batch loop procedure which commits after each batch
+BATCH_INFRA = r"""
+      CREATE TABLE :"psv_schema".:"psv_progress"(
+        app TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        signature TEXT NOT NULL,
+        last_key TEXT DEFAULT NULL,
+        rows BIGINT NOT NULL DEFAULT 0,
+        batches INTEGER NOT NULL DEFAULT 0,
+        started TIMESTAMP NOT NULL DEFAULT clock_timestamp(),
+        updated TIMESTAMP NOT NULL DEFAULT clock_timestamp(),
+        PRIMARY KEY (app, version)
+      );
+      -- procedures appeared with postgres 11
+      SELECT :SERVER_VERSION_NUM >= 110000 AS psv_pg_procedure \gset
+      \if :psv_pg_procedure
+      -- run stmt with last key $1 and batch size $2 until it returns no rows,
+      -- resuming from recorded progress unless the step changed
+      CREATE PROCEDURE :"psv_schema".:"psv_batch"(
+          progress REGCLASS, app TEXT, version INTEGER, signature TEXT, size INTEGER, stmt TEXT)
+        LANGUAGE plpgsql AS $psv$
+        DECLARE
+          last_key TEXT;
+          n BIGINT;
+          k TEXT;
+        BEGIN
+          EXECUTE format('DELETE FROM %s WHERE app = $1 AND version = $2 AND signature <> $3', progress)
+            USING app, version, signature;
+          EXECUTE format('INSERT INTO %s(app, version, signature) VALUES ($1, $2, $3) '
+                         'ON CONFLICT DO NOTHING', progress)
+            USING app, version, signature;
+          EXECUTE format('SELECT last_key FROM %s WHERE app = $1 AND version = $2', progress)
+            INTO last_key
+            USING app, version;
+          COMMIT;
+          stmt := rtrim(stmt, E' \t\r\n;');
+          LOOP
+            EXECUTE format(E'WITH psv_batch(key) AS (%s\n) SELECT COUNT(*), MAX(key)::TEXT FROM psv_batch', stmt)
+              INTO n, k
+              USING last_key, size;
+            EXIT WHEN n = 0;
+            last_key := k;
+            EXECUTE format('UPDATE %s SET last_key = $3, rows = rows + $4, batches = batches + 1, '
+                           'updated = clock_timestamp() WHERE app = $1 AND version = $2', progress)
+              USING app, version, last_key, n;
+            COMMIT;
+          END LOOP;
+        END;
+        $psv$;
+      \endif
+"""
+
+# wait for other long transactions holding relation locks, return how many are left
+PREFLIGHT_FUNCTION = r"""
+  CREATE OR REPLACE FUNCTION pg_temp.psv_preflight(age INTERVAL, timeout INTERVAL)
+    RETURNS INTEGER LANGUAGE plpgsql AS $psv$
+    DECLARE
+      deadline TIMESTAMPTZ := clock_timestamp() + timeout;
+      pause FLOAT := 0.1;
+      busy INTEGER;
+    BEGIN
+      LOOP
+        -- activity is otherwise frozen for the transaction
+        PERFORM pg_stat_clear_snapshot();
+        SELECT COUNT(DISTINCT a.pid) INTO busy
+          FROM pg_catalog.pg_stat_activity AS a
+          JOIN pg_catalog.pg_locks AS l ON l.pid = a.pid
+          WHERE a.pid <> pg_backend_pid()
+            AND a.datname = current_database()
+            AND a.backend_type = 'client backend'
+            AND a.xact_start < clock_timestamp() - age
+            AND l.locktype = 'relation';
+        EXIT WHEN busy = 0 OR clock_timestamp() >= deadline;
+        PERFORM pg_sleep(LEAST(pause, EXTRACT(EPOCH FROM deadline - clock_timestamp())));
+        pause := LEAST(pause * 2, 10.0);
+      END LOOP;
+      RETURN busy;
+    END;
+    $psv$;
+"""
+
 APP_VERSION = r"""
 \if :psv_no_infra
   \echo # psv skipping showing :psv_app version, no infra
 \else
   --- show target app version if available
   SELECT MAX(version) AS psv_app_version
-    FROM PsvAppStatus
+    FROM PsvAppHead
     WHERE app = :'psv_app'
-      AND active
     \gset
   \if :{{?psv_app_version}}
     \echo # psv :psv_app version: :psv_app_version
@@ -20,6 +147,30 @@ APP_VERSION = r"""
 \endif
 """
 
+# move inactive rows of the applications, or all of them on compact, to history partitions
+COMPACT = r"""
+  -- create yearly history partitions as needed
+  SELECT
+    format('CREATE TABLE IF NOT EXISTS %I.%I PARTITION OF %I.%I FOR VALUES FROM (%L) TO (%L)',
+      :'psv_schema', :'psv_history' || '_' || year, :'psv_schema', :'psv_history',
+      make_date(year, 1, 1), make_date(year + 1, 1, 1)),
+    format('CREATE INDEX IF NOT EXISTS %I ON %I.%I(app, created)',
+      :'psv_history' || '_' || year || '_ac', :'psv_schema', :'psv_history' || '_' || year)
+    FROM (SELECT DISTINCT EXTRACT(YEAR FROM created)::INT AS year
+            FROM :"psv_schema".:"psv_table"
+            WHERE NOT active
+              AND (app = ANY(:'psv_apps'::TEXT[]) OR :'psv_cmd' = 'compact')) AS years
+    \gexec
+  -- append-only history, columns are kept in the same order
+  WITH moved AS (
+    DELETE FROM :"psv_schema".:"psv_table"
+      WHERE NOT active
+        AND (app = ANY(:'psv_apps'::TEXT[]) OR :'psv_cmd' = 'compact')
+      RETURNING *)
+  INSERT INTO :"psv_schema".:"psv_history"
+    SELECT * FROM moved;
+"""
+
 SCRIPT_HEADER = r"""--
 --      _ __  _____   __
 --     | '_ \/ __\ \ / /
@@ -40,8 +191,8 @@ SCRIPT_HEADER = r"""--
 -- Control the script behavior by setting psql-variable "psv",
 -- with the full format command:version:moisture.
 --
--- Available commands: init, register, apply (default), create, status, history, unregister, remove, help, catchup.
--- Available moistures: dry (default), wet.
+-- Available commands: init, register, apply (default), create, status, history, unregister, remove, help, catchup, compact.
+-- Available moistures: dry (default), rehearse, wet.
 -- Version is the target version, default is latest.
 
 -- any error will stop the script immediately
@@ -58,10 +209,26 @@ SELECT :SERVER_VERSION_NUM < 100000 AS psv_pg_ko \gset
 -- psv infra names
 \set psv_schema {schema}
 \set psv_table {table}
+SELECT
+  :'psv_table' || '_history' AS psv_history,
+  :'psv_table' || '_head' AS psv_head,
+  :'psv_table' || '_head_update' AS psv_head_update,
+  :'psv_table' || '_applied' AS psv_applied,
+  :'psv_table' || '_reversed' AS psv_reversed,
+  :'psv_table' || '_progress' AS psv_progress,
+  :'psv_table' || '_batch' AS psv_batch
+  \gset
 
--- application name taken from scripts, but can be overriden with -v psv_app=…
+-- application names taken from scripts, but a single one can be overriden with -v psv_app=…
+\set psv_apps {apps}
 \if :{{?psv_app}}
+  \if {multi}
+    \warn # ERROR psv cannot override application name with several applications
+    \quit
+  \endif
   \warn # WARN application name overriden to :psv_app
+  \set psv_app_override 1
+  SELECT '{{' || :'psv_app' || '}}' AS psv_apps \gset
 \else
   \set psv_app {app}
 \endif
@@ -74,6 +241,39 @@ SELECT :SERVER_VERSION_NUM < 100000 AS psv_pg_ko \gset
   \set psv_debug 0
 \endif
 
+-- concurrent runs coordination: wait (default), nowait or none
+\if :{{?psv_lock}}
+  -- lock set from command line
+\else
+  \set psv_lock wait
+\endif
+
+-- move inactive status of the applications to history at the end of wet runs, default is off
+\if :{{?psv_compact}}
+\else
+  \set psv_compact 0
+\endif
+
+-- default step timeouts, overriden by step header directives, default is the session setting
+\if :{{?psv_lock_timeout}}
+\else
+  \set psv_lock_timeout ''
+\endif
+\if :{{?psv_statement_timeout}}
+\else
+  \set psv_statement_timeout ''
+\endif
+
+-- preflight: wait for long transactions older than this before executing steps, default is none
+\if :{{?psv_preflight}}
+\else
+  \set psv_preflight ''
+\endif
+\if :{{?psv_preflight_timeout}}
+\else
+  \set psv_preflight_timeout 5min
+\endif
+
 -- command to execute
 \if :{{?psv}}
   -- psv set from command line
@@ -86,14 +286,14 @@ SELECT :SERVER_VERSION_NUM < 100000 AS psv_pg_ko \gset
 -- split command, version and moisture
 SELECT
   CASE
-    WHEN :'psv' ~ '^[a-z]+(:(\d+|latest))?(:(dry|wet))?$' THEN FALSE
-    WHEN :'psv' ~ '^(\d+|latest)(:(dry|wet))?$' THEN FALSE
-    WHEN :'psv' ~ '^(dry|wet)$' THEN FALSE
+    WHEN :'psv' ~ '^[a-z]+(:(\d+|latest))?(:(dry|rehearse|wet))?$' THEN FALSE
+    WHEN :'psv' ~ '^(\d+|latest)(:(dry|rehearse|wet))?$' THEN FALSE
+    WHEN :'psv' ~ '^(dry|rehearse|wet)$' THEN FALSE
     ELSE TRUE
   END AS psv_cmd_ko,
   CASE
-    WHEN :'psv' ~ '^(\d+|latest)(:(dry|wet))?$' THEN 'apply'
-    WHEN :'psv' ~ '^(dry|wet)$' THEN 'apply'
+    WHEN :'psv' ~ '^(\d+|latest)(:(dry|rehearse|wet))?$' THEN 'apply'
+    WHEN :'psv' ~ '^(dry|rehearse|wet)$' THEN 'apply'
     WHEN :'psv' ~ ':' THEN SPLIT_PART(:'psv', ':', 1)
     ELSE :'psv'
   END AS psv_cmd,
@@ -105,8 +305,9 @@ SELECT
   END AS psv_cmd_version,
   CASE
     WHEN :'psv' ~ ':dry$' THEN 'dry'
+    WHEN :'psv' ~ ':rehearse$' THEN 'rehearse'
     WHEN :'psv' ~ ':wet$' THEN 'wet'
-    WHEN :'psv' ~ '^(dry|wet)$' THEN :'psv'
+    WHEN :'psv' ~ '^(dry|rehearse|wet)$' THEN :'psv'
     ELSE 'dry'
   END AS psv_mst
   \gset
@@ -130,7 +331,8 @@ SELECT
   -- check command validity
   :'psv_cmd' NOT IN ('init', 'register', 'apply',
       'reverse', 'create', 'status', 'help', 'history',
-      'unregister', 'remove', 'catchup')                   AS psv_bad_cmd,
+      'unregister', 'remove', 'catchup', 'compact',
+      'summary')                                           AS psv_bad_cmd,
 
   -- whether to initialize the infra if needed
   :'psv_cmd' IN ('create', 'init', 'catchup')              AS psv_do_init,
@@ -142,6 +344,10 @@ SELECT
   :'psv_cmd' IN ('status')                                 AS psv_do_status,
   -- whether to show application history
   :'psv_cmd' IN ('history')                                AS psv_do_history,
+  -- whether to show application step metrics summary
+  :'psv_cmd' IN ('summary')                                AS psv_do_summary,
+  -- whether to move inactive rows to history
+  :'psv_cmd' IN ('compact')                                AS psv_do_compact,
   -- whether to execute any step
   :'psv_cmd' IN ('create', 'apply', 'catchup', 'reverse')  AS psv_do_steps,
   -- whether to execute forward steps
@@ -156,25 +362,43 @@ SELECT
   :'psv_cmd' IN ('help')                                   AS psv_do_help,
 
   -- check moisture validity
-  :'psv_mst' NOT IN ('dry', 'wet')                         AS psv_bad_mst,
-
-  -- dry run ?
-  :'psv_mst' = 'dry'                                       AS psv_dry
+  :'psv_mst' NOT IN ('dry', 'rehearse', 'wet')             AS psv_bad_mst,
+
+  -- dry run ? changes are operated on a temporary copy
+  :'psv_mst' IN ('dry', 'rehearse')                        AS psv_dry,
+  -- whether steps are only simulated
+  :'psv_mst' = 'dry'                                       AS psv_simulate,
+  -- whether steps are executed within a transaction which is rolled back
+  :'psv_mst' = 'rehearse'                                  AS psv_rehearse,
+
+  -- check lock validity
+  :'psv_lock' NOT IN ('wait', 'nowait', 'none')            AS psv_bad_lock,
+  -- whether to lock applications, only when changes may occur
+  :'psv_mst' IN ('rehearse', 'wet') AND :'psv_lock' <> 'none' AND
+    :'psv_cmd' NOT IN ('status', 'history', 'summary', 'help') AS psv_do_lock,
+  -- whether to give up if applications are already locked
+  :'psv_lock' = 'nowait'                                   AS psv_lock_nowait
   \gset
 
 -- check that command is valid
 \if :psv_bad_cmd
-  \warn # ERROR psv unexpected command :psv_cmd, expecting: init register apply create status remove help catchup
+  \warn # ERROR psv unexpected command :psv_cmd, expecting: init register apply create status remove help catchup compact history summary
   \quit
 \endif
 \unset psv_bad_cmd
 
 \if :psv_bad_mst
-  \warn # ERROR psv unexpected moisture :psv_mst, expecting: dry wet
+  \warn # ERROR psv unexpected moisture :psv_mst, expecting: dry rehearse wet
   \quit
 \endif
 \unset psv_bad_mst
 
+\if :psv_bad_lock
+  \warn # ERROR psv unexpected lock :psv_lock, expecting: wait nowait none
+  \quit
+\endif
+\unset psv_bad_lock
+
 -- show help, whether dry or wet!
 \if :psv_do_help
   \echo # psql schema creation script for application {app}
@@ -184,10 +408,16 @@ SELECT
   \echo #   apply (execute needed forward steps, the default), status (show),
   \echo #   reverse (execute backward steps), unregister (remove app from versioning system),
   \echo #   remove (drop infra), help (this help); create stands for init + register + apply.
+  \echo #   history (show application changes), compact (move inactive status to history),
+  \echo #   summary (show application step metrics).
   \echo #
   \echo # version: target version, default is latest.
   \echo #
-  \echo # moistures: dry (default, just tell what will be done), wet (do it!).
+  \echo # moistures: dry (default, just tell what will be done), wet (do it!),
+  \echo #   rehearse (execute steps and report their metrics, then roll back).
+  \echo #
+  \echo # concurrent wet or rehearse runs are serialized per application, use "-v psv_lock=nowait"
+  \echo # to give up at once if another run holds the lock, or "none" to skip locking.
   \echo #
   \echo # example: psql -v psv=create -f acme.sql
   \echo #
@@ -195,12 +425,60 @@ SELECT
   \quit
 \endif
 
-\if :psv_dry
+\if :psv_rehearse
+  \echo # psv rehearse :psv_cmd for :psv_app on :psv_database, steps are rolled back
+\elif :psv_dry
   \echo # psv dry :psv_cmd for :psv_app on :psv_database, enable with -v psv=:psv_cmd::psv_cmd_version_display:wet
 \else
   \echo # psv wet :psv_cmd for :psv_app on :psv_database
 \endif
 
+--
+-- LOCK
+--
+-- Session advisory locks keyed on the psv table and application names,
+-- taken in a consistent order to avoid deadlocks between multi-application
+-- scripts. As all status are read afterwards, a run which waited for the
+-- lock only sees and does what is left by the previous holder.
+--
+\if :psv_do_lock
+
+  \if :psv_debug
+    \echo # DEBUG - LOCK
+  \endif
+
+  \if :psv_lock_nowait
+    SELECT NOT BOOL_AND(pg_try_advisory_lock(key1, key2)) AS psv_busy
+      FROM (SELECT DISTINCT hashtext(:'psv_schema' || '.' || :'psv_table') AS key1, hashtext(app) AS key2
+            FROM UNNEST(:'psv_apps'::TEXT[]) AS app
+            ORDER BY 1, 2) AS keys
+      \gset
+    \if :psv_busy
+      \warn # BUSY psv :psv_app is locked by another run, giving up
+      -- fail so that psql exits with status 3, the session locks go with it
+      \set ON_ERROR_STOP on
+      DO $$ BEGIN RAISE EXCEPTION 'psv application is locked by another run' USING ERRCODE = 'object_in_use'; END $$;
+    \endif
+    \unset psv_busy
+  \else
+    \echo # psv waiting for :psv_app lock
+    SELECT COUNT(*) AS psv_locked
+      FROM (SELECT pg_advisory_lock(key1, key2)
+            FROM (SELECT DISTINCT hashtext(:'psv_schema' || '.' || :'psv_table') AS key1, hashtext(app) AS key2
+                  FROM UNNEST(:'psv_apps'::TEXT[]) AS app
+                  ORDER BY 1, 2) AS keys) AS locks
+      \gset
+    \unset psv_locked
+  \endif
+  \echo # psv locked :psv_app
+
+\endif
+
+SELECT :'psv_preflight' <> '' AS psv_do_preflight \gset
+\if :psv_do_preflight
+""" + PREFLIGHT_FUNCTION + r"""
+\endif
+
 --
 -- REMOVE
 --
@@ -213,7 +491,19 @@ SELECT
   \if :psv_dry
     \echo # psv will drop its infra if it exists
   \else
-    DROP TABLE IF EXISTS :"psv_schema".:"psv_table";
+    BEGIN;
+      DROP TABLE IF EXISTS :"psv_schema".:"psv_history";
+      DROP TABLE IF EXISTS :"psv_schema".:"psv_table";
+      DROP FUNCTION IF EXISTS :"psv_schema".:"psv_head_update"();
+      DROP TABLE IF EXISTS :"psv_schema".:"psv_head";
+      DROP FUNCTION IF EXISTS :"psv_schema".:"psv_applied"(REGCLASS, TEXT, INTEGER, TEXT, TEXT, TEXT, TEXT, TEXT, TIMESTAMP, PG_LSN);
+      DROP FUNCTION IF EXISTS :"psv_schema".:"psv_reversed"(REGCLASS, TEXT, INTEGER, TEXT, TEXT, TEXT, TEXT, TEXT, TIMESTAMP, PG_LSN);
+      DROP TABLE IF EXISTS :"psv_schema".:"psv_progress";
+      SELECT format('DROP PROCEDURE IF EXISTS %I.%I(REGCLASS, TEXT, INTEGER, TEXT, INTEGER, TEXT)',
+                    :'psv_schema', :'psv_batch')
+        WHERE :SERVER_VERSION_NUM >= 110000
+        \gexec
+    COMMIT;
   \endif
   -- bye bye, nothing else to do!
   \quit
@@ -253,6 +543,7 @@ SELECT COUNT(*) = 0 AS psv_no_infra
          \endif
       \endif
       -- always quit without infra anyway
+      \echo # psv :psv_mst :psv_cmd for :psv_app done
       \quit
     \else
       -- wet run, do the job!
@@ -319,6 +610,39 @@ SELECT COUNT(*) = 0 AS psv_no_infra
   \endif
 \endif
 
+--
+-- INFRA VERSION, upgraded later if needed
+--
+-- psv infra versions are recorded as psv application versions:
+-- 0: initial status table
+-- 1: chained signatures
+-- 2: history table for inactive status
+-- 3: head table with the current status of each application
+-- 4: step bookkeeping functions
+-- 5: step metrics
+-- 6: batch step progress
+SELECT COALESCE(MAX(version), 0) AS psv_infra_version
+  FROM :"psv_schema".:"psv_table"
+  WHERE app = 'psv'
+    AND active
+  \gset
+
+SELECT
+  :psv_infra_version > 6 AS psv_infra_ko,
+  :psv_infra_version < 1 AS psv_infra_upgrade_1,
+  :psv_infra_version < 2 AS psv_infra_upgrade_2,
+  :psv_infra_version < 3 AS psv_infra_upgrade_3,
+  :psv_infra_version < 4 AS psv_infra_upgrade_4,
+  :psv_infra_version < 5 AS psv_infra_upgrade_5,
+  :psv_infra_version < 6 AS psv_infra_upgrade_6
+  \gset
+
+-- self check for possible future upgrades
+\if :psv_infra_ko
+  \warn # ERROR unexpected psv version :psv_infra_version
+  \quit
+\endif
+
 --
 -- STATUS
 --
@@ -336,6 +660,7 @@ SELECT COUNT(*) = 0 AS psv_no_infra
       \if :psv_dry
         \echo # psv will show all application status
         -- nothing else to do
+        \echo # psv :psv_mst :psv_cmd for :psv_app done
         \quit
       -- else proceed below
       \endif
@@ -349,88 +674,343 @@ SELECT COUNT(*) = 0 AS psv_no_infra
   -- show all app versions
   \echo # psv all applications status
 
-  WITH app_version AS (
-    SELECT app, MAX(version) AS version
-      FROM :"psv_schema".:"psv_table"
+  \if :psv_infra_upgrade_3
+    -- no head table yet
+    WITH app_version AS (
+      SELECT app, MAX(version) AS version
+        FROM :"psv_schema".:"psv_table"
+        WHERE active
+        GROUP BY 1)
+    SELECT app, version, description
+      FROM app_version
+      JOIN :"psv_schema".:"psv_table" USING (app, version)
       WHERE active
-      GROUP BY 1)
-  SELECT app, version, description
-    FROM app_version
-    JOIN :"psv_schema".:"psv_table" USING (app, version)
-    WHERE active
-    ORDER BY 1;
+      ORDER BY 1;
+  \else
+    SELECT app, version, description
+      FROM :"psv_schema".:"psv_head"
+      ORDER BY 1;
+  \endif
   \quit
 
 \endif
 
 --
--- HISTORY
+-- setup dry run, changes are operated on a temporary copy
 --
+\if :psv_dry
+  -- copy of the application active status, which is all the run reads or changes
+  CREATE TEMPORARY TABLE PsvAppStatus
+    AS SELECT *
+      FROM :"psv_schema".:"psv_table"
+      WHERE app = ANY(:'psv_apps'::TEXT[])
+        AND active;
+  -- simulate upgrades on the copy
+  \if :psv_infra_upgrade_1
+    \echo # psv will upgrade infra to version 1
+    ALTER TABLE PsvAppStatus
+      ADD COLUMN chain TEXT DEFAULT NULL;
+    INSERT INTO PsvAppStatus(app, version, signature, description, command)
+      VALUES ('psv', 1, 'psv infra 1', 'chained signatures', 'upgrade');
+  \endif
+  \if :psv_infra_upgrade_2
+    \echo # psv will upgrade infra to version 2
+    INSERT INTO PsvAppStatus(app, version, signature, description, command)
+      VALUES ('psv', 2, 'psv infra 2', 'history table', 'upgrade');
+  \endif
+  \if :psv_infra_upgrade_3
+    \echo # psv will upgrade infra to version 3
+    INSERT INTO PsvAppStatus(app, version, signature, description, command)
+      VALUES ('psv', 3, 'psv infra 3', 'head table', 'upgrade');
+  \endif
+  \if :psv_infra_upgrade_4
+    \echo # psv will upgrade infra to version 4
+    INSERT INTO PsvAppStatus(app, version, signature, description, command)
+      VALUES ('psv', 4, 'psv infra 4', 'step functions', 'upgrade');
+  \endif
+  \if :psv_infra_upgrade_5
+    \echo # psv will upgrade infra to version 5
+    ALTER TABLE PsvAppStatus
+""" + STEP_METRICS + r"""
+    INSERT INTO PsvAppStatus(app, version, signature, description, command)
+      VALUES ('psv', 5, 'psv infra 5', 'step metrics', 'upgrade');
+    -- current functions are not available, use session functions instead
+    \set psv_fn_schema pg_temp
+""" + STEP_FUNCTIONS + r"""
+  \else
+    \set psv_fn_schema :psv_schema
+  \endif
+  \if :psv_infra_upgrade_6
+    \echo # psv will upgrade infra to version 6
+    INSERT INTO PsvAppStatus(app, version, signature, description, command)
+      VALUES ('psv', 6, 'psv infra 6', 'batch progress', 'upgrade');
+  \endif
+  -- same partial indexes as the infra, and statistics for the planner
+  CREATE UNIQUE INDEX ON PsvAppStatus(app, version) WHERE active;
+  CREATE UNIQUE INDEX ON PsvAppStatus(signature) WHERE active;
+  ANALYZE PsvAppStatus;
+  -- current status of applications
+  CREATE TEMPORARY VIEW PsvAppHead
+    AS SELECT DISTINCT ON (app)
+         app, version, signature, chain, description, created AS updated
+      FROM PsvAppStatus
+      WHERE active
+      ORDER BY app, version DESC;
+\else
+  \if :psv_infra_upgrade_1
+    \echo # psv upgrading infra to version 1
+    BEGIN;
+      ALTER TABLE :"psv_schema".:"psv_table"
+        ADD COLUMN chain TEXT DEFAULT NULL;
+      INSERT INTO :"psv_schema".:"psv_table"(app, version, signature, description, command)
+        VALUES ('psv', 1, 'psv infra 1', 'chained signatures', 'upgrade');
+    COMMIT;
+  \endif
+  \if :psv_infra_upgrade_2
+    \echo # psv upgrading infra to version 2
+    BEGIN;
+      -- partitioned by creation time, partitions are created on compaction
+      CREATE TABLE :"psv_schema".:"psv_history"
+        (LIKE :"psv_schema".:"psv_table")
+        PARTITION BY RANGE (created);
+      INSERT INTO :"psv_schema".:"psv_table"(app, version, signature, description, command)
+        VALUES ('psv', 2, 'psv infra 2', 'history table', 'upgrade');
+    COMMIT;
+  \endif
+  \if :psv_infra_upgrade_3
+    \echo # psv upgrading infra to version 3
+    BEGIN;
+      -- current status of each application, maintained by a trigger
+      CREATE TABLE :"psv_schema".:"psv_head"(
+        app TEXT PRIMARY KEY,
+        version INTEGER NOT NULL,
+        signature TEXT DEFAULT NULL,
+        chain TEXT DEFAULT NULL,
+        description TEXT DEFAULT NULL,
+        updated TIMESTAMP NOT NULL DEFAULT NOW()
+      );
+      INSERT INTO :"psv_schema".:"psv_head"(app, version, signature, chain, description, updated)
+        SELECT DISTINCT ON (app) app, version, signature, chain, description, created
+          FROM :"psv_schema".:"psv_table"
+          WHERE active
+          ORDER BY app, version DESC;
+      -- recompute the head of a changed application, with the head table as argument
+      CREATE FUNCTION :"psv_schema".:"psv_head_update"() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $psv$
+        BEGIN
+          EXECUTE format('DELETE FROM %I.%I WHERE app = $1',
+                         TG_TABLE_SCHEMA, TG_ARGV[0])
+            USING NEW.app;
+          EXECUTE format('INSERT INTO %I.%I(app, version, signature, chain, description) '
+                         'SELECT app, version, signature, chain, description FROM %I.%I '
+                         'WHERE app = $1 AND active ORDER BY version DESC LIMIT 1',
+                         TG_TABLE_SCHEMA, TG_ARGV[0], TG_TABLE_SCHEMA, TG_TABLE_NAME)
+            USING NEW.app;
+          RETURN NULL;
+        END;
+        $psv$;
+      CREATE TRIGGER :"psv_head_update"
+        AFTER INSERT OR UPDATE ON :"psv_schema".:"psv_table"
+        FOR EACH ROW EXECUTE PROCEDURE :"psv_schema".:"psv_head_update"(:'psv_head');
+      INSERT INTO :"psv_schema".:"psv_table"(app, version, signature, description, command)
+        VALUES ('psv', 3, 'psv infra 3', 'head table', 'upgrade');
+    COMMIT;
+  \endif
+  \set psv_fn_schema :psv_schema
+  \if :psv_infra_upgrade_4
+    \echo # psv upgrading infra to version 4
+    BEGIN;
+""" + STEP_FUNCTIONS + r"""
+      INSERT INTO :"psv_schema".:"psv_table"(app, version, signature, description, command)
+        VALUES ('psv', 4, 'psv infra 4', 'step functions', 'upgrade');
+    COMMIT;
+  \endif
+  \if :psv_infra_upgrade_5
+    \echo # psv upgrading infra to version 5
+    BEGIN;
+      ALTER TABLE :"psv_schema".:"psv_table"
+""" + STEP_METRICS + r"""
+      ALTER TABLE :"psv_schema".:"psv_history"
+""" + STEP_METRICS + r"""
+      -- replace version 4 functions
+      DROP FUNCTION IF EXISTS :"psv_schema".:"psv_applied"(REGCLASS, TEXT, INTEGER, TEXT, TEXT, TEXT, TEXT, TEXT);
+      DROP FUNCTION IF EXISTS :"psv_schema".:"psv_reversed"(REGCLASS, TEXT, INTEGER, TEXT, TEXT, TEXT, TEXT, TEXT);
+""" + STEP_FUNCTIONS + r"""
+      INSERT INTO :"psv_schema".:"psv_table"(app, version, signature, description, command)
+        VALUES ('psv', 5, 'psv infra 5', 'step metrics', 'upgrade');
+    COMMIT;
+  \endif
+  \if :psv_infra_upgrade_6
+    \echo # psv upgrading infra to version 6
+    BEGIN;
+""" + BATCH_INFRA + r"""
+      INSERT INTO :"psv_schema".:"psv_table"(app, version, signature, description, command)
+        VALUES ('psv', 6, 'psv infra 6', 'batch progress', 'upgrade');
+    COMMIT;
+  \endif
+  -- reference
+  CREATE TEMPORARY VIEW PsvAppStatus
+    AS SELECT * FROM :"psv_schema".:"psv_table";
+  CREATE TEMPORARY VIEW PsvAppHead
+    AS SELECT * FROM :"psv_schema".:"psv_head";
+\endif
 
-\if :psv_do_history
+--
+-- COMPACT
+--
+
+\if :psv_do_compact
 
   \if :psv_debug
-    \echo # DEBUG - HISTORY
+    \echo # DEBUG - COMPACT
   \endif
 
-  -- quit if infra is not available
-  \if :psv_no_infra
-    \if :psv_do_init
-      -- ok, will have been initialized
-      \if :psv_dry
-        \echo # psv will show all application status
-        -- nothing else to do
-        \quit
-      -- else proceed below
-      \endif
-    \else
-      -- no infra and not initialized
-      \warn # ERROR cannot show history without psv infra, consider commands init or create
+  SELECT COUNT(*) AS psv_compact_rows
+    FROM :"psv_schema".:"psv_table"
+    WHERE NOT active
+    \gset
+
+  \if :psv_dry
+    \echo # psv will move :psv_compact_rows inactive status to history
+  \else
+    \echo # psv moving :psv_compact_rows inactive status to history
+""" + COMPACT + r"""
+  \endif
+  \echo # psv :psv_mst :psv_cmd for :psv_app done
+  \quit
+\endif
+
+"""
+
+# windowed script: the application must be at the first version with one of the expected signatures
+SINCE_GUARD = r"""
+--
+-- SINCE: steps up to version {version} are not included
+--
+\if :psv_do_steps
+  SELECT COUNT(*) = 0 AS psv_since_ko
+    FROM PsvAppStatus
+    WHERE app = :'psv_app'
+      AND active
+      AND version = {version}
+      AND signature IN ({signatures})
+    \gset
+  \if :psv_since_ko
+    \warn # ERROR :psv_app must be at version {version} or above with the expected signature for this script
+    \quit
+  \endif
+  \if :psv_do_reverse
+    SELECT :psv_cmd_version BETWEEN 0 AND {version} - 1 AS psv_since_ko \gset
+    \if :psv_since_ko
+      \warn # ERROR :psv_app cannot reverse below version {version} with this script
       \quit
     \endif
   \endif
+  \unset psv_since_ko
+\endif
+"""
+
+APP_HEADER = r"""
+--
+-- APPLICATION {app}
+--
+
+\if :{{?psv_app_override}}
+  -- keep overriden name
+\else
+  \set psv_app {app}
+\endif
+
+\if :psv_debug
+  \echo # DEBUG - APPLICATION :psv_app
+\endif
+
+--
+-- HISTORY
+--
+
+\if :psv_do_history
+
+  \if :psv_debug
+    \echo # DEBUG - HISTORY
+  \endif
 
   -- show all app versions
   \echo # psv application :psv_app history
 
-  SELECT app, version, command, active, created
-    FROM :"psv_schema".:"psv_table"
-    WHERE app = :'psv_app'
+  \if :psv_infra_upgrade_2
+    -- no history table yet
+    SELECT app, version, command, active, created
+      FROM :"psv_schema".:"psv_table"
+      WHERE app = :'psv_app'
+      ORDER BY 5 DESC;
+  \elif :psv_infra_upgrade_5
+    -- no step metrics yet
+    SELECT app, version, command, active, created
+      FROM :"psv_schema".:"psv_table"
+      WHERE app = :'psv_app'
+    UNION ALL
+    SELECT app, version, command, active, created
+      FROM :"psv_schema".:"psv_history"
+      WHERE app = :'psv_app'
     ORDER BY 5 DESC;
-  \quit
-
-\endif
+  \else
+    SELECT app, version, command, active, created,
+           started, finished, finished - started AS duration, wal_bytes, pid
+      FROM :"psv_schema".:"psv_table"
+      WHERE app = :'psv_app'
+    UNION ALL
+    SELECT app, version, command, active, created,
+           started, finished, finished - started AS duration, wal_bytes, pid
+      FROM :"psv_schema".:"psv_history"
+      WHERE app = :'psv_app'
+    ORDER BY 5 DESC;
+  \endif
 
 --
--- setup dry run, changes are operated on a temporary copy
+-- SUMMARY
 --
-\if :psv_dry
-  -- copy
-  CREATE TEMPORARY TABLE PsvAppStatus
-    AS SELECT * FROM :"psv_schema".:"psv_table";
-\else
-  -- reference
-  CREATE TEMPORARY VIEW PsvAppStatus
-    AS SELECT * FROM :"psv_schema".:"psv_table";
-\endif
 
--- self check for possible future upgrades
-SELECT MAX(version) <> 0 AS psv_not_v0
-  FROM PsvAppStatus
-  WHERE app = 'psv'
-    AND active
-  \gset
+\elif :psv_do_summary
 
-\if :psv_not_v0
-  \warn # ERROR unexpected psv version
-  \quit
-\endif
+  \if :psv_debug
+    \echo # DEBUG - SUMMARY
+  \endif
+
+  \echo # psv application :psv_app summary
+
+  \if :psv_infra_upgrade_5
+    \echo # psv no step metrics before infra version 5
+  \else
+    -- executed steps, whether still active or not
+    CREATE TEMPORARY VIEW PsvAppMetrics AS
+      SELECT app, version, command, started, finished, finished - started AS duration, wal_bytes, pid
+        FROM :"psv_schema".:"psv_table"
+        WHERE app = :'psv_app' AND started IS NOT NULL
+      UNION ALL
+      SELECT app, version, command, started, finished, finished - started AS duration, wal_bytes, pid
+        FROM :"psv_schema".:"psv_history"
+        WHERE app = :'psv_app' AND started IS NOT NULL;
+    SELECT app, COUNT(*) AS steps,
+           SUM(duration) AS total_duration, AVG(duration) AS avg_duration, MAX(duration) AS max_duration,
+           SUM(wal_bytes) AS total_wal_bytes, MAX(wal_bytes) AS max_wal_bytes,
+           MIN(started) AS first_started, MAX(finished) AS last_finished
+      FROM PsvAppMetrics
+      GROUP BY 1;
+    \echo # psv application :psv_app slowest steps
+    SELECT app, version, command, started, duration, wal_bytes, pid
+      FROM PsvAppMetrics
+      ORDER BY duration DESC, started DESC
+      LIMIT 10;
+    DROP VIEW PsvAppMetrics;
+  \endif
+
+\else
 
 -- check if the application is unknown
 SELECT COUNT(*) = 0 AS psv_app_ko
-  FROM PsvAppStatus
+  FROM PsvAppHead
   WHERE app = :'psv_app'
-    AND active
   \gset
 
 --
@@ -502,9 +1082,9 @@ SELECT COUNT(*) = 0 AS psv_app_ko
     \endif
   \endif
   -- nothing to do latter anyway
-  \quit
-\endif
 
+\else
+{since}
 --
 -- STEPS (APPLY or REVERSE) or CATCHUP
 --
@@ -514,10 +1094,9 @@ SELECT COUNT(*) = 0 AS psv_app_ko
 \if :psv_do_apply
 
   SELECT :psv_cmd_version <> -1 AND COUNT(*) >= 1 AS psv_no_step_needed
-    FROM PsvAppStatus
+    FROM PsvAppHead
     WHERE app = :'psv_app'
       AND version >= :psv_cmd_version
-      AND active
     \gset
   \set psv_operating applying
   \set psv_operate apply
@@ -525,10 +1104,9 @@ SELECT COUNT(*) = 0 AS psv_app_ko
 \elif :psv_do_reverse
 
   SELECT COUNT(*) = 0 AS psv_no_step_needed
-    FROM PsvAppStatus
+    FROM PsvAppHead
     WHERE app = :'psv_app'
       AND version > :psv_cmd_version
-      AND active
     \gset
   \set psv_operating reversing
   \set psv_operate reverse
@@ -575,8 +1153,7 @@ SELECT COUNT(*) = 0 AS psv_app_ko
 
 \if :psv_no_step_needed
   \echo # psv nothing to :psv_operate for :psv_app target version :psv_cmd_version_display
-  \quit
-\endif
+\else
 
 -- psv_do_apply_catchup := psv_do_apply OR psv_do_catchup
 \set psv_do_apply_catchup 0
@@ -587,6 +1164,25 @@ SELECT COUNT(*) = 0 AS psv_app_ko
   \set psv_do_apply_catchup 1
 \endif
 
+-- step message and whether step bodies are executed, for step functions
+\if :psv_do_catchup
+  \set psv_step_exec 0
+  \if :psv_dry
+    \set psv_step_msg 'will catch-up'
+  \else
+    \set psv_step_msg :psv_operating
+  \endif
+\elif :psv_simulate
+  \set psv_step_exec 0
+  \set psv_step_msg 'will execute ' :psv_operate
+\else
+  \set psv_step_exec 1
+  \set psv_step_msg :psv_operating
+\endif
+-- step metrics, only set when the step is executed
+\set psv_step_start ''
+\set psv_step_lsn ''
+
 -- consider each step in turn
 \if :psv_do_steps
 
@@ -600,267 +1196,551 @@ SELECT COUNT(*) = 0 AS psv_app_ko
   \else
     \echo # psv considering :psv_operating steps
   \endif
-""" + APP_VERSION
+""" + APP_VERSION + r"""
+  \set psv_up_to_date 0
+"""
 
-FILE_HEADER = r"""
+# relation locks held by the session and rows changed by the transaction, psv temporary tables excluded
+REHEARSE_SNAPSHOT = r"""
+    DELETE FROM PsvRehearsalLocks;
+    INSERT INTO PsvRehearsalLocks
+      SELECT relation, mode FROM PsvRehearsalLocking;
+    DELETE FROM PsvRehearsalRows;
+    INSERT INTO PsvRehearsalRows
+      SELECT relid, ins, upd, del FROM PsvRehearsalCounting;
+"""
+
+# rehearsal: all application steps are executed within one transaction which is rolled back
+REHEARSE_BEGIN = r"""
   --
-  -- File {file}
+  -- REHEARSE: setup transaction and step metrics
   --
-  -- check whether version is needed
-  \set psv_filename {filename}
-  \set psv_version {version}
-  \set psv_signature {signature}
-  \set psv_description {description}
-  \set psv_forward {forward}
-  \set psv_operation {operation}
+  \if :psv_rehearse
+    \echo # psv rehearsing :psv_app steps within a transaction
+    \set psv_rehearse_echo :ECHO
+    BEGIN;
+    CREATE TEMPORARY TABLE PsvRehearsal(
+      step SERIAL PRIMARY KEY,
+      app TEXT NOT NULL,
+      version INTEGER NOT NULL,
+      operation TEXT NOT NULL,
+      filename TEXT NOT NULL,
+      rehearsed BOOLEAN NOT NULL,
+      duration INTERVAL NOT NULL,
+      wal_bytes BIGINT NOT NULL,
+      strongest TEXT DEFAULT NULL,
+      locks TEXT DEFAULT NULL,
+      inserted BIGINT NOT NULL,
+      updated BIGINT NOT NULL,
+      deleted BIGINT NOT NULL
+    );
+    CREATE TEMPORARY VIEW PsvRehearsalLocking AS
+      SELECT l.relation, l.mode,
+             ARRAY_POSITION(ARRAY['AccessShareLock', 'RowShareLock', 'RowExclusiveLock',
+                                  'ShareUpdateExclusiveLock', 'ShareLock', 'ShareRowExclusiveLock',
+                                  'ExclusiveLock', 'AccessExclusiveLock'], l.mode) AS level
+        FROM pg_catalog.pg_locks AS l
+        LEFT JOIN pg_catalog.pg_class AS c ON c.oid = l.relation
+        LEFT JOIN pg_catalog.pg_namespace AS n ON n.oid = c.relnamespace
+        WHERE l.pid = pg_backend_pid()
+          AND l.locktype = 'relation'
+          AND l.granted
+          -- relations dropped by the transaction are kept
+          AND COALESCE(n.nspname !~ '^(pg_catalog|information_schema|pg_toast.*)$' AND
+                       n.oid <> pg_my_temp_schema() AND c.relkind NOT IN ('i', 'I'), TRUE);
+    CREATE TEMPORARY VIEW PsvRehearsalCounting AS
+      SELECT s.relid, s.n_tup_ins AS ins, s.n_tup_upd AS upd, s.n_tup_del AS del
+        FROM pg_catalog.pg_stat_xact_user_tables AS s
+        JOIN pg_catalog.pg_class AS c ON c.oid = s.relid
+        WHERE c.relnamespace <> pg_my_temp_schema();
+    CREATE TEMPORARY TABLE PsvRehearsalLocks(relation OID, mode TEXT);
+    CREATE TEMPORARY TABLE PsvRehearsalRows(relid OID, ins BIGINT, upd BIGINT, del BIGINT);
+""" + REHEARSE_SNAPSHOT + r"""
+  \endif
+"""
 
-  \if :psv_debug
-    \echo # DEBUG - STEP :psv_app :psv_operation :psv_version
-    SELECT app, version, command, active, signature
-      FROM PsvAppStatus WHERE app = :'psv_app' ORDER BY created DESC;
+# rehearsal report, the transaction is rolled back before the step plan is dropped
+REHEARSE_END = r"""
+  \if :psv_rehearse
+    \echo # psv rehearsal of :psv_app steps
+    SELECT step, app, version, operation, filename, rehearsed, duration, wal_bytes,
+           strongest, locks, inserted, updated, deleted
+      FROM PsvRehearsal
+      ORDER BY step;
+    SELECT COUNT(*) AS psv_rehearsed_steps, COALESCE(SUM(duration), '0') AS psv_rehearsed_duration
+      FROM PsvRehearsal
+      WHERE rehearsed
+      \gset
+    ROLLBACK;
+    \echo # psv rolled back :psv_rehearsed_steps rehearsed steps for :psv_app in :psv_rehearsed_duration
+    \unset psv_rehearsed_steps
+    \unset psv_rehearsed_duration
+    \unset psv_rehearse_echo
   \endif
+"""
 
-  -- first consider step direction to know if we should consider this
-  \if :psv_forward
-    \if :psv_do_apply_catchup
-      \set psv_keep_step 1
-    \else
-      \set psv_keep_step 0
-    \endif
+# whole step plan, computed in one query from the list of steps
+STEP_PLAN = r"""
+  \if :psv_up_to_date
+    -- nothing to do
   \else
-    -- backward
-    \if :psv_do_reverse
-      \set psv_keep_step 1
+  --
+  -- STEP PLAN: decide about all steps at once
+  --
+  CREATE TEMPORARY TABLE PsvStepPlan AS
+    WITH step(step, version, forward, baseline, signature, chain, filename, description) AS (
+{steps}
+    ),
+    -- current application status
+    app_status AS (
+      SELECT version, signature
+        FROM PsvAppStatus
+        WHERE app = :'psv_app'
+          AND active
+    ),
+    head AS (
+      SELECT COALESCE(MAX(version), 0) AS head
+        FROM app_status
+    ),
+    -- baseline version used instead of its covered steps on a fresh application
+    base AS (
+      SELECT COALESCE(MAX(step.version), 0) AS base
+        FROM step
+        CROSS JOIN head
+        WHERE step.baseline
+          AND :'psv_do_apply'::BOOLEAN
+          AND head.head = 0
+          AND (:psv_cmd_version = -1 OR step.version <= :psv_cmd_version)
+    ),
+    -- steps in the direction of the current operation
+    considered AS (
+      SELECT step.*, head.head, GREATEST(head.head, base.base) AS start, base.base,
+        -- this version is currently active
+        app_status.version IS NOT NULL AS done,
+        -- with another signature, which is not the baseline one
+        app_status.version IS NOT NULL AND
+          app_status.signature IS DISTINCT FROM step.signature AND
+          app_status.signature IS DISTINCT FROM
+            (SELECT signature FROM step AS b WHERE b.baseline) AS differs,
+        -- this signature is already used by another version
+        EXISTS (SELECT 1 FROM app_status AS other
+                  WHERE other.signature = step.signature
+                    AND other.version <> step.version) AS used,
+        -- first step provided for this version
+        ROW_NUMBER() OVER (PARTITION BY step.version, step.baseline ORDER BY step.step) = 1 AS first,
+        FIRST_VALUE(step.signature) OVER (PARTITION BY step.version, step.baseline ORDER BY step.step) AS first_signature
+      FROM step
+      CROSS JOIN head
+      CROSS JOIN base
+      LEFT JOIN app_status ON (app_status.version = step.version)
+      WHERE CASE WHEN step.forward THEN :'psv_do_apply_catchup'::BOOLEAN
+                 ELSE :'psv_do_reverse'::BOOLEAN END
+    ),
+    -- whether a step is reachable from the current version without missing steps
+    chained AS (
+      SELECT considered.*,
+        CASE WHEN baseline THEN
+          version = base
+        WHEN forward THEN
+          NOT done AND version > start AND
+            DENSE_RANK() OVER (PARTITION BY version > start, baseline ORDER BY version) = version - start
+        ELSE
+          done AND version <= head AND
+            DENSE_RANK() OVER (PARTITION BY version <= head ORDER BY version DESC) = head - version + 1
+        END AS reachable,
+        CASE WHEN forward THEN
+          :psv_cmd_version = -1 OR version <= :psv_cmd_version
+        ELSE
+          :psv_cmd_version <> -1 AND version > :psv_cmd_version
+        END AS targeted
+      FROM considered
+    ),
+    decided AS (
+      SELECT step,
+        CASE
+          -- baseline only applies to a fresh application
+          WHEN baseline AND reachable THEN 'needed'
+          WHEN baseline THEN 'skip'
+          -- already applied with another script
+          WHEN forward AND differs AND used THEN 'collision'
+          WHEN forward AND differs THEN 'inconsistent'
+          WHEN NOT reachable OR NOT targeted THEN 'skip'
+          -- several scripts for the same version
+          WHEN NOT first AND signature <> first_signature THEN 'collision'
+          WHEN NOT first THEN 'skip'
+          -- this script was used somewhere already
+          WHEN forward AND used THEN 'collision'
+          ELSE 'needed'
+        END AS status
+      FROM chained
+    )
+    SELECT step.*, COALESCE(decided.status, 'ignore') AS status
+      FROM step
+      LEFT JOIN decided USING (step);
+
+  SELECT
+    COUNT(*) FILTER (WHERE status = 'needed') AS psv_plan_needed,
+    COUNT(*) FILTER (WHERE status = 'inconsistent') AS psv_plan_inconsistent,
+    COUNT(*) FILTER (WHERE status = 'inconsistent') > 0 AS psv_plan_has_inconsistent,
+    COUNT(*) FILTER (WHERE status = 'collision') AS psv_plan_collision,
+    COUNT(*) FILTER (WHERE status = 'collision') > 0 AS psv_plan_has_collision
+    FROM PsvStepPlan
+    \gset
+
+  \if :psv_debug
+    \echo # DEBUG plan needed: :psv_plan_needed inconsistent: :psv_plan_inconsistent collision: :psv_plan_collision
+    SELECT step, version, forward, filename, status
+      FROM PsvStepPlan
+      ORDER BY step;
+  \endif
+
+  \if :psv_plan_has_collision
+    SELECT version, filename, signature
+      FROM PsvStepPlan
+      WHERE status = 'collision'
+      ORDER BY step;
+    \warn # ERROR :psv_app signature collision on :psv_plan_collision steps
+    \quit
+  \endif
+
+  \if :psv_plan_has_inconsistent
+    \if :psv_do_catchup
+      \warn # WARN :psv_app :psv_plan_inconsistent steps with inconsistent signature
+      \if :psv_dry
+        \echo # psv will update signatures
+      \else
+        \echo # psv updating signatures
+      \endif
+      -- do it anyway, possibly on the tmp copy
+      BEGIN;
+        UPDATE PsvAppStatus
+          SET active = FALSE
+          WHERE app = :'psv_app'
+            AND active
+            AND version IN (SELECT version FROM PsvStepPlan WHERE status = 'inconsistent');
+        INSERT INTO PsvAppStatus(app, version, signature, chain, filename, description, command)
+          SELECT :'psv_app', version, signature, chain, filename, description, :'psv_cmd'
+            FROM PsvStepPlan
+            WHERE status = 'inconsistent'
+            ORDER BY step;
+      COMMIT;
     \else
-      \set psv_keep_step 0
+      SELECT version, filename, signature
+        FROM PsvStepPlan
+        WHERE status = 'inconsistent'
+        ORDER BY step;
+      \warn # ERROR :psv_app :psv_plan_inconsistent steps with inconsistent signature
+      \quit
     \endif
   \endif
 
-  \if :psv_debug
-    \echo # DEBUG :psv_app :psv_operation :psv_version considered: :psv_keep_step
+  --
+  -- PREFLIGHT: wait for long transactions which may block steps on locks
+  --
+  \if :psv_do_preflight
+    SELECT :psv_plan_needed > 0 AND NOT :'psv_do_catchup'::BOOLEAN AS psv_preflight_needed \gset
+    \if :psv_preflight_needed
+      \if :psv_simulate
+        SELECT pg_temp.psv_preflight(:'psv_preflight', '0') AS psv_preflight_busy \gset
+        \echo # psv will wait for :psv_preflight_busy long transactions older than :psv_preflight
+      \else
+        \echo # psv waiting for long transactions older than :psv_preflight
+        SELECT busy AS psv_preflight_busy, busy > 0 AS psv_preflight_ko
+          FROM pg_temp.psv_preflight(:'psv_preflight', :'psv_preflight_timeout') AS busy
+          \gset
+        \if :psv_preflight_ko
+          \warn # ERROR psv :psv_preflight_busy long transactions still running after :psv_preflight_timeout, giving up
+          \quit
+        \endif
+      \endif
+    \endif
   \endif
 
-  \if :psv_keep_step
+  -- refresh chained signatures of consistent steps, eg recorded by an older psv
+  \if :psv_do_apply_catchup
+    UPDATE PsvAppStatus AS s
+      SET chain = p.chain
+      FROM PsvStepPlan AS p
+      WHERE s.app = :'psv_app'
+        AND s.active
+        AND s.version = p.version
+        AND s.signature = p.signature
+        AND p.chain IS NOT NULL
+        AND s.chain IS DISTINCT FROM p.chain;
+  \endif
+""" + REHEARSE_BEGIN
 
-    -- precondition : app schema prior operation was done
-    \if :psv_do_apply_catchup
-      SELECT COUNT(*) = 1 AS psv_version_prec
-        FROM PsvAppStatus
-        WHERE app = :'psv_app'
-          AND version = :psv_version - 1
-          AND active
-        \gset
-    \elif :psv_do_reverse
-      SELECT COUNT(*) = 0 AS psv_version_prec
-        FROM PsvAppStatus
-        WHERE app = :'psv_app'
-          AND version = :psv_version + 1
-          AND active
-        \gset
-      -- else dead code
+# shortcut when the application is already at the latest version with the same history
+UP_TO_DATE = r"""
+  --
+  -- UP TO DATE: check latest version and chained signature at once
+  --
+  \if :psv_do_apply
+    SELECT COUNT(*) = 1 AS psv_up_to_date
+      FROM PsvAppHead
+      WHERE app = :'psv_app'
+        AND version = {version}
+        AND chain = '{chain}'
+        AND (:psv_cmd_version = -1 OR :psv_cmd_version >= {version})
+      \gset
+    \if :psv_up_to_date
+      \echo # psv :psv_app is up to date at version {version}
     \endif
+  \endif
+"""
 
-    \if :psv_debug
-      \echo # DEBUG :psv_app :psv_operation :psv_version prec: :psv_version_prec
-    \endif
+# single application scripts stop at once when up to date, without reading steps
+UP_TO_DATE_QUIT = r"""
+  \if :psv_up_to_date
+    \echo # psv :psv_mst :psv_cmd for :psv_app done
+    \quit
+  \endif
+"""
 
-    \if :psv_version_prec
-      \if :psv_do_apply_catchup
-        -- this app schema upgrade not already applied
-        SELECT COUNT(*) = 0 AS psv_version_not_done
-          FROM PsvAppStatus
-          WHERE app = :'psv_app'
-            AND version = :psv_version
-            AND active
-          \gset
+# per-step needed flags, by chunks to stay below postgres column limit
+STEP_FLAGS = r"""
+  SELECT
+{flags}
+    FROM (SELECT ARRAY_AGG(status = 'needed' ORDER BY step) AS needed
+            FROM PsvStepPlan) AS plan
+    \gset
+"""
 
-        \if :psv_version_not_done
-          -- we may have to do it
-          \set psv_do_sigcheck 0
-        \else
-          \set psv_do_sigcheck 1
-        \endif
+# step timeouts from the step header or global settings,
+# for the step transaction only, or for the session until reset
+STEP_TIMEOUTS = r"""
+    SELECT
+      set_config('lock_timeout',
+        COALESCE(NULLIF(:'psv_step_lock_timeout', ''), NULLIF(:'psv_lock_timeout', ''),
+                 current_setting('lock_timeout')), {local}) AS psv_step_lock_timeout,
+      set_config('statement_timeout',
+        COALESCE(NULLIF(:'psv_step_statement_timeout', ''), NULLIF(:'psv_statement_timeout', ''),
+                 current_setting('statement_timeout')), {local}) AS psv_step_statement_timeout
+      \gset
+"""
 
-      \elif :psv_do_reverse
+STEP_RESET = r"""
+    RESET lock_timeout;
+    RESET statement_timeout;
+"""
 
-        \set psv_do_sigcheck 0
-        -- this downgrade can be executed
-        SELECT COUNT(*) = 1 AS psv_version_not_done
-          FROM PsvAppStatus
-          WHERE app = :'psv_app'
-            AND version = :psv_version
-            AND active
-          \gset
-      -- else dead code
-      \endif
+# step transaction, unless rehearsing within the application transaction
+STEP_TX = r"""
+    \if :psv_rehearse
+      -- rehearsal transaction
     \else
-      -- we have to skip this operation because the status is not right
-      \set psv_version_not_done 0
-      \set psv_do_sigcheck 0
+    BEGIN;
     \endif
-    \unset psv_version_prec
+"""
 
-    \if :psv_debug
-      \echo # DEBUG :psv_app :psv_operation :psv_version not done: :psv_version_not_done
+# show rehearsed step statements with their execution time
+STEP_TIMING = r"""
+    \if :psv_rehearse
+      \set ECHO queries
+      \timing on
     \endif
+"""
 
-    -- and above/below target
-    \if :psv_version_not_done
-
-      -- filter out based on target version
-      \if :psv_do_apply_catchup
-        SELECT :psv_cmd_version = -1 OR :psv_version <= :psv_cmd_version AS psv_version_needed
-        \gset
-      \elif :psv_do_reverse
-        SELECT :psv_cmd_version <> -1 AND :psv_version > :psv_cmd_version AS psv_version_needed
-        \gset
-      -- else dead code
-      \endif
-      -- override signature checks
-      \set psv_do_sigcheck 0
-
-    \else
-      -- psv version was done
-      \set psv_version_needed 0
+STEP_TIMING_END = r"""
+    \if :psv_rehearse
+      \timing off
+      \set ECHO :psv_rehearse_echo
     \endif
-    \unset psv_version_not_done
+"""
 
-    \if :psv_do_sigcheck
+# non transactional steps cannot be rehearsed within a transaction
+STEP_NOTX_REHEARSE = r"""
+    \if :psv_rehearse
+      \warn # WARN psv cannot rehearse non transactional step :psv_app :psv_version
+    \else
+"""
 
-      -- check signature consistency in passing
-      \if :psv_debug
-        \echo # DEBUG checking signature consistency
-      \endif
+# step metrics within the rehearsal transaction, new locks are reported from the strongest
+STEP_REHEARSAL = r"""
+      INSERT INTO PsvRehearsal(app, version, operation, filename, rehearsed, duration, wal_bytes,
+                               strongest, locks, inserted, updated, deleted)
+        SELECT :'psv_app', :psv_version, :'psv_operation', :'psv_filename', {rehearsed},
+               clock_timestamp()::TIMESTAMP - :'psv_step_start'::TIMESTAMP,
+               pg_wal_lsn_diff(pg_current_wal_insert_lsn(), :'psv_step_lsn')::BIGINT,
+               locks.strongest, locks.locks, counts.inserted, counts.updated, counts.deleted
+          FROM (SELECT (ARRAY_AGG(mode ORDER BY level DESC))[1] AS strongest,
+                       STRING_AGG(relation::REGCLASS || ' ' || mode, ', '
+                                  ORDER BY level DESC, relation::REGCLASS::TEXT) AS locks
+                  FROM PsvRehearsalLocking AS l
+                  WHERE NOT EXISTS (SELECT 1 FROM PsvRehearsalLocks AS p
+                                      WHERE p.relation = l.relation AND p.mode = l.mode)) AS locks
+          CROSS JOIN (SELECT COALESCE(SUM(c.ins - COALESCE(p.ins, 0)), 0) AS inserted,
+                             COALESCE(SUM(c.upd - COALESCE(p.upd, 0)), 0) AS updated,
+                             COALESCE(SUM(c.del - COALESCE(p.del, 0)), 0) AS deleted
+                        FROM PsvRehearsalCounting AS c
+                        LEFT JOIN PsvRehearsalRows AS p USING (relid)) AS counts;
+""" + REHEARSE_SNAPSHOT + STEP_RESET
+
+# step parts: info, then either the inline step or its bundle inclusion, then tail
+STEP_INFO = r"""
+  --
+  -- File {file}
+  --
+  \set psv_filename {filename}
+  \set psv_version {version}
+  \set psv_signature {signature}
+  \set psv_description {description}
+  \set psv_operation {operation}
+  \set psv_chain {chain}
+  \set psv_step_lock_timeout {lock_timeout}
+  \set psv_step_statement_timeout {statement_timeout}
 
-      -- app schema upgrade already applied with another script
-      SELECT COUNT(*) = 0 AS psv_version_inconsistent
-        FROM PsvAppStatus
-        WHERE app = :'psv_app'
-          AND version = :psv_version
-          AND signature = :'psv_signature'
-          AND active
-        \gset
+  \if :psv_debug
+    \echo # DEBUG - STEP {step} :psv_app :psv_operation :psv_version needed: :psv_step_{step}
+  \endif
 
-      -- this script was used somewhere already
-      SELECT COUNT(*) > 0 AS psv_signature_used
-        FROM PsvAppStatus
-        WHERE app = :'psv_app'
-          AND signature = :'psv_signature'
-          AND active
-        \gset
+  \if :psv_step_{step}
+"""
 
+STEP_PRELUDE = r"""
+    -- app version to be executed
+    \if :psv_do_catchup
+      \if :psv_dry
+        \echo # psv will catch-up :psv_app :psv_version
+      \else
+        \echo # psv catching-up :psv_app :psv_version
+      \endif
+      -- do it anyway, possibly on the fake copy
+      INSERT INTO PsvAppStatus(app, version, signature, chain, filename, description, command)
+        VALUES (:'psv_app', :psv_version, :'psv_signature', NULLIF(:'psv_chain', ''), :'psv_filename', :'psv_description', :'psv_cmd');
+    \elif :psv_simulate
+      \echo # psv will execute :psv_operate :psv_app :psv_version
+      -- record the execution on the copy anyway
+      \if :psv_do_apply
+        INSERT INTO PsvAppStatus(app, version, signature, chain, filename, description, command, active)
+          VALUES (:'psv_app', :psv_version, :'psv_signature', NULLIF(:'psv_chain', ''), :'psv_filename', :'psv_description', :'psv_cmd', TRUE);
+      \elif :psv_do_reverse
+        BEGIN;
+          UPDATE PsvAppStatus
+            SET active = FALSE
+            WHERE app = :'psv_app'
+              AND version = :psv_version
+              AND active;
+          INSERT INTO PsvAppStatus(app, version, signature, filename, description, command, active)
+            VALUES (:'psv_app', :psv_version, :'psv_signature', :'psv_filename', :'psv_description', :'psv_cmd', FALSE);
+        COMMIT;
+      -- else dead code
+      \endif
     \else
-      -- no check, assume all is well
-      \set psv_version_inconsistent 0
-      \set psv_signature_used 0
-    \endif
-    \unset psv_do_sigcheck
+      \echo # psv :psv_operating :psv_app :psv_version
 
-    \if :psv_debug
-      \echo # DEBUG :psv_app :psv_operate :psv_version for :psv_cmd_version_display: :psv_version_needed
-    \endif
+    SELECT clock_timestamp()::TIMESTAMP AS psv_step_start, pg_current_wal_insert_lsn() AS psv_step_lsn \gset
+"""
 
-    \if :psv_version_needed
-      -- app version to be executed
-      \if :psv_do_catchup
-        \if :psv_dry
-          \echo # psv will catch-up :psv_app :psv_version
-        \else
-          \echo # psv catching-up :psv_app :psv_version
-        \endif
-        \if :psv_signature_used
-          -- will fail on UNIQUE(signature)
-          \warn # ERROR :psv_app :psv_version script already applied
-          \quit
-        \endif
-        -- do it anyway, possibly on the fake copy ?
-        INSERT INTO PsvAppStatus(app, version, signature, filename, description, command)
-          VALUES (:'psv_app', :'psv_version', :'psv_signature', :'psv_filename', :'psv_description', :'psv_cmd');
-      \else
-        -- actual execution mode!
-        \if :psv_signature_used
-          -- will fail on UNIQUE(signature)
-          \warn # ERROR :psv_app :psv_version script already applied
-          \quit
-        \endif
+STEP_BEGIN = STEP_PRELUDE + STEP_TX + STEP_TIMEOUTS.format(local="TRUE") + STEP_TIMING
 
-        \if :psv_dry
-          \echo # psv will execute :psv_operate :psv_app :psv_version
-            -- record the execution on the copy anyway
-            \if :psv_do_apply
-              INSERT INTO PsvAppStatus(app, version, signature, filename, description, command, active)
-                VALUES (:'psv_app', :psv_version, :'psv_signature', :'psv_filename', :'psv_description', :'psv_cmd', TRUE);
-            \elif :psv_do_reverse
-              BEGIN;
-                UPDATE PsvAppStatus
-                  SET active = FALSE
-                  WHERE app = :'psv_app'
-                    AND version = :'psv_version'
-                    AND active;
-                INSERT INTO PsvAppStatus(app, version, signature, filename, description, command, active)
-                  VALUES (:'psv_app', :psv_version, :'psv_signature', :'psv_filename', :'psv_description', :'psv_cmd', FALSE);
-              COMMIT;
-            -- else dead code
-            \endif
-        \else
-          \echo # psv :psv_operating :psv_app :psv_version
+# non transactional step statements are executed one by one
+STEP_NOTX_BEGIN = STEP_PRELUDE + STEP_TIMEOUTS.format(local="FALSE") + STEP_NOTX_REHEARSE
 
-    BEGIN;
+# drop invalid indexes left by an interrupted non transactional step
+STEP_CLEANUP = r"""
+    SELECT format('DROP INDEX CONCURRENTLY IF EXISTS %s', i.indexrelid::REGCLASS)
+      FROM pg_catalog.pg_index AS i
+      WHERE NOT i.indisvalid
+        AND i.indexrelid IN ({indexes})
+      \gexec
 """
 
-FILE_FOOTER = r"""
-      \if :psv_do_apply_catchup
+STEP_RECORD = r"""
+      \if :psv_do_apply
         -- upgrade application new version
-        INSERT INTO PsvAppStatus(app, version, signature, filename, description, command)
-          VALUES (:'psv_app', :psv_version, :'psv_signature', :'psv_filename', :'psv_description', :'psv_cmd');
+        INSERT INTO PsvAppStatus(app, version, signature, chain, filename, description, command,
+                                 started, finished, wal_bytes, pid)
+          VALUES (:'psv_app', :psv_version, :'psv_signature', NULLIF(:'psv_chain', ''), :'psv_filename', :'psv_description', :'psv_cmd',
+                  :'psv_step_start', clock_timestamp(), pg_wal_lsn_diff(pg_current_wal_insert_lsn(), :'psv_step_lsn'), pg_backend_pid());
       \elif :psv_do_reverse
         UPDATE PsvAppStatus
           SET active = FALSE
           WHERE app = :'psv_app'
-            AND version = :'psv_version'
+            AND version = :psv_version
             AND active;
-        INSERT INTO PsvAppStatus(app, version, signature, filename, description, command, active)
-          VALUES (:'psv_app', :psv_version, :'psv_signature', :'psv_filename', :'psv_description', :'psv_cmd', FALSE);
+        INSERT INTO PsvAppStatus(app, version, signature, filename, description, command, active,
+                                 started, finished, wal_bytes, pid)
+          VALUES (:'psv_app', :psv_version, :'psv_signature', :'psv_filename', :'psv_description', :'psv_cmd', FALSE,
+                  :'psv_step_start', clock_timestamp(), pg_wal_lsn_diff(pg_current_wal_insert_lsn(), :'psv_step_lsn'), pg_backend_pid());
       -- else dead code
       \endif
+"""
 
+# step transaction commit, or its metrics within the rehearsal transaction
+STEP_TX_END = r"""
+    \if :psv_rehearse
+""" + STEP_REHEARSAL + r"""
+    \else
     COMMIT;
+    \endif
+"""
 
-        \endif
-      \endif
+STEP_UNSET = r"""
+    \unset psv_step_start
+    \unset psv_step_lsn
+
+    \endif
+"""
+
+STEP_COMMIT = STEP_TX_END.format(rehearsed="TRUE") + STEP_UNSET
+
+STEP_NOTX_COMMIT = STEP_TX_END.format(rehearsed="FALSE") + STEP_UNSET
+
+STEP_END = STEP_TIMING_END + STEP_RECORD + STEP_COMMIT
+
+# baseline records the versions it covers, with the signatures of available steps
+STEP_BASELINE_END = STEP_TIMING_END + r"""
+      INSERT INTO PsvAppStatus(app, version, signature, chain, filename, description, command)
+        SELECT DISTINCT ON (version) :'psv_app', version, signature, chain, filename, description, :'psv_cmd'
+          FROM PsvStepPlan
+          WHERE forward AND NOT baseline AND version < :psv_version
+          ORDER BY version, step;
+      INSERT INTO PsvAppStatus(app, version, signature, chain, filename, description, command,
+                               started, finished, wal_bytes, pid)
+        SELECT :'psv_app', :psv_version, COALESCE(covered.signature, :'psv_signature'),
+               COALESCE(covered.chain, NULLIF(:'psv_chain', '')), :'psv_filename', :'psv_description', :'psv_cmd',
+               :'psv_step_start', clock_timestamp(), pg_wal_lsn_diff(pg_current_wal_insert_lsn(), :'psv_step_lsn'), pg_backend_pid()
+          FROM (SELECT) AS baseline
+          LEFT JOIN (SELECT signature, chain
+                       FROM PsvStepPlan
+                       WHERE forward AND NOT baseline AND version = :psv_version
+                       ORDER BY step
+                       LIMIT 1) AS covered ON TRUE;
+""" + STEP_COMMIT
+
+# status is recorded only after the non transactional step succeeded
+STEP_NOTX_END = r"""
+    \endif
+""" + STEP_TX + STEP_RECORD + STEP_RESET + STEP_NOTX_COMMIT
+
+# batch step statement is run by the infra procedure
+STEP_BATCH_CALL = r"""
+    CALL :"psv_schema".:"psv_batch"(format('%I.%I', :'psv_schema', :'psv_progress')::REGCLASS,
+      :'psv_app', :psv_version, :'psv_signature', {size}, $psv_batch$
+"""
+
+STEP_BATCH_CALL_END = r"""
+$psv_batch$);
+"""
+
+# progress is forgotten when the batch step is recorded
+STEP_BATCH_DONE = r"""
+    DELETE FROM :"psv_schema".:"psv_progress"
+      WHERE app = :'psv_app' AND version = :psv_version;
+"""
+
+STEP_BATCH_END = r"""
+    \endif
+""" + STEP_TX + STEP_RECORD + STEP_BATCH_DONE + STEP_RESET + STEP_NOTX_COMMIT
+
+STEP_TAIL = r"""
+  \elif :psv_do_{direction}
+    -- step not needed
+    \if :psv_dry
+      \echo # psv will skip :psv_app :psv_operation :psv_version
     \else
-      -- step not needed
-      \if :psv_version_inconsistent
-        \if :psv_do_catchup
-          \warn # WARN :psv_app :psv_version inconsistent signature
-          \if :psv_signature_used
-            \echo # ERROR cannot update :psv_app :psv_version, signature collision
-            \quit
-          \endif
-          \if :psv_dry
-            \echo # psv will update signature
-          \else
-            \echo # psv updating signature
-          \endif
-          BEGIN;
-            UPDATE PsvAppStatus
-              SET active = FALSE
-              WHERE app = :'pvs_app'
-                AND version = :'psv_version'
-                AND active;
-            INSERT INTO PsvAppStatus(app, version, signature, filename, description, command)
-              VALUES (:'psv_app', :psv_version, :'psv_signature', :'psv_filename', :'psv_description', :'psv_cmd');
-          COMMIT;
-        \else
-          \warn # ERROR :psv_app :psv_version inconsistent signature
-          \quit
-        \endif
-      \endif
-      \if :psv_dry
-        \echo # psv will skip :psv_app :psv_operation :psv_version
-      \else
-        \echo # psv skipping :psv_app :psv_operation :psv_version
-      \endif
+      \echo # psv skipping :psv_app :psv_operation :psv_version
     \endif
   \else
     -- step skipped as it does not apply to operation
@@ -870,16 +1750,69 @@ FILE_FOOTER = r"""
       \echo # psv ignoring :psv_app :psv_operation :psv_version
     \endif
   \endif
- 
+
+  \unset psv_step_{step}
+  \unset psv_chain
   \unset psv_operation
-  \unset psv_forward
   \unset psv_description
   \unset psv_signature
   \unset psv_version
   \unset psv_filename
+  \unset psv_step_lock_timeout
+  \unset psv_step_statement_timeout
 """
 
-SCRIPT_FOOTER = APP_VERSION + r"""
+# step bookkeeping with infra functions, instead of STEP_BEGIN and STEP_END
+STEP_CALL_PRELUDE = r"""
+    -- app version to be executed
+    \echo # psv :psv_step_msg :psv_app :psv_version
+    \if :psv_step_exec
+
+    SELECT clock_timestamp()::TIMESTAMP AS psv_step_start, pg_current_wal_insert_lsn() AS psv_step_lsn \gset
+"""
+
+STEP_CALL_BEGIN = STEP_CALL_PRELUDE + STEP_TX + STEP_TIMEOUTS.format(local="TRUE") + STEP_TIMING
+
+STEP_CALL_NOTX_BEGIN = STEP_CALL_PRELUDE + STEP_TIMEOUTS.format(local="FALSE") + STEP_NOTX_REHEARSE
+
+STEP_CALL_RECORD = r"""
+    \endif
+    SELECT :"psv_fn_schema".:"psv_{record}"('PsvAppStatus', :'psv_app', :psv_version, :'psv_signature',
+      :'psv_chain', :'psv_filename', :'psv_description', :'psv_cmd',
+      NULLIF(:'psv_step_start', '')::TIMESTAMP, NULLIF(:'psv_step_lsn', '')::PG_LSN) AS psv_recorded \gset
+    \if :psv_step_exec
+"""
+
+STEP_CALL_UNSET = r"""
+    \set psv_step_start ''
+    \set psv_step_lsn ''
+    \endif
+"""
+
+STEP_CALL_COMMIT = STEP_TX_END.format(rehearsed="TRUE") + STEP_CALL_UNSET
+
+STEP_CALL_NOTX_COMMIT = STEP_TX_END.format(rehearsed="FALSE") + STEP_CALL_UNSET
+
+STEP_CALL_END = STEP_TIMING_END + STEP_CALL_RECORD + STEP_CALL_COMMIT
+
+# recording transaction is only started after the non transactional step succeeded
+STEP_CALL_NOTX_END = r"""
+    \endif
+""" + STEP_TX + STEP_CALL_RECORD + STEP_RESET + STEP_CALL_NOTX_COMMIT
+
+STEP_CALL_BATCH_END = r"""
+    \endif
+""" + STEP_TX + STEP_CALL_RECORD + STEP_BATCH_DONE + STEP_RESET + STEP_CALL_NOTX_COMMIT
+
+# bundle step file is included only when needed
+STEP_INCLUDE = r"""    \ir {path}
+"""
+
+APP_FOOTER = REHEARSE_END + r"""
+  DROP TABLE PsvStepPlan;
+""" + APP_VERSION + r"""
+  -- end of steps
+  \endif
 \else
   -- do not apply steps
   \if :psv_dry
@@ -888,13 +1821,46 @@ SCRIPT_FOOTER = APP_VERSION + r"""
     \echo # psv skipping all steps for command :psv_cmd
   \endif
 \endif
+-- end of no step needed
+\endif
+-- end of unregister
+\endif
+-- end of history
+\endif
+
+-- end of application {app}
+"""
+
+SCRIPT_FOOTER = r"""
+\if :{{?psv_app_override}}
+  -- keep overriden name
+\else
+  \set psv_app {app}
+\endif
 
 -- final output
 \if :psv_dry
+  DROP VIEW PsvAppHead;
   DROP TABLE PsvAppStatus;
-  \echo # psv dry :psv_cmd for :psv_app done
+  \if :psv_rehearse
+    \if :psv_do_lock
+      SELECT pg_advisory_unlock_all() AS psv_unlocked \gset
+      \unset psv_unlocked
+    \endif
+    \echo # psv rehearse :psv_cmd for :psv_app done
+  \else
+    \echo # psv dry :psv_cmd for :psv_app done
+  \endif
 \else
+  DROP VIEW PsvAppHead;
   DROP VIEW PsvAppStatus;
+  \if :psv_compact
+""" + COMPACT + r"""
+  \endif
+  \if :psv_do_lock
+    SELECT pg_advisory_unlock_all() AS psv_unlocked \gset
+    \unset psv_unlocked
+  \endif
   \echo # psv wet :psv_cmd for :psv_app done
 \endif
 
@@ -0,0 +1,270 @@
+import argparse
+import gzip
+import json
+import logging
+import os
+import re
+import shlex
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .utils import log
+
+# psv output lines of interest
+PSV_VERSION = re.compile(r"# psv (\w+) version: (\d+)$")
+PSV_UNREGISTERED = re.compile(r"# psv (\w+) is not registered$")
+PSV_DONE = re.compile(r"# psv (dry|rehearse|wet) \S+ for \S+ done$")
+PSV_ERROR = re.compile(r"# (INTERNAL )?ERROR ")
+PSV_BUSY = re.compile(r"# BUSY ")
+PSV_WARN = re.compile(r"# WARN ")
+# lock timeout errors, with verbose psql error messages
+LOCK_TIMEOUT = re.compile(r"ERROR:\s+55P03:")
+
+# hide passwords from connection strings in reports
+PASSWORD = re.compile(r"(://[^:/@]*:)[^@]*(@)|(password\s*=\s*)('(\\.|[^'])*'|\S+)")
+
+def hide_password(dsn: str) -> str:
+    """Mask passwords in a connection string or URI."""
+    return PASSWORD.sub(lambda m: (m[1] + "***" + m[2]) if m[1] else (m[3] + "***"), dsn)
+
+class Outcome:
+    """Outcome of running a psv script on one database."""
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.status = "pending"
+        self.returncode: int|None = None
+        self.start = 0.0
+        self.duration = 0.0
+        self.versions: dict[str, int|None] = {}
+        self.messages: list[str] = []
+        self.attempts = 0
+        self.lock_timeout = False
+
+    def parse(self, output: str):
+        """Collect psv lines from psql output, later versions override earlier ones."""
+        done = False
+        errors = False
+        busy = False
+        for line in output.splitlines():
+            line = line.rstrip()
+            if not line.startswith("# "):
+                continue
+            if m := PSV_VERSION.match(line):
+                self.versions[m[1]] = int(m[2])
+            elif m := PSV_UNREGISTERED.match(line):
+                self.versions[m[1]] = None
+            elif PSV_DONE.match(line):
+                done = True
+            elif PSV_ERROR.match(line):
+                errors = True
+                self.messages.append(line[2:])
+            elif PSV_BUSY.match(line):
+                busy = True
+                self.messages.append(line[2:])
+            elif PSV_WARN.match(line):
+                self.messages.append(line[2:])
+        # busy runs fail on purpose, then psql exit code, then psv errors which quit "successfully"
+        if busy:
+            self.status = "busy"
+        elif self.returncode != 0:
+            self.status = "failed"
+        elif errors:
+            self.status = "error"
+        elif done:
+            self.status = "done"
+        else:
+            self.status = "incomplete"
+
+    def report(self) -> dict:
+        """JSON-compatible report."""
+        return {
+            "dsn": hide_password(self.dsn),
+            "status": self.status,
+            "returncode": self.returncode,
+            "start": self.start,
+            "duration": round(self.duration, 3),
+            "attempts": self.attempts,
+            "versions": self.versions,
+            "messages": self.messages,
+        }
+
+def run_psql(psql: list[str], dsn: str, script: bytes, timeout: float|None) -> Outcome:
+    """Run psql script once on one database, without ever raising."""
+
+    outcome = Outcome(dsn)
+    outcome.start = time.time()
+    t0 = time.monotonic()
+    try:
+        proc = subprocess.run(psql + ["-d", dsn], input=script, capture_output=True,
+                              timeout=timeout, check=False)
+        outcome.returncode = proc.returncode
+        stderr = proc.stderr.decode("UTF-8", "replace")
+        outcome.parse(proc.stdout.decode("UTF-8", "replace") + "\n" + stderr)
+        if proc.returncode != 0:
+            # keep psql error messages, such as connection failures
+            outcome.messages.extend(line for line in stderr.splitlines()
+                                    if line.startswith(("psql:", "ERROR:", "FATAL:")))
+            outcome.lock_timeout = LOCK_TIMEOUT.search(stderr) is not None
+    except subprocess.TimeoutExpired:
+        outcome.status = "timeout"
+        outcome.messages.append(f"timeout after {timeout} seconds")
+    except OSError as e:
+        outcome.status = "failed"
+        outcome.messages.append(str(e))
+    outcome.duration = time.monotonic() - t0
+
+    return outcome
+
+def run_one(psql: list[str], dsn: str, script: bytes, timeout: float|None,
+            retries: int = 0, backoff: float = 1.0) -> Outcome:
+    """Run psql script on one database, retrying on lock timeouts with exponential backoff.
+
+    Scripts are idempotent and a failed step is rolled back, so a retry
+    resumes from the first step which is still needed.
+    """
+
+    start, t0 = time.time(), time.monotonic()
+    attempt, outcome = 0, run_psql(psql, dsn, script, timeout)
+    while outcome.lock_timeout and attempt < retries:
+        delay = backoff * 2 ** attempt
+        log.info(f"{hide_password(dsn)}: lock timeout, retrying in {delay} s")
+        time.sleep(delay)
+        attempt += 1
+        outcome = run_psql(psql, dsn, script, timeout)
+    outcome.attempts = attempt + 1
+    outcome.start, outcome.duration = start, time.monotonic() - t0
+
+    log.info(f"{hide_password(dsn)}: {outcome.status} in {outcome.duration:.3f} s")
+
+    return outcome
+
+def load_dsns(args) -> list[str]:
+    """Get connection strings from arguments and files, ignoring empty lines and comments."""
+
+    dsns = list(args.dsn)
+    for filename in args.dsn_file:
+        with open(filename) if filename != "-" else sys.stdin as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    dsns.append(line)
+    return dsns
+
+def print_report(outcomes: list[Outcome], out):
+    """Show a human-readable aggregated report."""
+
+    width = max(len(hide_password(o.dsn)) for o in outcomes)
+    for o in outcomes:
+        versions = " ".join(f"{app}:{'-' if v is None else v}" for app, v in o.versions.items())
+        message = f" {o.messages[-1]}" if o.messages and o.status != "done" else ""
+        print(f"{hide_password(o.dsn):{width}} {o.status:10} {o.duration:8.3f} s {versions}{message}", file=out)
+
+    counts: dict[str, int] = {}
+    for o in outcomes:
+        counts[o.status] = counts.get(o.status, 0) + 1
+    total = sum(o.duration for o in outcomes)
+    summary = " ".join(f"{status}={n}" for status, n in sorted(counts.items()))
+    print(f"# psv run on {len(outcomes)} databases: {summary} (cumulated {total:.3f} s)", file=out)
+
+def psv_run(argv: list[str]):
+    """Run a psv-generated script on many databases."""
+
+    ap = argparse.ArgumentParser(
+            prog="pg-schema-version run",
+            description="Run a psv-generated psql script on many databases with bounded concurrency.",
+            epilog="All software have bugs…")
+    ap.add_argument("-d", "--debug", default=False, action="store_true",
+                    help="set debug mode")
+    ap.add_argument("-v", "--verbose", default=False, action="store_true",
+                    help="set verbose mode")
+    ap.add_argument("-f", "--file", type=str, required=True,
+                    help="psql script generated by psv, possibly compressed with .gz")
+    ap.add_argument("-c", "--command", type=str, default=None,
+                    help="psv command, e.g. 'apply:wet', default is the script default")
+    ap.add_argument("-l", "--lock", type=str, choices=["wait", "nowait", "none"], default=None,
+                    help="psv application lock mode, default is the script default")
+    ap.add_argument("-R", "--retries", type=int, default=0,
+                    help="number of retries on step lock timeouts, default is 0")
+    ap.add_argument("--backoff", type=float, default=1.0,
+                    help="initial delay in seconds before retrying, doubled on each retry, default is 1.0")
+    ap.add_argument("-D", "--dsn-file", type=str, action="append", default=[],
+                    help="file with one connection string per line, '-' for stdin, repeatable")
+    ap.add_argument("-j", "--jobs", type=int, default=4,
+                    help="number of databases processed concurrently, default is 4")
+    ap.add_argument("--timeout", type=float, default=None,
+                    help="per database timeout in seconds, default is none")
+    ap.add_argument("--psql", type=str, default="psql",
+                    help="psql command with options, default is 'psql'")
+    ap.add_argument("-r", "--report", type=str, default=None,
+                    help="JSON report output file, default is none")
+    ap.add_argument("dsn", nargs="*",
+                    help="database connection strings")
+    args = ap.parse_args(argv)
+
+    if args.debug:
+        log.setLevel(logging.DEBUG)
+    elif args.verbose:
+        log.setLevel(logging.INFO)
+
+    if args.jobs <= 0:
+        log.error(f"unexpected number of jobs: {args.jobs}")
+        return 1
+
+    if args.retries < 0 or args.backoff < 0:
+        log.error(f"unexpected retries or backoff: {args.retries} {args.backoff}")
+        return 1
+
+    if args.command is not None and not re.match(r"[\w:]+$", args.command):
+        log.error(f"unexpected psv command: {args.command}")
+        return 1
+
+    try:
+        dsns = load_dsns(args)
+        # passed as is to psql
+        with open(args.file, "rb") as f:
+            script = f.read()
+        if args.file.endswith(".gz"):
+            script = gzip.decompress(script)
+    except OSError as e:
+        log.error(str(e))
+        return 1
+
+    if not dsns:
+        log.error("no database to run on")
+        return 1
+
+    psql = shlex.split(args.psql) + ["-X", "-q"]
+    if args.command:
+        psql += ["-v", f"psv={args.command}"]
+    if args.lock:
+        psql += ["-v", f"psv_lock={args.lock}"]
+    if args.retries:
+        # show sqlstate to detect lock timeouts
+        psql += ["-v", "VERBOSITY=verbose"]
+
+    log.info(f"running {args.file} on {len(dsns)} databases with {args.jobs} jobs")
+
+    # results are reported in the order of the provided databases
+    outcomes: list[Outcome|None] = [None] * len(dsns)
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {executor.submit(run_one, psql, dsn, script, args.timeout, args.retries, args.backoff): i
+                   for i, dsn in enumerate(dsns)}
+        for future in as_completed(futures):
+            outcomes[futures[future]] = future.result()
+
+    results = [o for o in outcomes if o is not None]
+    assert len(results) == len(dsns)
+
+    print_report(results, sys.stdout)
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"psv_run": 1, "script": os.path.basename(args.file), "command": args.command,
+                       "databases": [o.report() for o in results]}, f, indent=2)
+            f.write("\n")
+
+    # 0 if all done, 2 if some databases did not make it
+    return 0 if all(o.status == "done" for o in results) else 2
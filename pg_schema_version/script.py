@@ -1,69 +1,426 @@
 import os
+import io
 import sys
 import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import argparse
 import hashlib
-from .utils import log, bytes_hash, squote, ScriptError
-from .psql import SCRIPT_HEADER, FILE_HEADER, FILE_FOOTER, SCRIPT_FOOTER
+import time
+from .utils import log, chain_hash, squote, open_text, ScriptError
+from .cache import ScriptCache
+from .lexer import Lexer
+from .runner import psv_run
+from .stats import GenStats, CountingWriter, show_stats, save_stats
+from .locks import LOCKS, LockAnalyzer, lock_level, lock_option, lock_report, show_locks, save_locks
+from .psql import SCRIPT_HEADER, APP_HEADER, UP_TO_DATE, UP_TO_DATE_QUIT, STEP_PLAN, STEP_FLAGS, \
+    STEP_INFO, STEP_BEGIN, STEP_END, STEP_CALL_BEGIN, STEP_CALL_END, STEP_TAIL, STEP_INCLUDE, \
+    STEP_NOTX_BEGIN, STEP_NOTX_END, STEP_CALL_NOTX_BEGIN, STEP_CALL_NOTX_END, STEP_CLEANUP, \
+    STEP_BATCH_CALL, STEP_BATCH_CALL_END, STEP_BATCH_END, STEP_CALL_BATCH_END, STEP_BASELINE_END, \
+    APP_FOOTER, SCRIPT_FOOTER, SINCE_GUARD
+
+# postgres allows at most 1664 columns in a target list
+FLAGS_CHUNK = 1000
+
+# scripts are read by chunks of characters
+CHUNK_SIZE = 1 << 20
+# psv header line maximum length
+HEADER_MAX = 4096
+
+# step header directives and their expected values
+DURATION = r"\d+(us|ms|s|min|h|d)?"
+DIRECTIVES = {
+    "lock_timeout": DURATION,
+    "statement_timeout": DURATION,
+    "transaction": r"on|off",
+    "batch": r"[1-9]\d*",
+}
+
+# batch step bodies are passed to the infra procedure as a dollar-quoted string
+BATCH_QUOTE = "$psv_batch$"
+
+# transaction commands at the beginning of a statement
+TRANSACTION = re.compile(r"(commit|rollback|savepoint)\b", re.IGNORECASE)
+
+# indexes created concurrently by non transactional steps
+CONCURRENT_INDEX = re.compile(
+    r"create\s+(unique\s+)?index\s+concurrently\s+(if\s+not\s+exists\s+)?"
+    r"((\"[^\"]+\"|\w+)(\.(\"[^\"]+\"|\w+))?)\s+on\b", re.IGNORECASE)
+
+# lexer states which must not be left open at the end of a script
+UNTERMINATED = {
+    "block": "block comment",
+    "string": "string literal",
+    "estring": "string literal",
+    "ident": "quoted identifier",
+    "dollar": "dollar-quoted string",
+}
+
+# bundle driver script and step files subdirectory
+BUNDLE_DRIVER = "psv.sql"
+BUNDLE_STEPS = "steps"
 
 class Script:
-    """Hold an SQL script."""
+    """Hold an SQL script, the body is streamed from its file on output."""
 
-    def __init__(self, filename: str, trust = False, hasher = "sha3_256", encoding = "UTF-8"):
-        # read
+    def __init__(self, filename: str, trust = False, hasher = "sha3_256", encoding = "UTF-8",
+                 cache: ScriptCache|None = None, header_only = False, chunk_size = CHUNK_SIZE):
         self._filename = filename
+        self._encoding = encoding
+        self._chunk_size = chunk_size
+        # warnings are reported by the caller, so that their order is deterministic
+        self._warnings: list[str] = []
+        # body is only kept for standard input, which cannot be read twice
+        self._body: str|None = None
+        # scan timings, not available for cached scripts
+        self._times: dict[str, float]|None = None
+        # signature is None when only the header was read
+        self._signature: str|None = None
         if filename == "-":
-            script = sys.stdin.read()
+            self._body = sys.stdin.read()
+            self._stat = None
+            self._scan(io.StringIO(self._body), trust, hasher)
+        elif header_only:
+            self._stat = self._fstat()
+            self._size = 0
+            with open_text(filename, "r", encoding) as f:
+                self._read_header(f)
         else:
-            with open(filename) as f:
-                script = f.read()
-        # checks
-        if not re.match(r"\s*--\s*psv\s*:", script):
+            self._stat = self._fstat()
+            fields = cache.get(filename, self._stat, hasher, encoding) if cache else None
+            if fields:
+                self._restore(fields, trust)
+            else:
+                with open_text(filename, "r", encoding) as f:
+                    self._scan(f, trust, hasher)
+                if cache:
+                    cache.put(filename, self._stat, hasher, encoding, self._fields())
+        # chained signature of all forward steps up to this one, if available
+        self._chain: str|None = None
+
+    def _fstat(self):
+        """File identity to detect changes between loading and output."""
+        st = os.stat(self._filename)
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _warn(self, msg: str):
+        """Record a warning once."""
+        if msg not in self._warnings:
+            self._warnings.append(msg)
+
+    def _found(self, what: str, status: int, trust: bool):
+        """Report a suspicious command, with its first line if known."""
+        where = f" at line {self._lines[what]}" if what in self._lines else ""
+        if trust:
+            self._warn(f"script {self._filename} seems to contain a {what} command{where}")
+        else:
+            raise ScriptError(status, f"script {self._filename} contains a {what} command{where}")
+
+    def _found_unterminated(self, state: str, trust: bool):
+        """Report a script ending within a comment or a quoted string."""
+        msg = f"script {self._filename} ends within a {UNTERMINATED[state]}"
+        if trust:
+            self._warn(msg)
+        else:
+            raise ScriptError(13, msg)
+
+    def _check_batch_quote(self):
+        """Reject batch steps which would break out of their quoted string."""
+        if self._batch_quote and "batch" in self._settings:
+            raise ScriptError(3, f"script {self._filename} batch step cannot contain {BATCH_QUOTE}")
+
+    def _check_backslash(self, line: int, trust: bool):
+        """Check a psql backslash command found by the lexer."""
+        self._backslash = True
+        self._lines.setdefault("backslash", line)
+        self._found("backslash", 4, trust)
+
+    def _check_statement(self, statement: str, line: int, trust: bool):
+        """Check the normalized beginning of a statement found by the lexer."""
+        if TRANSACTION.match(statement):
+            self._transaction = True
+            self._lines.setdefault("transaction", line)
+            self._found("transaction", 5, trust)
+        if self._notx() and (m := CONCURRENT_INDEX.match(statement)) and m.group(3) not in self._indexes:
+            self._indexes.append(m.group(3))
+        self._analyzer.statement(statement, line)
+
+    def _notx(self) -> bool:
+        """Whether the step is executed outside of a transaction."""
+        return self._settings.get("transaction") == "off" or "batch" in self._settings
+
+    def _fields(self) -> dict:
+        """Loaded fields, for caching."""
+        return {
+            "name": self._name, "forward": self._forward, "baseline": self._baseline, "version": self._version,
+            "description": self._description, "signature": self._signature,
+            "backslash": self._backslash, "transaction": self._transaction,
+            "size": self._size, "settings": self._settings, "indexes": self._indexes,
+            "lines": self._lines, "unterminated": self._unterminated, "locks": self._locks,
+            "batch_quote": self._batch_quote,
+        }
+
+    def _restore(self, fields: dict, trust: bool):
+        """Restore cached fields, checks are applied again."""
+        self._name = fields["name"]
+        self._forward = fields["forward"]
+        self._baseline = fields["baseline"]
+        self._version = fields["version"]
+        self._description = fields["description"]
+        self._signature = fields["signature"]
+        self._backslash = fields["backslash"]
+        self._transaction = fields["transaction"]
+        self._size = fields["size"]
+        self._settings = fields["settings"]
+        self._indexes = fields["indexes"]
+        self._lines = fields["lines"]
+        self._unterminated = fields["unterminated"]
+        self._locks = fields["locks"]
+        self._batch_quote = fields["batch_quote"]
+        if self._backslash:
+            self._found("backslash", 4, trust)
+        if self._transaction:
+            self._found("transaction", 5, trust)
+        if self._unterminated:
+            self._found_unterminated(self._unterminated, trust)
+        self._check_batch_quote()
+
+    def _check_header(self, header: str):
+        """Check and extract psv header."""
+        filename = self._filename
+        if not re.match(r"--\s*psv\s*:", header):
             raise ScriptError(2, f"script {filename} missing psv header: -- psv: …")
-        m = re.match(r"\s*--\s*psv\s*:\s*(\w+)\s*([-+])\s*(\d+)(\s+(.*?)\s*)?$", script, re.M)
+        m = re.match(r"--\s*psv\s*:\s*(\w+)\s*([-+=])\s*(\d+)(\s+(.*?)\s*)?$", header)
         if not m:
             raise ScriptError(3, f"script {filename} unexpected psv header")
-        if re.search(r"^\s*\\[a-zA-Z?!]", script, re.M):
-            if trust:
-                log.warning(f"script {filename} seems to contain a backslash command")
-            else:
-                raise ScriptError(4, f"script {filename} contains a backslash command")
-        if re.search(r"^\s*(commit|rollback|savepoint)\b", script, re.I|re.M):
-            if trust:
-                log.warning(f"script {filename} seems to contain a transaction command")
-            else:
-                raise ScriptError(5, f"script {filename} contains a transaction command")
-        # extract and store
-        self._script = script
         self._name = m.group(1)
-        self._forward = m.group(2) == "+"
+        self._forward = m.group(2) in ("+", "=")
+        self._baseline = m.group(2) == "="
         self._version = int(m.group(3))
         self._description = m.group(5)
+        # leading directives, e.g. lock_timeout=5s
+        self._settings: dict[str, str] = {}
+        while self._description and (d := re.match(r"(\w+)=(\S*)\s*", self._description)) \
+                and d.group(1) in DIRECTIVES:
+            if not re.fullmatch(DIRECTIVES[d.group(1)], d.group(2)):
+                raise ScriptError(3, f"script {filename} unexpected {d.group(1)} value: {d.group(2)}")
+            self._settings[d.group(1)] = d.group(2)
+            self._description = self._description[d.end():]
+        if "batch" in self._settings and self._settings.get("transaction") == "on":
+            raise ScriptError(3, f"script {filename} batch step cannot be transactional")
+        if self._baseline and self._notx():
+            raise ScriptError(3, f"script {filename} baseline step must be transactional")
         if not self._description:
-            self._description = f"{self._name} {'forward' if self._forward else 'reverse'} {self._version}"
-        self._signature = bytes_hash(hasher, script.encode(encoding))
-
-    def __str__(self):
-        """Generate psql script."""
-        out = FILE_HEADER.format(
-            file=self._filename, version=self._version,
-            signature=self._signature, description=squote(self._description),
-            filename=self._filename.split("/")[-1],
-            forward=1 if self._forward else 0,
-            operation="apply" if self._forward else "reverse",
-        )
-        out += self._script
-        out += FILE_FOOTER
-        return out
-
-def check_versions(scripts: list[Script], partial=False):
-    """Tell about version errors."""
+            self._description = f"{self._name} {self._operation()} {self._version}"
+
+    def _operation(self) -> str:
+        """Step operation."""
+        return "baseline" if self._baseline else "forward" if self._forward else "reverse"
+
+    def _read_header(self, f):
+        """Check the psv header line only, without reading the script body."""
+        head = ""
+        while True:
+            chunk = f.read(HEADER_MAX)
+            head += chunk
+            header, newline, _ = head.lstrip().partition("\n")
+            if len(header) > HEADER_MAX:
+                self._check_header(header[:HEADER_MAX])
+                raise ScriptError(3, f"script {self._filename} psv header is too long")
+            if newline or not chunk:
+                break
+        self._check_header(header)
+
+    def _scan(self, f, trust: bool, hasher: str):
+        """Hash, check header and lex a script by chunks, in one pass and bounded memory."""
+        h = hashlib.new(hasher)
+        self._backslash, self._transaction = False, False
+        self._indexes: list[str] = []
+        # first line of each suspicious command
+        self._lines: dict[str, int] = {}
+        self._unterminated: str|None = None
+        self._batch_quote = False
+        self._analyzer = LockAnalyzer()
+        self._size = 0
+        times = self._times = {"read": 0.0, "hash": 0.0, "check": 0.0}
+        lexer = Lexer(lambda statement, line: self._check_statement(statement, line, trust),
+                      lambda line: self._check_backslash(line, trust))
+        # beginning of the script until the end of its header line, which is a comment for the lexer
+        head, in_header = "", True
+        # end of the previous chunk, for a batch quote spanning chunks
+        tail = ""
+        while True:
+            t0 = time.perf_counter()
+            chunk = f.read(self._chunk_size)
+            t1 = time.perf_counter()
+            times["read"] += t1 - t0
+            if not chunk:
+                break
+            data = chunk.encode(self._encoding)
+            self._size += len(data)
+            h.update(data)
+            t2 = time.perf_counter()
+            times["hash"] += t2 - t1
+            tail += chunk
+            if BATCH_QUOTE in tail:
+                self._batch_quote = True
+            tail = tail[-len(BATCH_QUOTE) + 1:]
+            if in_header:
+                head += chunk
+                header, newline, _ = head.lstrip().partition("\n")
+                if len(header) > HEADER_MAX:
+                    self._check_header(header[:HEADER_MAX])
+                    raise ScriptError(3, f"script {self._filename} psv header is too long")
+                if newline:
+                    self._check_header(header)
+                    chunk, in_header = head, False
+            if not in_header:
+                lexer.feed(chunk)
+            times["check"] += time.perf_counter() - t2
+        # header without a newline
+        if in_header:
+            self._check_header(head.lstrip())
+            lexer.feed(head)
+        if state := lexer.end():
+            self._unterminated = state
+            self._found_unterminated(state, trust)
+        self._check_batch_quote()
+        self._locks = self._analyzer.report()
+        del self._analyzer
+        self._signature = h.hexdigest()
+
+    def plan(self, step: int) -> str:
+        """Generate step plan values."""
+        return (f"({step}, {self._version}, {'TRUE' if self._forward else 'FALSE'}, "
+                f"{'TRUE' if self._baseline else 'FALSE'}, "
+                f"'{self._signature}', {squote(self._chain) if self._chain else 'NULL'}, "
+                f"{squote(self._filename.split('/')[-1])}, "
+                f"{squote(self._description)})")
+
+    def _write_body(self, out):
+        """Stream the script body on out."""
+        if self._body is not None:
+            out.write(self._body)
+        else:
+            if self._fstat() != self._stat:
+                raise ScriptError(11, f"script {self._filename} changed during generation")
+            with open_text(self._filename, "r", self._encoding) as f:
+                shutil.copyfileobj(f, out, self._chunk_size)
+
+    def write(self, out, step: int, bundle: str|None = None, encoding: str = "UTF-8",
+              functions: bool = False):
+        """Generate psql script on out, streaming the script body.
+
+        With a bundle directory, the step is written to its own file which is
+        only included by the driver script when the step is needed.
+        With functions, step bookkeeping relies on psv infra functions.
+        Non transactional steps are executed statement by statement, after
+        dropping invalid indexes left by a previous interrupted execution.
+        Batch steps are a single statement run repeatedly by an infra procedure.
+        Baseline steps record all the versions they cover.
+        """
+        operation = "baseline" if self._baseline else "apply" if self._forward else "reverse"
+        notx, batch = self._notx(), self._settings.get("batch")
+        if self._baseline:
+            begin, end = STEP_BEGIN, STEP_BASELINE_END
+        elif functions:
+            begin = STEP_CALL_NOTX_BEGIN if notx else STEP_CALL_BEGIN
+            end = (STEP_CALL_BATCH_END if batch else STEP_CALL_NOTX_END if notx else STEP_CALL_END) \
+                .format(record="applied" if self._forward else "reversed")
+        else:
+            begin = STEP_NOTX_BEGIN if notx else STEP_BEGIN
+            end = STEP_BATCH_END if batch else STEP_NOTX_END if notx else STEP_END
+        if batch:
+            begin += STEP_BATCH_CALL.format(size=int(batch))
+            end = STEP_BATCH_CALL_END + end
+        if self._indexes:
+            begin += STEP_CLEANUP.format(
+                indexes=", ".join(f"to_regclass({squote(index)})" for index in self._indexes))
+        out.write(STEP_INFO.format(
+            file=self._filename, version=self._version, step=step,
+            signature=self._signature, chain=self._chain or "", description=squote(self._description),
+            filename=self._filename.split("/")[-1], operation=operation,
+            lock_timeout=self._settings.get("lock_timeout", ""),
+            statement_timeout=self._settings.get("statement_timeout", ""),
+        ))
+        if bundle is None:
+            out.write(begin)
+            self._write_body(out)
+            out.write(end)
+        else:
+            path = f"{BUNDLE_STEPS}/{self._name}_{step:04d}_{operation}_{self._version}.sql"
+            with open_text(os.path.join(bundle, path), "w", encoding) as f:
+                f.write(f"-- step {self._name} {operation} {self._version} from {self._filename}\n")
+                f.write(begin)
+                self._write_body(f)
+                f.write(end)
+            out.write(STEP_INCLUDE.format(path=path))
+        out.write(STEP_TAIL.format(
+            step=step,
+            direction="apply_catchup" if self._forward else "reverse",
+        ))
+
+def chain_scripts(forwards: list[Script], hasher = "sha3_256", baseline: Script|None = None) -> Script|None:
+    """Compute chained signatures of ordered forward steps, return the last chained one.
+
+    With a baseline, the chain goes through the steps it covers if they are all
+    available, otherwise it restarts from the baseline.
+    """
+    chain, last = "", None
+    if baseline:
+        covered = chain_scripts([s for s in forwards if s._version <= baseline._version], hasher)
+        if covered and covered._version == baseline._version:
+            chain = str(covered._chain)
+        else:
+            # chained scripts are fully loaded
+            assert baseline._signature is not None
+            chain = chain_hash(hasher, "", baseline._signature)
+        baseline._chain = chain
+        last = baseline
+        forwards = [s for s in forwards if s._version > baseline._version]
+    for script in forwards:
+        if last and script._version == last._version:
+            # repeated version, ignored
+            continue
+        if script._version != (last._version if last else 0) + 1:
+            # missing version, stop the chain
+            break
+        assert script._signature is not None
+        chain = chain_hash(hasher, chain, script._signature)
+        script._chain = chain
+        last = script
+    return last
+
+def gen_step_plan(scripts: list[Script]) -> str:
+    """Generate psql step plan and per-step flags."""
+    if scripts:
+        steps = "      VALUES\n" + ",\n".join(
+            "        " + script.plan(step) for step, script in enumerate(scripts, 1))
+    else:
+        steps = "      SELECT NULL::INT, NULL::INT, NULL::BOOLEAN, NULL::BOOLEAN, NULL::TEXT, NULL::TEXT, NULL::TEXT, NULL::TEXT WHERE FALSE"
+    out = STEP_PLAN.format(steps=steps)
+    for chunk in range(1, len(scripts) + 1, FLAGS_CHUNK):
+        last = min(chunk + FLAGS_CHUNK, len(scripts) + 1)
+        flags = ",\n".join(f"    needed[{step}] AS psv_step_{step}" for step in range(chunk, last))
+        out += STEP_FLAGS.format(flags=flags)
+    return out
+
+def gen_since_guard(scripts: list[Script], since: int) -> str:
+    """Generate psql guard for a script without the steps up to the since version."""
+    signatures = sorted({s._signature for s in scripts
+                         if s._version == since and s._forward and s._signature is not None})
+    if not signatures:
+        raise ScriptError(8, f"missing since version: {since}")
+    return SINCE_GUARD.format(version=since, signatures=", ".join(f"'{sig}'" for sig in signatures))
+
+def check_versions(scripts: list[Script], partial=False, base=0):
+    """Tell about version errors, versions covered by a baseline are optional."""
     bads = set(filter(lambda s: s._version < 1, scripts))
     # version < 1
     if bads:
         raise ScriptError(6, f"unexpected non positive versions: {' '.join(str(v._version) for v in bads)}")
-    versions = set(s._version for s in scripts)
+    versions = {s._version for s in scripts}
     # repeated
     if len(versions) != len(scripts):
         seen, repeated = set(), set()
@@ -79,69 +436,201 @@ def check_versions(scripts: list[Script], partial=False):
             raise ScriptError(7, msg)
     # missing
     latest = max(s._version for s in scripts)
-    expected = set(range(1, latest+1))
-    if len(versions) != len(expected):
-        msg = f"missing versions: {' '.join(str(v) for v in sorted(expected - versions))}"
+    missing = set(range(base+1, latest+1)) - versions
+    if missing:
+        msg = f"missing versions: {' '.join(str(v) for v in sorted(missing))}"
         if partial:
             log.warning(msg)
         else:
             raise ScriptError(8, msg)
 
-def gen_psql_script(args):
-    """Generate an idempotent psql script."""
+def check_locks(steps: dict[str, list[Script]], max_lock: str):
+    """Enforce the maximum table lock taken by steps."""
+    level = lock_level(max_lock)
+    for app_steps in steps.values():
+        for script in app_steps:
+            locks = script._locks
+            if locks["max"] and LOCKS.index(locks["max"]) > level:
+                stmt = next((s for s in locks["statements"] if LOCKS.index(s["lock"]) > level), None)
+                where = f" for {stmt['operation']} at line {stmt['line']}" if stmt else ""
+                raise ScriptError(14, f"script {script._filename} requires lock {locks['max']}{where}, "
+                                      f"beyond {LOCKS[level]}")
 
-    log.info(f"loading {len(args.sql)} scripts…")
+def in_window(script: Script, since: int) -> bool:
+    """Whether a step is needed by a script since this version, including the guard one."""
+    return script._version > since or script._version == since and script._forward
 
-    # load all scripts
-    scripts = [Script(fn, args.trust_scripts, args.hash, args.encoding) for fn in args.sql]
-
-    # check name consistency
-    if not args.app and scripts:
-        args.app = scripts[0]._name
-    if args.app:
-        log.info(f"considering scripts for application {args.app}")
-        bad_names = [script for script in scripts if script._name != args.app]
-        if bad_names:
-            filenames = ", ".join(script._filename for script in scripts)
-            raise ScriptError(9, f"inconsistent application name found in: {filenames}")
+def load_scripts(args) -> list[Script]:
+    """Load, check and hash scripts, possibly in parallel, in order.
 
-    # order and check versions
-    forwards = sorted((s for s in scripts if s._forward), key=lambda s: s._version)
+    With a since version, only headers are read for steps outside the window.
+    """
+
+    cache = ScriptCache(args.cache, args.cache_size) if args.cache else None
+
+    def load(filename: str) -> Script:
+        return Script(filename, args.trust_scripts, args.hash, args.encoding, cache, chunk_size=args.chunk_size)
+
+    if args.since is not None:
+        # standard input is always fully loaded
+        headers = [Script(fn, args.trust_scripts, args.hash, args.encoding, header_only=True,
+                          chunk_size=args.chunk_size) for fn in args.sql]
+        todo = [i for i, s in enumerate(headers) if s._signature is None and in_window(s, args.since)]
+        log.info(f"loading {len(todo)} scripts since version {args.since}")
+    else:
+        headers, todo = [], list(range(len(args.sql)))
+    filenames = [args.sql[i] for i in todo]
+
+    jobs = args.jobs or os.cpu_count() or 1
+    if jobs == 1 or len(filenames) <= 1:
+        loaded = [load(fn) for fn in filenames]
+    else:
+        log.info(f"loading with {jobs} jobs")
+        pool = ThreadPoolExecutor(max_workers=jobs)
+        try:
+            # results and errors are reported in order
+            loaded = list(pool.map(load, filenames))
+        finally:
+            pool.shutdown(cancel_futures=True)
+
+    if args.since is None:
+        scripts = loaded
+    else:
+        scripts = headers
+        for i, script in zip(todo, loaded):
+            scripts[i] = script
+
+    for script in scripts:
+        for msg in script._warnings:
+            log.warning(msg)
+
+    if cache:
+        cache.save()
+
+    return scripts
+
+def order_scripts(scripts: list[Script], partial=False) -> list[Script]:
+    """Order and check application scripts versions, baseline then forwards first."""
+
+    baselines = [s for s in scripts if s._baseline]
+    if len(baselines) > 1:
+        raise ScriptError(7, f"several baselines: {' '.join(str(s._version) for s in baselines)}")
+    if baselines and baselines[0]._version < 1:
+        raise ScriptError(6, f"unexpected non positive baseline version: {baselines[0]._version}")
+    base = baselines[0]._version if baselines else 0
+
+    forwards = sorted((s for s in scripts if s._forward and not s._baseline), key=lambda s: s._version)
     if forwards:
-        check_versions(forwards, args.partial)
+        check_versions(forwards, partial, base)
 
     backwards = sorted((s for s in scripts if not s._forward), key=lambda s: s._version, reverse=True)
     if backwards:
-        check_versions(backwards, args.partial)
+        check_versions(backwards, partial, base)
 
-    assert len(forwards) + len(backwards) == len(scripts)
+    assert len(baselines) + len(forwards) + len(backwards) == len(scripts)
 
     if backwards and len(forwards) != len(backwards):
-        if args.partial:
+        if partial:
             log.warning("asymmetrical steps")
         else:
             raise ScriptError(10, "asymmetrical steps")
 
+    return baselines + forwards + backwards
+
+def gen_psql_script(args):
+    """Generate an idempotent psql script."""
+
+    stats = GenStats()
+
+    log.info(f"loading {len(args.sql)} scripts…")
+
+    # load all scripts
+    scripts = load_scripts(args)
+    stats.lap("load")
+
+    # group scripts per application, in order of first appearance
+    apps: dict[str, list[Script]] = {}
+    if args.multi:
+        for script in scripts:
+            apps.setdefault(script._name, []).append(script)
+        log.info(f"considering scripts for applications {' '.join(apps)}")
+    else:
+        # check name consistency
+        if not args.app and scripts:
+            args.app = scripts[0]._name
+        if args.app:
+            log.info(f"considering scripts for application {args.app}")
+            bad_names = [script for script in scripts if script._name != args.app]
+            if bad_names:
+                filenames = ", ".join(script._filename for script in scripts)
+                raise ScriptError(9, f"inconsistent application name found in: {filenames}")
+        apps[str(args.app)] = scripts
+
+    # order and check versions
+    steps = {app: order_scripts(app_scripts, args.partial) for app, app_scripts in apps.items()}
+    if args.since is None:
+        latests = {app: chain_scripts([s for s in app_steps if s._forward and not s._baseline], args.hash,
+                                      next((s for s in app_steps if s._baseline), None))
+                   for app, app_steps in steps.items()}
+        guards = {app: "" for app in steps}
+    else:
+        # chained signatures are not available without previous steps
+        latests = {app: None for app in steps}
+        guards = {app: gen_since_guard(app_steps, args.since) for app, app_steps in steps.items()}
+        steps = {app: [s for s in app_steps if s._version > args.since and not s._baseline]
+                 for app, app_steps in steps.items()}
+    if args.locks:
+        report = lock_report(steps)
+        if args.locks == "-":
+            show_locks(report)
+        else:
+            save_locks(report, args.locks)
+    if args.max_lock:
+        check_locks(steps, args.max_lock)
+    stats.lap("validate")
+
     # actual psql generation
-    log.info("generating schema construction script for {args.app}")
+    names = ",".join(apps)
+    log.info(f"generating schema construction script for {names}")
+
+    out = CountingWriter(args.out, args.encoding) if args.stats else args.out
 
     def output(s: str):
-        print(s, file=args.out, end="")
+        print(s, file=out, end="")
 
-    output(SCRIPT_HEADER.format(app=args.app, schema=squote(args.schema), table=squote(args.table)))
-    for script in forwards + backwards:
-        log.info(f"considering file {script._filename} for step {args.app} {script._version}")
-        output(str(script))
-    output(SCRIPT_FOOTER.format(app=args.app))
+    output(SCRIPT_HEADER.format(app=names, apps="{" + names + "}", multi=1 if len(apps) > 1 else 0,
+                                schema=squote(args.schema), table=squote(args.table)))
 
-    log.info(f"generation for {args.app} done")
+    for app, app_steps in steps.items():
+        forwards = [s for s in app_steps if s._forward]
+        latest = latests[app]
+        output(APP_HEADER.format(app=app, since=guards[app]))
+        if latest and latest._version == forwards[-1]._version:
+            output(UP_TO_DATE.format(version=latest._version, chain=latest._chain))
+            if len(apps) == 1:
+                output(UP_TO_DATE_QUIT)
+        output(gen_step_plan(app_steps))
+        for step, script in enumerate(app_steps, 1):
+            log.info(f"considering file {script._filename} for step {app} {script._version}")
+            script.write(out, step, args.bundle, args.encoding, args.functions)
+        output(APP_FOOTER.format(app=app))
 
-    return 0
+    output(SCRIPT_FOOTER.format(app=names))
+    stats.lap("emit")
 
-def psv():
-    """Actual Postgres schema version script."""
+    log.info(f"generation for {names} done")
 
-    logging.basicConfig(level=logging.WARN)
+    if args.stats:
+        report = stats.report(args, scripts, [s for app_steps in steps.values() for s in app_steps], out)
+        if args.stats == "-":
+            show_stats(report)
+        else:
+            save_stats(report, args.stats)
+
+    return 0
+
+def psv_parser() -> argparse.ArgumentParser:
+    """Main command line options, also the generation defaults of subcommands."""
 
     ap = argparse.ArgumentParser(
             prog="pg-schema-version",
@@ -155,6 +644,8 @@ def psv():
                     help="set verbose mode")
     ap.add_argument("-a", "--app", type=str, default=None,
                     help="expected application name")
+    ap.add_argument("-m", "--multi", default=False, action="store_true",
+                    help="allow several applications, processed in order of first appearance")
     ap.add_argument("-s", "--schema", type=str, default="public",
                     help="schema name for psv infra, default is 'public'")
     ap.add_argument("-t", "--table", type=str, default="psv_app_status",
@@ -164,14 +655,52 @@ def psv():
     ap.add_argument("-H", "--hash", type=str, default="sha3_256",
                     help="hashlib algorithm for step signature, default is 'sha3_256'")
     ap.add_argument("-o", "--out", type=str, default=sys.stdout,
-                    help="output script, default on stdout")
+                    help="output script, default on stdout, compressed if ending with .gz")
+    ap.add_argument("-b", "--bundle", type=str, default=None,
+                    help=f"output directory for a {BUNDLE_DRIVER} driver script and one file per step")
+    ap.add_argument("-F", "--functions", default=False, action="store_true",
+                    help="use psv infra functions for step bookkeeping, for smaller scripts")
     ap.add_argument("-p", "--partial", default=False, action="store_true",
                     help="allow partial scripts")
+    ap.add_argument("-j", "--jobs", type=int, default=1,
+                    help="number of parallel jobs for loading scripts, 0 for all cpus, default is 1")
+    ap.add_argument("-C", "--cache", type=str, default=None,
+                    help="cache file for script headers, signatures and checks, default is none")
+    ap.add_argument("--cache-size", type=int, default=10000,
+                    help="maximum number of cached scripts, default is 10000")
+    ap.add_argument("--stats", type=str, nargs="?", const="-", default=None,
+                    help="show generation statistics on stderr, or save them as JSON with --stats=FILE")
+    ap.add_argument("--locks", type=str, nargs="?", const="-", default=None,
+                    help="show step table lock analysis on stderr, or save it as JSON with --locks=FILE")
+    ap.add_argument("--max-lock", type=str, default=None, metavar="LOCK",
+                    choices=[lock_option(level) for level in range(len(LOCKS))],
+                    help="fail if a step takes a stronger table lock, e.g. 'share_update_exclusive'")
+    ap.add_argument("-S", "--since", type=int, default=None, metavar="VERSION",
+                    help="only include steps after this version, which applications must have reached")
     ap.add_argument("-T", "--trust-scripts", default=False, action="store_true",
                     help="blindly trust provided scripts")
+    # read size, small values exercise the lexer state across chunks in tests
+    ap.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help=argparse.SUPPRESS)
     ap.add_argument("sql", nargs="*",
-                    help="sql schema definition files")
-    args = ap.parse_args()
+                    help="sql schema definition files, possibly compressed with .gz")
+
+    return ap
+
+def psv():
+    """Actual Postgres schema version script."""
+
+    logging.basicConfig(level=logging.WARN)
+
+    # fleet runner subcommand
+    if len(sys.argv) > 1 and sys.argv[1] == "run":
+        return psv_run(sys.argv[2:])
+
+    # template database subcommand
+    if len(sys.argv) > 1 and sys.argv[1] == "template":
+        from .template import psv_template
+        return psv_template(sys.argv[2:])
+
+    args = psv_parser().parse_args()
 
     if args.debug:
         log.setLevel(logging.DEBUG)
@@ -183,19 +712,57 @@ def psv():
         print(f"{sys.argv[0]} version {pkg_version('pg-schema-version')}")
         return 0
 
+    if args.app is not None and args.multi:
+        log.error("cannot expect an application name with several applications")
+        return 1
+
     if args.app is not None and not re.match(r"\w+$", args.app):
         log.error(f"unexpected app name: {args.app}")
         return 1
 
+    if args.jobs < 0:
+        log.error(f"unexpected number of jobs: {args.jobs}")
+        return 1
+
+    if args.chunk_size < 1:
+        log.error(f"unexpected chunk size: {args.chunk_size}")
+        return 1
+
+    if args.since is not None and args.since < 1:
+        log.error(f"unexpected since version: {args.since}")
+        return 1
+
+    if args.since is not None and args.multi:
+        log.error("cannot use a since version with several applications")
+        return 1
+
+    if args.stats is not None and re.search(r"\.sql(\.gz)?$", args.stats):
+        log.error(f"unexpected stats file {args.stats}, use --stats=FILE")
+        return 1
+
+    if args.locks is not None and re.search(r"\.sql(\.gz)?$", args.locks):
+        log.error(f"unexpected locks file {args.locks}, use --locks=FILE")
+        return 1
+
     if args.hash not in hashlib.algorithms_available:
         log.error(f"unexpected hash algorithm: {args.hash}")
         return 1
 
+    if args.bundle is not None:
+        if isinstance(args.out, str):
+            log.error("cannot use both output and bundle options")
+            return 1
+        if os.path.exists(args.bundle):
+            log.error(f"psv will not overwrite bundle directory {args.bundle}, remove it first")
+            return 1
+        os.makedirs(os.path.join(args.bundle, BUNDLE_STEPS))
+        args.out = open_text(os.path.join(args.bundle, BUNDLE_DRIVER), "w", args.encoding)
+
     if isinstance(args.out, str):
         if os.path.exists(args.out):
             log.error(f"psv will not overwrite output file {args.out}, remove it first")
             return 1
-        args.out = open(args.out, "w")
+        args.out = open_text(args.out, "w", args.encoding)
 
     try:
         return gen_psql_script(args)
@@ -204,3 +771,6 @@ def psv():
         if args.debug:
             raise
         return e.status
+    finally:
+        if args.out is not sys.stdout:
+            args.out.close()
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import sys
+import time
+
+# sample size for measuring hash algorithms throughput
+HASH_SAMPLE = 1 << 22
+# number of largest steps reported
+LARGEST = 10
+
+class CountingWriter:
+    """Text output wrapper which counts written bytes."""
+
+    def __init__(self, out, encoding: str = "UTF-8"):
+        self._out = out
+        self._encoding = encoding
+        self.bytes = 0
+
+    def write(self, s: str):
+        self.bytes += len(s.encode(self._encoding))
+        return self._out.write(s)
+
+def hash_throughputs(size: int = HASH_SAMPLE) -> dict[str, float]:
+    """Measure hashlib guaranteed algorithms throughput in MB/s."""
+    data = bytes(range(256)) * (size // 256)
+    throughputs = {}
+    for algo in sorted(hashlib.algorithms_guaranteed):
+        # variable length digests are not usable as signatures
+        if algo.startswith("shake_"):
+            continue
+        t0 = time.perf_counter()
+        hashlib.new(algo, data).hexdigest()
+        throughputs[algo] = round(len(data) / 1e6 / max(time.perf_counter() - t0, 1e-9), 1)
+    return throughputs
+
+class GenStats:
+    """Generation profiling statistics."""
+
+    def __init__(self):
+        self._start = self._last = time.perf_counter()
+        self._phases: dict[str, float] = {}
+
+    def lap(self, phase: str):
+        """Record wall time spent in a generation phase since the previous one."""
+        now = time.perf_counter()
+        self._phases[phase] = now - self._last
+        self._last = now
+
+    def report(self, args, scripts: list, emitted: list, out: CountingWriter) -> dict:
+        """Build statistics from loaded scripts, emitted steps and output."""
+        loaded = [s for s in scripts if s._times is not None]
+        # scripts outside of a since window
+        headers = sum(1 for s in scripts if s._signature is None)
+        read, hashed, checked = (sum(s._times[k] for s in loaded) for k in ("read", "hash", "check"))
+        read_bytes = sum(s._size for s in loaded)
+        # scripts before a since version are only loaded for their headers
+        body_bytes = sum(s._size for s in emitted)
+        largest = sorted((s for s in scripts if s._signature is not None),
+                         key=lambda s: s._size, reverse=True)[:LARGEST]
+        return {
+            "psv_stats": 1,
+            "scripts": len(scripts),
+            "cached": len(scripts) - len(loaded) - headers,
+            "headers": headers,
+            "jobs": args.jobs or None,
+            "hash": args.hash,
+            "seconds": {
+                "total": time.perf_counter() - self._start,
+                **self._phases,
+                # cumulated over loading jobs
+                "read": read,
+                "hash": hashed,
+                "check": checked,
+            },
+            "bytes": {
+                "read": read_bytes,
+                "written": out.bytes,
+                "bodies": body_bytes,
+                "boilerplate": out.bytes if args.bundle else out.bytes - body_bytes,
+            },
+            "hash_throughput": {
+                # MB/s on actual scripts, then on a sample for each algorithm
+                "actual": round(read_bytes / 1e6 / hashed, 1) if hashed > 0 else None,
+                **hash_throughputs(),
+            },
+            "largest": [{"filename": s._filename, "bytes": s._size} for s in largest],
+        }
+
+def show_stats(stats: dict, out=sys.stderr):
+    """Show human-readable statistics."""
+    sec, size, hashes = stats["seconds"], stats["bytes"], stats["hash_throughput"]
+    headers = f", {stats['headers']} headers only" if stats["headers"] else ""
+    print(f"psv stats: {stats['scripts']} scripts ({stats['cached']} cached{headers}) in {sec['total']:.3f} s",
+          file=out)
+    for phase in ("load", "validate", "emit"):
+        if phase in sec:
+            print(f"  {phase}: {sec[phase]:.3f} s", file=out)
+    print(f"  loading jobs cumulated: read {sec['read']:.3f} s, hash {sec['hash']:.3f} s, "
+          f"check {sec['check']:.3f} s", file=out)
+    print(f"  bytes: read {size['read']}, written {size['written']}, "
+          f"bodies {size['bodies']}, boilerplate {size['boilerplate']}", file=out)
+    others = ", ".join(f"{algo} {mbs}" for algo, mbs in hashes.items() if algo != "actual")
+    print(f"  hash MB/s: {stats['hash']} actual {hashes['actual']}; sample {others}", file=out)
+    for script in stats["largest"]:
+        print(f"  large: {script['filename']} {script['bytes']}", file=out)
+
+def save_stats(stats: dict, path: str):
+    """Write statistics as JSON."""
+    with open(path, "w") as f:
+        json.dump(stats, f, indent=2)
+        f.write("\n")
@@ -0,0 +1,227 @@
+import argparse
+import hashlib
+import io
+import json
+import logging
+import re
+import shlex
+import subprocess
+import time
+
+from .runner import run_psql
+from .utils import ScriptError, chain_hash, log, squote
+
+# postgres identifiers are truncated beyond this length
+NAME_MAX = 63
+# template key length, in hexadecimal digits
+KEY_LEN = 12
+
+def dquote(s: str) -> str:
+    """Double quote an identifier for postgres."""
+    return '"' + s.replace('"', '""') + '"'
+
+def template_key(hasher: str, schema: str, table: str, steps: dict[str, list]) -> str:
+    """Key of the migrated schema, from psv infra and ordered step signatures of all applications."""
+    key = chain_hash(hasher, "", f"{schema}.{table}")
+    for app, scripts in steps.items():
+        key = chain_hash(hasher, key, app)
+        for script in scripts:
+            key = chain_hash(hasher, key, script._signature)
+    return key[:KEY_LEN]
+
+class Templates:
+    """Template databases management through psql on a maintenance database."""
+
+    def __init__(self, psql: list[str], maintenance: str, prefix: str, app: str):
+        self._psql = psql
+        self._maintenance = maintenance
+        self._prefix = prefix
+        self._app = app
+
+    def sql(self, *commands: str) -> str:
+        """Execute SQL commands, each in its own transaction, return unaligned output."""
+        cmd = self._psql + ["-X", "-q", "-tA", "-v", "ON_ERROR_STOP=1", "-d", self._maintenance]
+        for command in commands:
+            cmd += ["-c", command]
+        log.debug(f"running: {shlex.join(cmd)}")
+        try:
+            proc = subprocess.run(cmd, capture_output=True, text=True, check=False)
+        except OSError as e:
+            raise ScriptError(12, str(e))
+        if proc.returncode != 0:
+            raise ScriptError(12, f"psql failed: {proc.stderr.strip()}")
+        return proc.stdout
+
+    def name(self, key: str) -> str:
+        """Template database name, within postgres identifier length."""
+        return f"{self._prefix}_{self._app}"[:NAME_MAX - KEY_LEN - 1] + "_" + key
+
+    def list(self) -> dict[str, dict]:
+        """Templates of this prefix and application, with their psv metadata."""
+        templates = {}
+        for line in self.sql("SELECT datname, shobj_description(oid, 'pg_database') "
+                             "FROM pg_catalog.pg_database WHERE datistemplate").splitlines():
+            name, _, comment = line.partition("|")
+            try:
+                meta = json.loads(comment)
+            except ValueError:
+                continue
+            if (isinstance(meta, dict) and meta.get("psv_template") == 1 and
+                    meta.get("prefix") == self._prefix and meta.get("app") == self._app):
+                templates[name] = meta
+        return templates
+
+    def touch(self, name: str, key: str):
+        """Record template metadata, including its last use for retention."""
+        meta = {"psv_template": 1, "prefix": self._prefix, "app": self._app, "key": key, "used": time.time()}
+        self.sql(f"COMMENT ON DATABASE {dquote(name)} IS {squote(json.dumps(meta))}")
+
+    def build(self, name: str, key: str, script: bytes):
+        """Build a template by running a psv script on a new database, then renaming it."""
+        building = name[:NAME_MAX - 8] + "_b" + str(time.time_ns() % 1000000)
+        log.info(f"building template {name} as {building}")
+        self.sql(f"CREATE DATABASE {dquote(building)}")
+        outcome = run_psql(self._psql + ["-X", "-q", "-v", "psv=create:wet"], building, script, None)
+        if outcome.status != "done":
+            self.drop(building)
+            raise ScriptError(12, f"template build failed: {'; '.join(outcome.messages)}")
+        self.sql(f"ALTER DATABASE {dquote(building)} WITH IS_TEMPLATE TRUE ALLOW_CONNECTIONS FALSE")
+        self.touch(building, key)
+        try:
+            self.sql(f"ALTER DATABASE {dquote(building)} RENAME TO {dquote(name)}")
+        except ScriptError:
+            # probably built concurrently
+            self.drop(building)
+            if name not in self.list():
+                raise
+
+    def drop(self, name: str):
+        """Drop a template database."""
+        log.info(f"dropping template {name}")
+        self.sql(f"ALTER DATABASE {dquote(name)} WITH IS_TEMPLATE FALSE",
+                 f"DROP DATABASE IF EXISTS {dquote(name)}")
+
+    def retain(self, current: str, keep: int):
+        """Drop least recently used templates beyond keep, the current one is kept."""
+        templates = self.list()
+        others = sorted((n for n in templates if n != current),
+                        key=lambda n: templates[n].get("used", 0), reverse=True)
+        for name in others[max(keep - 1, 0):]:
+            self.drop(name)
+
+def psv_template(argv: list[str]):
+    """Maintain a pre-migrated template database keyed by step signatures."""
+
+    # avoid circular imports with the main command
+    from .script import gen_psql_script, load_scripts, order_scripts, psv_parser
+
+    ap = argparse.ArgumentParser(
+            prog="pg-schema-version template",
+            description="Maintain a pre-migrated template database for creating application databases quickly.",
+            epilog="All software have bugs…")
+    ap.add_argument("-d", "--debug", default=False, action="store_true",
+                    help="set debug mode")
+    ap.add_argument("-v", "--verbose", default=False, action="store_true",
+                    help="set verbose mode")
+    ap.add_argument("-a", "--app", type=str, default=None,
+                    help="expected application name")
+    ap.add_argument("-m", "--multi", default=False, action="store_true",
+                    help="allow several applications, processed in order of first appearance")
+    ap.add_argument("-s", "--schema", type=str, default="public",
+                    help="schema name for psv infra, default is 'public'")
+    ap.add_argument("-t", "--table", type=str, default="psv_app_status",
+                    help="table name for psv infra, default is 'psv_app_status'")
+    ap.add_argument("-e", "--encoding", type=str, default="UTF-8",
+                    help="sql file encoding, default is 'UTF-8'")
+    ap.add_argument("-H", "--hash", type=str, default="sha3_256",
+                    help="hashlib algorithm for step signature, default is 'sha3_256'")
+    ap.add_argument("-T", "--trust-scripts", default=False, action="store_true",
+                    help="blindly trust provided scripts")
+    ap.add_argument("-D", "--maintenance-db", type=str, default="postgres",
+                    help="database to connect to for managing templates, default is 'postgres'")
+    ap.add_argument("-P", "--prefix", type=str, default="psv_tpl",
+                    help="template database name prefix, default is 'psv_tpl'")
+    ap.add_argument("-k", "--keep", type=int, default=3,
+                    help="number of templates kept per application, default is 3")
+    ap.add_argument("-c", "--create", type=str, action="append", default=[],
+                    help="create a database from the template, repeatable")
+    ap.add_argument("--drop", default=False, action="store_true",
+                    help="drop all templates of the application and exit")
+    ap.add_argument("--psql", type=str, default="psql",
+                    help="psql command with options, default is 'psql'")
+    ap.add_argument("sql", nargs="*",
+                    help="sql schema definition files, possibly compressed with .gz")
+    # generation options which are not relevant to templates keep the main command defaults
+    args = argparse.Namespace(**{**vars(psv_parser().parse_args([])), **vars(ap.parse_args(argv))})
+
+    if args.debug:
+        log.setLevel(logging.DEBUG)
+    elif args.verbose:
+        log.setLevel(logging.INFO)
+
+    if args.keep < 1:
+        log.error(f"unexpected number of kept templates: {args.keep}")
+        return 1
+
+    if args.hash not in hashlib.algorithms_available:
+        log.error(f"unexpected hash algorithm: {args.hash}")
+        return 1
+
+    if not re.match(r"\w+$", args.prefix):
+        log.error(f"unexpected template prefix: {args.prefix}")
+        return 1
+
+    if args.app is not None and (args.multi or not re.match(r"\w+$", args.app)):
+        log.error(f"unexpected app name: {args.app}")
+        return 1
+
+    if not args.sql:
+        log.error("no scripts to build a template from")
+        return 1
+
+    try:
+        scripts = load_scripts(args)
+        apps: dict[str, list] = {}
+        for script in scripts:
+            apps.setdefault(script._name, []).append(script)
+        if len(apps) > 1 and not args.multi:
+            raise ScriptError(9, f"inconsistent application names: {' '.join(apps)}")
+        if args.app is not None and args.app not in apps:
+            raise ScriptError(9, f"unexpected application name: {' '.join(apps)}")
+        steps = {app: order_scripts(app_scripts) for app, app_scripts in apps.items()}
+        app = "_".join(apps)
+
+        templates = Templates(shlex.split(args.psql), args.maintenance_db, args.prefix, app)
+
+        if args.drop:
+            for name in templates.list():
+                templates.drop(name)
+            return 0
+
+        key = template_key(args.hash, args.schema, args.table, steps)
+        name = templates.name(key)
+
+        if name in templates.list():
+            log.info(f"reusing template {name}")
+            templates.touch(name, key)
+        else:
+            out = io.StringIO()
+            args.out = out
+            gen_psql_script(args)
+            templates.build(name, key, out.getvalue().encode(args.encoding))
+
+        templates.retain(name, args.keep)
+
+        for dbname in args.create:
+            log.info(f"creating database {dbname} from template {name}")
+            templates.sql(f"CREATE DATABASE {dquote(dbname)} TEMPLATE {dquote(name)}")
+
+    except ScriptError as e:
+        log.error(str(e))
+        if args.debug:
+            raise
+        return e.status
+
+    print(name)
+
+    return 0
@@ -1,5 +1,8 @@
 import logging
 import hashlib
+import gzip
+import io
+from typing import IO
 
 log = logging.getLogger("psv")
 
@@ -16,6 +19,16 @@ def bytes_hash(algo: str, data: bytes) -> str:
     h.update(data)
     return h.hexdigest()
 
+def chain_hash(algo: str, previous: str, signature: str) -> str:
+    """Chain a signature to the previous chained signature."""
+    return bytes_hash(algo, f"{previous}:{signature}".encode("ASCII"))
+
+def open_text(filename: str, mode: str, encoding: str) -> IO[str]:
+    """Open a text file, possibly gzip-compressed."""
+    if filename.endswith(".gz"):
+        return io.TextIOWrapper(gzip.GzipFile(filename, mode), encoding=encoding)
+    return open(filename, mode, encoding=encoding)
+
 def squote(s: str):
     """Simple quote escaping for psql."""
     return "'" + s.replace("'", "''") + "'"
@@ -17,6 +17,9 @@ pgopts=${TEST_PG_OPTS:-}
 
 pg="$psql $pgopts"
 
+# expected psv infra version
+PSV_INFRA=6
+
 set -o pipefail
 
 # counters
@@ -117,10 +120,11 @@ function check_run()
   local name="$1" expect="$2" app="$3" cmd="$4"
   shift 4
   [ "$cmd" ] && cmd="-v psv=$cmd"
+  [ "$app" ] && app="-a $app"
 
   local tmp=./tmp_$$.sql
 
-  $psv -a "$app" "$@" > $tmp
+  $psv $app "$@" > $tmp
   psv_result=$?
   test_result "run psv $name $cmd" $psv_result 0
 
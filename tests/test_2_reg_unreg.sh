@@ -11,7 +11,7 @@ check_nop "2.4"
 check_run "2.5" 0 app "init:wet"
 check_cnt "2.6" 1
 check_run "2.7" 0 app "register:wet"
-check_ver "2.8" psv 0
+check_ver "2.8" psv $PSV_INFRA
 check_ver "2.9" app 0
 check_cnt "2.a" 2
 check_run "2.b" 0 foo "register:wet"
@@ -10,7 +10,7 @@ check_nop "4.3"
 check_run "4.4" 0 app "create:wet"
 check_run "4.5" 0 bla "create:wet"
 check_cnt "4.6" 3
-check_ver "4.7" psv 0
+check_ver "4.7" psv $PSV_INFRA
 check_ver "4.8" app 0
 check_ver "4.9" bla 0
 check_run "4.a" 0 bla "create:wet" bla_1.sql  # ok
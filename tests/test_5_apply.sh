@@ -20,6 +20,13 @@ check_run "5.d" 0 bla "apply:wet" bla_1.sql bla_2.sql
 check_ver "5.e" bla 2
 check_run "5.f" 0 bla "apply:wet" bla_3.sql bla_2.sql bla_1.sql  # out of order is ok
 check_ver "5.g" bla 3
+# chained signatures are recorded, rerun is up to date
+check_que "5.g1" 3 "SELECT COUNT(*) FROM public.psv_app_status WHERE app='bla' AND active AND chain IS NOT NULL"
+check_run "5.g2" 0 bla "apply:wet" bla_1.sql bla_2.sql bla_3.sql
+check_ver "5.g3" bla 3
+# and stops before the steps, the version is shown once
+n=$($psv -a bla bla_1.sql bla_2.sql bla_3.sql | $pg -v psv=apply:wet $db | grep -c "^# psv bla version: 3$")
+test_result "up to date 5.g4" "$n" 1
 check_run "5.h" 0 bla "remove:wet"
 check_nop "5.i"
 
@@ -10,7 +10,7 @@ check_run "8.2" 0 bla "init:wet" -s psv_test_schema -t psv_test_table bla_1.sql
 check_cnt "8.3" 1 psv_test_schema psv_test_table
 check_run "8.4" 0 bla "register:wet" -s psv_test_schema -t psv_test_table bla_1.sql bla_2.sql bla_3.sql
 check_cnt "8.5" 2 psv_test_schema psv_test_table
-check_ver "8.6" psv 0 psv_test_schema psv_test_table
+check_ver "8.6" psv $PSV_INFRA psv_test_schema psv_test_table
 check_ver "8.7" bla 0 psv_test_schema psv_test_table
 check_run "8.8" 0 bla "remove:wet" -s psv_test_schema -t psv_test_table bla_1.sql bla_2.sql bla_3.sql
 check_nop "8.9" psv_test_schema psv_test_table
@@ -55,6 +55,13 @@ check_psv "8.E output option" 0 bla -o tmp.out bla_1.sql bla_2.sql
 check_psv "8.F output option" 1 bla -o tmp.out bla_1.sql bla_2.sql
 rm -f tmp.out
 
+# compressed input and output
+gzip -c bla_2.sql > tmp_bla_2.sql.gz
+check_psv "8.E1 compressed output" 0 bla -o tmp.out.gz bla_1.sql bla_2.sql
+check_psv "8.E2 compressed input" 0 bla -o tmp.out bla_1.sql tmp_bla_2.sql.gz
+test_result "8.E3 same output" $(zcat tmp.out.gz | sed 's/bla_2.sql/tmp_bla_2.sql.gz/' | diff - tmp.out | wc -l) 0
+rm -f tmp.out tmp.out.gz tmp_bla_2.sql.gz
+
 # help
 check_run "8.G" 0 app "help"
 check_run "8.H" 0 app "help:dry"
@@ -71,5 +78,40 @@ check_psv "8.L version" 0 bla --version
 check_psv "8.M app" 1 "<bad-name>"
 check_psv "8.N hash" 1 bla --hash "no-such-algorithm" bla_1.sql
 
+# parallel loading
+check_psv "8.O jobs" 0 bla --jobs 2 bla_1.sql bla_2.sql bla_3.sql
+check_psv "8.P all cpus" 0 bla -j 0 bla_1.sql bla_2.sql bla_3.sql
+check_psv "8.Q first error" 4 bla -j 3 bla_1.sql bad_bs.sql bad_sql.sql
+check_psv "8.R jobs" 1 bla -j -1 bla_1.sql
+
+# script cache
+rm -f tmp_cache.json
+touch -d "1 hour ago" bla_1.sql bla_2.sql bla_3.sql bad_bs.sql
+check_psv "8.S cache" 0 bla -C tmp_cache.json bla_1.sql bla_2.sql bla_3.sql
+inode=$(stat -c %i tmp_cache.json)
+check_psv "8.T cached" 0 bla -C tmp_cache.json bla_1.sql bla_2.sql bla_3.sql
+# hits do not rewrite the cache
+test_result "8.T1 cache kept" "$(stat -c %i tmp_cache.json)" "$inode"
+check_psv "8.U cached trust" 0 bad -C tmp_cache.json -T bad_bs.sql
+check_psv "8.V cached error" 4 bad -C tmp_cache.json bad_bs.sql
+check_psv "8.W eviction" 0 bla -C tmp_cache.json --cache-size 1 bla_1.sql bla_2.sql
+cp bla_1.sql tmp_bla_1.sql
+check_psv "8.X recent file" 0 bla -C tmp_cache.json tmp_bla_1.sql
+echo "garbage" > tmp_cache.json
+check_psv "8.Y invalid cache" 0 bla -C tmp_cache.json bla_1.sql
+echo '{"psv_cache": 0, "entries": {}}' > tmp_cache.json
+check_psv "8.Y1 old cache" 0 bla -C tmp_cache.json bla_1.sql
+rm -f tmp_cache.json tmp_bla_1.sql
+
+# generation statistics
+check_psv "8.Z1 stats" 0 bla bla_1.sql bla_2.sql --stats 2> /dev/null
+check_psv "8.Z2 stats json" 0 bla --stats=tmp_stats.json bla_1.sql bla_2.sql
+check_que "8.Z3 stats scripts" 2 "SELECT '$(cat tmp_stats.json)'::JSON ->> 'scripts'"
+check_psv "8.Z4 stats script" 1 bla --stats bla_1.sql bla_2.sql
+# only emitted step bodies are counted
+check_psv "8.Z5 stats since" 0 bla --since 1 --stats=tmp_stats.json bla_1.sql bla_2.sql
+check_que "8.Z6 stats bodies" $(wc -c < bla_2.sql) "SELECT '$(cat tmp_stats.json)'::JSON -> 'bytes' ->> 'bodies'"
+rm -f tmp_stats.json
+
 echo "passed: $OK/$TEST"
 exit $KO
@@ -10,7 +10,7 @@ check_nop "9.3"
 # simple register
 check_run "9.4" 0 bla "create:0:wet" bla_1.sql bla_2.sql bla_3.sql bla_4.sql
 check_cnt "9.5" 2
-check_ver "9.6" psv 0
+check_ver "9.6" psv $PSV_INFRA
 check_ver "9.7" bla 0
 check_run "9.8" 0 bla "apply:1:dry" bla_1.sql bla_2.sql bla_3.sql bla_4.sql
 check_ver "9.9" bla 0
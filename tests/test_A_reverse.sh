@@ -8,7 +8,7 @@ all_bla=$(echo bla_*.sql)
 check_nop "A.0"
 check_run "A.1" 0 bla "create:wet" $all_bla
 check_cnt "A.2" 2
-check_ver "A.3" psv 0
+check_ver "A.3" psv $PSV_INFRA
 check_ver "A.4" bla 4
 check_run "A.5" 0 bla "reverse:4" $all_bla
 check_run "A.6" 0 bla "reverse:4:dry" $all_bla
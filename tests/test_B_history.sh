@@ -0,0 +1,46 @@
+#! /bin/bash
+
+source psv-test-infra.sh
+
+all_bla=$(echo bla_*.sql)
+
+# history and compaction
+check_nop "B.0"
+check_nop "B.1" psv_app_status_history
+check_run "B.2" 0 bla "create:wet" $all_bla
+check_ver "B.3" psv $PSV_INFRA
+check_ver "B.4" bla 4
+check_que "B.5" 1 "SELECT COUNT(*) FROM pg_catalog.pg_tables WHERE tablename = 'psv_app_status_history'"
+check_run "B.6" 0 bla "reverse:2:wet" $all_bla
+check_ver "B.7" bla 2
+# inactive status are kept until compaction
+check_que "B.8" 4 "SELECT COUNT(*) FROM public.psv_app_status WHERE NOT active"
+check_que "B.9" 0 "SELECT COUNT(*) FROM public.psv_app_status_history WHERE app = 'bla'"
+check_run "B.a" 0 bla "history" $all_bla
+# or moved to history by wet runs on demand
+check_run "B.b" 0 bla "apply:wet -v psv_compact=1" $all_bla
+check_ver "B.c" bla 4
+check_que "B.d" 0 "SELECT COUNT(*) FROM public.psv_app_status WHERE NOT active"
+check_que "B.e" 4 "SELECT COUNT(*) FROM public.psv_app_status_history WHERE app = 'bla'"
+check_run "B.f" 0 bla "history" $all_bla
+check_run "B.g" 0 bla "compact" $all_bla
+check_run "B.h" 0 bla "compact:wet" $all_bla
+check_que "B.i" 0 "SELECT COUNT(*) FROM public.psv_app_status WHERE NOT active"
+# inactive status left by an older psv are moved on compact
+$pg -c "INSERT INTO public.psv_app_status(app, version, active) VALUES ('old', 0, FALSE)" $db
+check_que "B.j" 1 "SELECT COUNT(*) FROM public.psv_app_status WHERE NOT active"
+check_run "B.k" 0 bla "compact:wet" $all_bla
+check_que "B.l" 0 "SELECT COUNT(*) FROM public.psv_app_status WHERE NOT active"
+check_que "B.m" 1 "SELECT COUNT(*) FROM public.psv_app_status_history WHERE app = 'old'"
+check_run "B.n" 0 bla "unregister:wet" $all_bla
+check_que "B.o" 0 "SELECT COUNT(*) FROM public.psv_app_status WHERE app = 'bla' AND active"
+# inactive status are kept until compaction
+check_que "B.p" 6 "SELECT COUNT(*) FROM public.psv_app_status WHERE app = 'bla'"
+check_run "B.q" 0 bla "compact:wet" $all_bla
+check_que "B.r" 0 "SELECT COUNT(*) FROM public.psv_app_status WHERE app = 'bla'"
+check_run "B.s" 0 bla "remove:wet"
+check_nop "B.t"
+check_nop "B.u" psv_app_status_history
+
+echo "passed: $OK/$TEST"
+exit $KO
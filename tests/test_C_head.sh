@@ -0,0 +1,37 @@
+#! /bin/bash
+
+source psv-test-infra.sh
+
+all_bla=$(echo bla_*.sql)
+
+# check application head
+function check_head()
+{
+  local name="$1" app="$2" version="$3"
+  shift 3
+  check_que "head $name" "$version" \
+    "SELECT COALESCE(MAX(version), -1) FROM public.psv_app_status_head WHERE app = '$app'"
+}
+
+# head table maintenance
+check_nop "C.0"
+check_run "C.1" 0 bla "create:wet" $all_bla
+check_head "C.2" psv $PSV_INFRA
+check_head "C.3" bla 4
+check_que "C.4" 1 "SELECT COUNT(*) FROM public.psv_app_status_head WHERE app = 'bla' AND chain IS NOT NULL"
+check_run "C.5" 0 bla "reverse:1:wet" $all_bla
+check_head "C.6" bla 1
+check_run "C.7" 0 bla "apply:3:wet" $all_bla
+check_head "C.8" bla 3
+check_run "C.9" 0 bla "catchup:2:wet" $all_bla
+check_head "C.a" bla 2
+check_run "C.b" 0 bla "status" $all_bla
+check_run "C.c" 0 bla "unregister:wet" $all_bla
+check_head "C.d" bla -1
+check_que "C.e" 1 "SELECT COUNT(*) FROM public.psv_app_status_head"
+check_run "C.f" 0 bla "remove:wet"
+check_nop "C.g"
+check_nop "C.h" psv_app_status_head
+
+echo "passed: $OK/$TEST"
+exit $KO
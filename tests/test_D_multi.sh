@@ -0,0 +1,33 @@
+#! /bin/bash
+
+source psv-test-infra.sh
+
+all_bla=$(echo bla_?.sql)
+all_foo=$(echo foo_?.sql)
+
+# several applications in one script
+check_psv "D.0" 9 bla $all_bla $all_foo
+check_psv "D.1" 1 bla --multi $all_bla $all_foo
+check_psv "D.2" 0 "" --multi $all_bla $all_foo
+check_nop "D.3"
+check_run "D.4" 0 "" "create" --multi $all_bla $all_foo
+check_nop "D.5"
+check_run "D.6" 0 "" "create:wet" --multi $all_bla $all_foo
+check_cnt "D.7" 3
+check_ver "D.8" bla 4
+check_ver "D.9" foo 3
+check_run "D.a" 0 "" "status" --multi $all_bla $all_foo
+check_run "D.b" 0 "" "history" --multi $all_bla $all_foo
+# up to date, one application then both
+check_run "D.c" 0 "" "apply:wet" --multi $all_foo
+check_run "D.d" 0 "" "apply:wet" --multi $all_bla $all_foo
+check_ver "D.e" bla 4
+check_ver "D.f" foo 3
+check_run "D.g" 0 "" "unregister:wet" --multi $all_bla $all_foo
+check_cnt "D.h" 1
+check_run "D.i" 0 bla "remove:wet"
+check_nop "D.j"
+$pg -c "DROP TABLE Foo" $db  # cleanup
+
+echo "passed: $OK/$TEST"
+exit $KO
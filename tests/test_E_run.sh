@@ -0,0 +1,70 @@
+#! /bin/bash
+
+source psv-test-infra.sh
+
+all_bla=$(echo bla_?.sql)
+
+# check psv run status
+function check_fleet()
+{
+  local name="$1" expect="$2"
+  shift 2
+  $psv run --psql "$pg" "$@" > /dev/null
+  result=$?
+  test_result "fleet $name" "$result" "$expect"
+}
+
+tmp=./tmp_$$.sql
+report=./tmp_$$.json
+dsns=./tmp_$$.txt
+fake=./tmp_psql_$$.sh
+
+$psv $all_bla > $tmp
+printf "# tenants\n$db\n\n$db\n" > $dsns
+gzip -c $tmp > $tmp.gz
+
+# fake psql: check the script, then answer or hang for "$1" seconds
+cat > $fake <<FAKE
+#! /bin/bash
+[ "\$(head -c 2)" = "--" ] || exit 4
+cat > /dev/null
+echo "# psv bla is not registered"
+echo "# WARN psv fake warning"
+[ "\$1" = 0 ] || exec sleep "\$1"
+echo "# psv wet apply for bla done"
+FAKE
+chmod +x $fake
+
+# fleet runner on several databases, actually the same one
+check_nop "E.0"
+check_fleet "E.1" 1 -f $tmp
+check_fleet "E.2" 1 -f $tmp -j 0 $db
+check_fleet "E.3" 1 -f $tmp -c "bad command" $db
+check_fleet "E.4" 1 -f ./no_such_file.sql $db
+check_fleet "E.5" 2 -f $tmp -c apply:wet $db
+check_nop "E.6"
+check_fleet "E.7" 0 -f $tmp -c create:wet -j 1 $db
+check_ver "E.8" bla 4
+check_fleet "E.9" 0 -f $tmp -c apply:wet -j 3 -D $dsns $db -r $report
+check_que "E.a" 3 "SELECT COUNT(*) FROM json_array_elements('$(cat $report)'::JSON -> 'databases')
+                   WHERE value ->> 'status' = 'done' AND (value -> 'versions' ->> 'bla')::INT = 4"
+# failure isolation
+check_fleet "E.b" 2 -f $tmp -c status -v $db "dbname=no_such_database_$$" -r $report
+check_que "E.c" 1 "SELECT COUNT(*) FROM json_array_elements('$(cat $report)'::JSON -> 'databases')
+                   WHERE value ->> 'status' = 'failed'"
+check_fleet "E.d" 2 -f $tmp -c bad_command $db
+check_fleet "E.e" 0 -f $tmp -c unregister:wet -d $db
+check_run "E.f" 0 bla "remove:wet"
+check_nop "E.g"
+# compressed script, unregistered application and warnings
+check_fleet "E.h" 0 -f $tmp.gz --psql "$fake 0" $db -r $report
+test_result "report E.i" "$(grep -c '"bla": null' $report)" 1
+# psql timeout and psql which cannot start
+check_fleet "E.j" 2 -f $tmp --psql "$fake 5" --timeout 1 $db
+check_fleet "E.k" 2 -f $tmp --psql ./no_such_psql $db
+check_fleet "E.l" 1 -f $tmp -R -1 $db
+
+rm -f $tmp $tmp.gz $report $dsns $fake
+
+echo "passed: $OK/$TEST"
+exit $KO
@@ -0,0 +1,47 @@
+#! /bin/bash
+
+source psv-test-infra.sh
+
+all_bla=$(echo bla_?.sql)
+all_m_bla=$(echo bla_m?.sql)
+
+# check psv run status
+function check_fleet()
+{
+  local name="$1" expect="$2"
+  shift 2
+  $psv run --psql "$pg" "$@" > /dev/null
+  result=$?
+  test_result "fleet $name" "$result" "$expect"
+}
+
+tmp=./tmp_f_$$.sql
+$psv $all_bla $all_m_bla > $tmp
+
+# hold the bla lock for a while in another session
+lock="SELECT pg_advisory_lock(hashtext('public.psv_app_status'), hashtext('bla'))"
+$pg -c "$lock" -c "SELECT pg_sleep(3)" $db > /dev/null &
+sleep 1
+
+# application lock
+check_nop "F.0"
+check_fleet "F.1" 2 -f $tmp -c create:wet -l nowait $db
+check_run "F.2" 3 bla "create:wet -v psv_lock=nowait" $all_bla 2> /dev/null
+check_nop "F.3"
+check_fleet "F.4" 0 -f $tmp -c create:dry -l nowait $db
+check_fleet "F.5" 0 -f $tmp -c create:wet -l wait $db
+wait
+check_ver "F.6" bla 4
+# concurrent runs, only one does the work
+check_fleet "F.7" 0 -f $tmp -c reverse:0:wet $db
+check_ver "F.8" bla 0
+check_fleet "F.9" 0 -f $tmp -c apply:wet -j 4 $db $db $db $db
+check_ver "F.a" bla 4
+check_fleet "F.b" 0 -f $tmp -c apply:wet -l none $db
+check_run "F.c" 0 bla "remove:wet"
+check_nop "F.d"
+
+rm -f $tmp
+
+echo "passed: $OK/$TEST"
+exit $KO
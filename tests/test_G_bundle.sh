@@ -0,0 +1,40 @@
+#! /bin/bash
+
+source psv-test-infra.sh
+
+all_bla=$(echo bla_*.sql)
+bundle=./tmp_bundle_$$
+
+# run a bundle driver script, which includes step files relative to itself
+function check_bundle()
+{
+  local name="$1" expect="$2" cmd="$3"
+  shift 3
+  $pg -v psv=$cmd -f $bundle/psv.sql $db
+  result=$?
+  test_result "bundle $name $cmd" "$result" "$expect"
+}
+
+# bundle output
+check_psv "G.0" 1 bla --bundle $bundle --out $bundle.sql $all_bla
+check_psv "G.1" 0 bla --bundle $bundle $all_bla
+check_psv "G.2" 1 bla --bundle $bundle $all_bla
+check_que "G.3" 8 "SELECT $(ls $bundle/steps | wc -l)"
+check_nop "G.4"
+check_bundle "G.5" 0 create
+check_nop "G.6"
+check_bundle "G.7" 0 create:2:wet
+check_ver "G.8" bla 2
+check_bundle "G.9" 0 apply:wet
+check_ver "G.a" bla 4
+check_bundle "G.b" 0 reverse:1:wet
+check_ver "G.c" bla 1
+check_bundle "G.d" 0 catchup:3:wet
+check_ver "G.e" bla 3
+check_bundle "G.f" 0 remove:wet
+check_nop "G.g"
+
+rm -rf $bundle
+
+echo "passed: $OK/$TEST"
+exit $KO
@@ -0,0 +1,48 @@
+#! /bin/bash
+
+source psv-test-infra.sh
+
+all_bla=$(echo bla_*.sql)
+
+# count psv step functions
+function check_fun()
+{
+  local name="$1" number="$2"
+  shift 2
+  check_que "functions $name" "$number" \
+    "SELECT COUNT(*) FROM pg_catalog.pg_proc
+     WHERE proname IN ('psv_app_status_applied', 'psv_app_status_reversed')
+       AND pronamespace = 'public'::REGNAMESPACE"
+}
+
+# step bookkeeping with infra functions
+check_nop "H.0"
+check_run "H.1" 0 bla "create" --functions $all_bla
+check_nop "H.2"
+check_fun "H.3" 0
+check_run "H.4" 0 bla "create:2:wet" --functions $all_bla
+check_fun "H.5" 2
+check_ver "H.6" bla 2
+check_des "H.7" bla 2 "application bla first upgrade"
+check_run "H.8" 0 bla "apply" --functions $all_bla
+check_ver "H.9" bla 2
+check_run "H.a" 0 bla "apply:wet" --functions $all_bla
+check_ver "H.b" bla 4
+check_run "H.c" 0 bla "reverse:1" --functions $all_bla
+check_ver "H.d" bla 4
+check_run "H.e" 0 bla "reverse:1:wet" --functions $all_bla
+check_ver "H.f" bla 1
+check_run "H.g" 0 bla "catchup:3" --functions $all_bla
+check_ver "H.h" bla 1
+check_run "H.i" 0 bla "catchup:3:wet" --functions $all_bla
+check_ver "H.j" bla 3
+# inline and function bookkeeping are interchangeable
+check_run "H.k" 0 bla "reverse:2:wet" $all_bla
+check_run "H.l" 0 bla "apply:wet" --functions $all_bla
+check_ver "H.m" bla 4
+check_run "H.n" 0 bla "remove:wet"
+check_nop "H.o"
+check_fun "H.p" 0
+
+echo "passed: $OK/$TEST"
+exit $KO
@@ -0,0 +1,43 @@
+#! /bin/bash
+
+source psv-test-infra.sh
+
+all_bla=$(echo bla_*.sql)
+
+# count status rows with step metrics, including history
+function check_met()
+{
+  local name="$1" number="$2" cond="$3"
+  shift 3
+  check_que "metrics $name" "$number" \
+    "SELECT COUNT(*) FROM (SELECT * FROM public.psv_app_status UNION ALL SELECT * FROM public.psv_app_status_history) AS s
+     WHERE app = 'bla' AND started IS NOT NULL AND finished >= started AND wal_bytes >= 0 AND pid IS NOT NULL AND $cond"
+}
+
+# step metrics
+check_nop "I.0"
+check_run "I.1" 0 bla "summary" $all_bla
+check_run "I.2" 0 bla "create:wet" $all_bla
+check_ver "I.3" bla 4
+check_met "I.4" 4 "active"
+check_que "I.5" 1 "SELECT COUNT(*) FROM public.psv_app_status WHERE app = 'bla' AND version = 0 AND started IS NULL"
+check_run "I.6" 0 bla "summary" $all_bla
+check_run "I.7" 0 bla "history" $all_bla
+check_run "I.8" 0 bla "reverse:2:wet" $all_bla
+check_met "I.9" 2 "NOT active AND command = 'reverse'"
+check_run "I.a" 0 bla "apply:wet" --functions $all_bla
+check_met "I.b" 4 "active"
+check_run "I.c" 0 bla "reverse:3:wet" --functions $all_bla
+check_met "I.d" 3 "NOT active AND command = 'reverse'"
+# no metrics for catch-up
+check_run "I.e" 0 bla "catchup:4:wet" --functions $all_bla
+check_ver "I.f" bla 4
+check_met "I.g" 3 "active"
+check_run "I.h" 0 bla "compact:wet" $all_bla
+check_run "I.i" 0 bla "summary" $all_bla
+check_met "I.j" 9 "TRUE"
+check_run "I.k" 0 bla "remove:wet"
+check_nop "I.l"
+
+echo "passed: $OK/$TEST"
+exit $KO
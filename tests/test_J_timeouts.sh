@@ -0,0 +1,66 @@
+#! /bin/bash
+
+source psv-test-infra.sh
+
+# check psv run status
+function check_fleet()
+{
+  local name="$1" expect="$2"
+  shift 2
+  $psv run --psql "$pg" "$@" > /dev/null
+  result=$?
+  test_result "fleet $name" "$result" "$expect"
+}
+
+tj1=./tmp_j1_$$.sql tj2=./tmp_j2_$$.sql tj3=./tmp_j3_$$.sql tjx=./tmp_jx_$$.sql
+echo "-- psv: tj +1 lock_timeout=200ms statement_timeout=10s tj table" > $tj1
+echo "CREATE TABLE tj(id INTEGER);" >> $tj1
+echo "-- psv: tj +2 lock_timeout=100ms tj data" > $tj2
+echo "ALTER TABLE tj ADD COLUMN data TEXT;" >> $tj2
+echo "-- psv: tj +3 tj more" > $tj3
+echo "ALTER TABLE tj ADD COLUMN more TEXT;" >> $tj3
+echo "-- psv: tj +2 lock_timeout=5x tj bad" > $tjx
+echo "ALTER TABLE tj ADD COLUMN data TEXT;" >> $tjx
+
+tmp=./tmp_j_$$.sql
+$psv $tj1 $tj2 > $tmp
+
+# header directives
+check_psv "J.0" 0 tj $tj1 $tj2
+check_psv "J.1" 3 tj $tj1 $tjx
+check_nop "J.2"
+check_run "J.3" 0 tj "create:wet" $tj1
+check_des "J.4" tj 1 "tj table"
+
+# hold a lock on the table for a while in another session
+hold="BEGIN; LOCK TABLE tj; SELECT pg_sleep(3); COMMIT;"
+$pg -c "$hold" $db > /dev/null &
+sleep 1
+
+# step lock timeout, then retries
+check_fleet "J.5" 2 -f $tmp -c apply:wet $db
+check_ver "J.6" tj 1
+check_fleet "J.7" 0 -f $tmp -c apply:wet --retries 3 --backoff 1 $db
+wait
+check_ver "J.8" tj 2
+check_des "J.9" tj 2 "tj data"
+
+# preflight waits for long transactions
+$psv $tj1 $tj2 $tj3 > $tmp
+$pg -c "$hold" $db > /dev/null &
+sleep 1
+check_fleet "J.a" 0 -f $tmp -c apply:dry --psql "$pg -v psv_preflight=500ms" $db
+check_fleet "J.b" 2 -f $tmp -c apply:wet --psql "$pg -v psv_preflight=500ms -v psv_preflight_timeout=100ms" $db
+check_ver "J.c" tj 2
+check_fleet "J.d" 0 -f $tmp -c apply:wet --psql "$pg -v psv_preflight=500ms -v psv_preflight_timeout=10s" $db
+wait
+check_ver "J.e" tj 3
+
+check_run "J.f" 0 tj "remove:wet" $tj1 $tj2 $tj3
+check_nop "J.g"
+$pg -c "DROP TABLE IF EXISTS tj" $db > /dev/null
+
+rm -f $tmp $tj1 $tj2 $tj3 $tjx
+
+echo "passed: $OK/$TEST"
+exit $KO
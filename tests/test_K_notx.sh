@@ -0,0 +1,64 @@
+#! /bin/bash
+
+source psv-test-infra.sh
+
+# check number of valid or invalid tk indexes
+function check_idx()
+{
+  local name="$1" number="$2" valid="$3"
+  shift 3
+  check_que "index $name" "$number" \
+    "SELECT COUNT(*) FROM pg_catalog.pg_index WHERE indrelid = 'tk'::REGCLASS AND indisvalid = $valid"
+}
+
+tk1=./tmp_k1_$$.sql tk2=./tmp_k2_$$.sql tkx=./tmp_kx_$$.sql
+echo "-- psv: tk +1 tk table" > $tk1
+echo "CREATE TABLE tk(id INTEGER, data TEXT);" >> $tk1
+echo "INSERT INTO tk VALUES (1, 'one'), (2, 'two'), (2, 'deux');" >> $tk1
+echo "-- psv: tk +2 transaction=off statement_timeout=1min tk indexes" > $tk2
+echo "CREATE INDEX CONCURRENTLY IF NOT EXISTS tk_data ON tk(data);" >> $tk2
+echo "CREATE UNIQUE INDEX CONCURRENTLY tk_id ON tk(id);" >> $tk2
+echo "VACUUM ANALYZE tk;" >> $tk2
+echo "-- psv: tk +2 transaction=maybe tk bad" > $tkx
+echo "VACUUM tk;" >> $tkx
+
+# header directive
+check_psv "K.0" 0 tk $tk1 $tk2
+check_psv "K.1" 3 tk $tk1 $tkx
+check_nop "K.2"
+
+# interrupted non transactional step leaves an invalid index
+check_run "K.3" 0 tk "create:wet" $tk1
+check_run "K.4" 3 tk "apply:wet" $tk1 $tk2 2> /dev/null
+check_ver "K.5" tk 1
+check_idx "K.6" 1 TRUE
+check_idx "K.7" 1 FALSE
+
+# which is dropped on the next run
+$pg -c "DELETE FROM tk WHERE data = 'deux'" $db > /dev/null
+check_run "K.8" 0 tk "apply" $tk1 $tk2
+check_idx "K.9" 1 FALSE
+check_run "K.a" 0 tk "apply:wet" $tk1 $tk2
+check_ver "K.b" tk 2
+check_des "K.c" tk 2 "tk indexes"
+check_idx "K.d" 2 TRUE
+check_idx "K.e" 0 FALSE
+check_que "K.f" 1 "SELECT COUNT(*) FROM public.psv_app_status WHERE app = 'tk' AND version = 2 AND finished >= started"
+
+# with functions
+check_run "K.g" 0 tk "remove:wet"
+$pg -c "DROP TABLE tk" $db > /dev/null
+check_run "K.h" 0 tk "create:wet" --functions $tk1
+$pg -c "DELETE FROM tk WHERE data = 'deux'" $db > /dev/null
+check_run "K.i" 0 tk "apply:wet" --functions $tk1 $tk2
+check_ver "K.j" tk 2
+check_idx "K.k" 2 TRUE
+
+check_run "K.l" 0 tk "remove:wet"
+check_nop "K.m"
+$pg -c "DROP TABLE tk" $db > /dev/null
+
+rm -f $tk1 $tk2 $tkx
+
+echo "passed: $OK/$TEST"
+exit $KO
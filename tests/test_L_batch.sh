@@ -0,0 +1,62 @@
+#! /bin/bash
+
+source psv-test-infra.sh
+
+tl1=./tmp_l1_$$.sql tl2=./tmp_l2_$$.sql tlx=./tmp_lx_$$.sql tly=./tmp_ly_$$.sql tlz=./tmp_lz_$$.sql
+echo "-- psv: tl +1 tl table" > $tl1
+echo "CREATE TABLE tl(id INTEGER PRIMARY KEY, data TEXT, n INTEGER NOT NULL DEFAULT 0);" >> $tl1
+echo "INSERT INTO tl(id) SELECT i FROM generate_series(1, 1000) AS i;" >> $tl1
+echo "-- psv: tl +2 batch=100 tl backfill" > $tl2
+echo "UPDATE tl SET data = id::TEXT, n = n + 1" >> $tl2
+echo "  WHERE id IN (SELECT id FROM tl WHERE \$1 IS NULL OR id > \$1::INTEGER ORDER BY id LIMIT \$2)" >> $tl2
+echo "  RETURNING id;" >> $tl2
+echo "-- psv: tl +2 batch=0 tl bad" > $tlx
+echo "SELECT 1;" >> $tlx
+echo "-- psv: tl +2 batch=100 tl quoted" > $tly
+echo "SELECT id FROM tl WHERE '\$psv_batch\$' <> \$1 LIMIT \$2;" >> $tly
+echo "-- psv: tl +2 tl quoted" > $tlz
+echo "SELECT '\$psv_batch\$';" >> $tlz
+
+# header directive
+check_psv "L.0" 0 tl $tl1 $tl2
+check_psv "L.1" 3 tl $tl1 $tlx
+# batch quote only matters in batch steps
+check_psv "L.1a" 3 tl $tl1 $tly
+check_psv "L.1b" 0 tl $tl1 $tlz
+check_nop "L.2"
+check_run "L.3" 0 tl "create:wet" $tl1
+check_ver "L.4" tl 1
+
+# interrupted batch step keeps its progress
+$pg -c "ALTER TABLE tl ADD CONSTRAINT tl_555 CHECK (data IS NULL OR id <> 555)" $db > /dev/null
+check_run "L.5" 3 tl "apply:wet" $tl1 $tl2 2> /dev/null
+check_ver "L.6" tl 1
+check_que "L.7" 500 "SELECT COUNT(*) FROM tl WHERE n = 1"
+check_que "L.8" 1 "SELECT COUNT(*) FROM public.psv_app_status_progress WHERE app = 'tl' AND version = 2 AND last_key = '500' AND rows = 500 AND batches = 5"
+
+# and resumes where it stopped
+$pg -c "ALTER TABLE tl DROP CONSTRAINT tl_555" $db > /dev/null
+check_run "L.9" 0 tl "apply" $tl1 $tl2
+check_ver "L.a" tl 1
+check_run "L.b" 0 tl "apply:wet" $tl1 $tl2
+check_ver "L.c" tl 2
+check_des "L.d" tl 2 "tl backfill"
+check_que "L.e" 1000 "SELECT COUNT(*) FROM tl WHERE n = 1 AND data = id::TEXT"
+check_que "L.f" 0 "SELECT COUNT(*) FROM public.psv_app_status_progress"
+
+# with functions, from scratch
+check_run "L.g" 0 tl "remove:wet"
+$pg -c "DROP TABLE tl" $db > /dev/null
+check_run "L.h" 0 tl "create:wet" --functions $tl1 $tl2
+check_ver "L.i" tl 2
+check_que "L.j" 1000 "SELECT COUNT(*) FROM tl WHERE n = 1"
+
+check_run "L.k" 0 tl "remove:wet"
+check_nop "L.l"
+check_nop "L.m" psv_app_status_progress
+$pg -c "DROP TABLE tl" $db > /dev/null
+
+rm -f $tl1 $tl2 $tlx $tly $tlz
+
+echo "passed: $OK/$TEST"
+exit $KO
@@ -0,0 +1,69 @@
+#! /bin/bash
+
+source psv-test-infra.sh
+
+# count active versions of tm
+function check_act()
+{
+  local name="$1" number="$2"
+  shift 2
+  check_que "active $name" "$number" \
+    "SELECT COUNT(*) FROM public.psv_app_status WHERE app = 'tm' AND active"
+}
+
+tm0=./tmp_m0_$$.sql tm1=./tmp_m1_$$.sql tm2=./tmp_m2_$$.sql tm3=./tmp_m3_$$.sql tmx=./tmp_mx_$$.sql
+echo "-- psv: tm =2 tm baseline" > $tm0
+echo "CREATE TABLE tm(id INTEGER, data TEXT);" >> $tm0
+echo "-- psv: tm +1 tm one" > $tm1
+echo "CREATE TABLE tm(id INTEGER);" >> $tm1
+echo "-- psv: tm +2 tm two" > $tm2
+echo "ALTER TABLE tm ADD COLUMN data TEXT;" >> $tm2
+echo "-- psv: tm +3 tm three" > $tm3
+echo "ALTER TABLE tm ADD COLUMN more TEXT;" >> $tm3
+echo "-- psv: tm =1 tm other baseline" > $tmx
+echo "CREATE TABLE tm(id INTEGER);" >> $tmx
+
+# versions covered by the baseline are optional
+check_psv "M.0" 0 tm $tm0 $tm3
+check_psv "M.1" 0 tm $tm0 $tm1 $tm2 $tm3
+check_psv "M.2" 8 tm $tm1 $tm3
+check_psv "M.3" 7 tm $tm0 $tmx $tm3
+check_nop "M.4"
+
+# fresh application without history
+check_run "M.5" 0 tm "create" $tm0 $tm3
+check_run "M.6" 0 tm "create:wet" $tm0 $tm3
+check_ver "M.7" tm 3
+check_act "M.8" 3
+check_des "M.9" tm 2 "tm baseline"
+# history is consistent with the baseline
+check_run "M.a" 0 tm "apply:wet" $tm0 $tm1 $tm2 $tm3
+check_ver "M.b" tm 3
+check_run "M.c" 0 tm "remove:wet"
+$pg -c "DROP TABLE tm" $db > /dev/null
+
+# fresh application with history, which is recorded but not executed
+check_run "M.d" 0 tm "create:wet" $tm0 $tm1 $tm2 $tm3
+check_ver "M.e" tm 3
+check_act "M.f" 4
+check_que "M.g" 3 "SELECT COUNT(*) FROM public.psv_app_status WHERE app = 'tm' AND active AND chain IS NOT NULL"
+check_run "M.h" 0 tm "apply:wet" $tm0 $tm1 $tm2 $tm3
+check_run "M.i" 0 tm "remove:wet"
+$pg -c "DROP TABLE tm" $db > /dev/null
+
+# baseline is ignored on an existing application or below the target version
+check_run "M.j" 0 tm "create:1:wet" $tm0 $tm1 $tm2 $tm3
+check_ver "M.k" tm 1
+check_run "M.l" 0 tm "apply:wet" $tm0 $tm1 $tm2 $tm3
+check_ver "M.m" tm 3
+check_act "M.n" 4
+check_que "M.o" 1 "SELECT COUNT(*) FROM public.psv_app_status WHERE app = 'tm' AND active AND filename LIKE 'tmp_m2_%'"
+
+check_run "M.p" 0 tm "remove:wet"
+check_nop "M.q"
+$pg -c "DROP TABLE tm" $db > /dev/null
+
+rm -f $tm0 $tm1 $tm2 $tm3 $tmx
+
+echo "passed: $OK/$TEST"
+exit $KO
@@ -0,0 +1,89 @@
+#! /bin/bash
+
+source psv-test-infra.sh
+
+all_bla=$(echo bla_?.sql)
+prefix=psv_test_$$
+newdb=${db}_new_$$
+
+# check psv template status
+function check_tpl()
+{
+  local name="$1" expect="$2"
+  shift 2
+  template=$($psv template --psql "$pg" -D $db -P $prefix "$@")
+  result=$?
+  test_result "template $name" "$result" "$expect"
+}
+
+# count psv templates with this prefix
+function check_nbt()
+{
+  local name="$1" number="$2"
+  shift 2
+  check_que "templates $name" "$number" \
+    "SELECT COUNT(*) FROM pg_catalog.pg_database WHERE datistemplate AND datname LIKE '${prefix}_%'"
+}
+
+tb5=./tmp_n5_$$.sql
+echo "-- psv: bla +5 bla five" > $tb5
+echo "CREATE TABLE bla_five();" >> $tb5
+tbx=./tmp_nx_$$.sql
+echo "-- psv: bla +5 bla failing" > $tbx
+echo "SELECT 1 / 0;" >> $tbx
+tbe=./tmp_ne_$$.sql
+printf -- "-- psv: bla +5 bla latin1\nCREATE TABLE bla_latin1();\nCOMMENT ON TABLE bla_latin1 IS '\xe9';\n" > $tbe
+
+# options and scripts
+check_tpl "N.0" 1 -k 0 $all_bla
+check_tpl "N.1" 1 -P "bad prefix" $all_bla
+check_tpl "N.2" 1
+check_tpl "N.3" 9 bla_1.sql foo_1.sql
+check_tpl "N.3a" 1 -H no_such_hash $all_bla
+check_tpl "N.3b" 1 -a "bad app" $all_bla
+check_tpl "N.3c" 9 -a foo $all_bla
+check_tpl "N.3d" 1 -d bla_1.sql foo_1.sql 2> /dev/null
+check_tpl "N.3e" 12 -v --psql ./no_such_psql $all_bla 2> /dev/null
+check_tpl "N.3f" 12 -D no_such_database_$$ $all_bla 2> /dev/null
+check_tpl "N.3g" 12 $all_bla $tbx 2> /dev/null
+check_nbt "N.4" 0
+check_que "N.4a" 0 "SELECT COUNT(*) FROM pg_catalog.pg_database WHERE datname LIKE '${prefix}_%'"
+
+# build once, then reuse
+check_tpl "N.5" 0 $all_bla
+first=$template
+check_nbt "N.6" 1
+check_tpl "N.7" 0 -c $newdb $all_bla
+test_result "template N.8 same" $([ "$template" = "$first" ] && echo 0 || echo 1) 0
+check_nbt "N.9" 1
+n=$($pg -tA -c "SELECT MAX(version) FROM public.psv_app_status WHERE app = 'bla' AND active" $newdb)
+test_result "template N.a version" "$n" 4
+$pg -c "DROP DATABASE $newdb" $db > /dev/null
+
+# changed steps make a new template, with bounded retention
+check_tpl "N.b" 0 $all_bla $tb5
+test_result "template N.c other" $([ "$template" != "$first" ] && echo 0 || echo 1) 0
+check_nbt "N.d" 2
+check_tpl "N.e" 0 -k 1 $all_bla $tb5
+check_nbt "N.f" 1
+
+# scripts are passed to psql in their encoding
+PGCLIENTENCODING=LATIN1 check_tpl "N.e1" 0 -e LATIN1 -c $newdb $all_bla $tbe
+n=$($pg -tA -c "SELECT obj_description('bla_latin1'::REGCLASS) = U&'\00E9'" $newdb)
+test_result "template N.e2 encoding" "$n" t
+$pg -c "DROP DATABASE $newdb" $db > /dev/null
+
+# cleanup
+check_tpl "N.g" 0 --drop $all_bla
+check_nbt "N.h" 0
+# a database already holds the template name
+$pg -c "CREATE DATABASE $first" $db > /dev/null
+check_tpl "N.h1" 12 $all_bla 2> /dev/null
+check_nbt "N.h2" 0
+$pg -c "DROP DATABASE $first" $db > /dev/null
+check_nop "N.i"
+
+rm -f $tb5 $tbx $tbe
+
+echo "passed: $OK/$TEST"
+exit $KO
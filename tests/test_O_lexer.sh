@@ -0,0 +1,66 @@
+#! /bin/bash
+
+source psv-test-infra.sh
+
+to1=./tmp_o1_$$.sql to2=./tmp_o2_$$.sql to3=./tmp_o3_$$.sql tox=./tmp_ox_$$.sql
+echo "-- psv: to +1 to procedure" > $to1
+echo "-- commit; \\echo in a comment" >> $to1
+echo "/* rollback; /* nested */ \\set x 1 */" >> $to1
+echo "CREATE TABLE to_data(id INTEGER, data TEXT);" >> $to1
+echo "CREATE PROCEDURE to_proc() AS \$body\$" >> $to1
+echo "BEGIN" >> $to1
+echo "  INSERT INTO to_data VALUES (1, 'commit; \\x');" >> $to1
+echo "  COMMIT;" >> $to1
+echo "END;" >> $to1
+echo "\$body\$ LANGUAGE plpgsql;" >> $to1
+echo "INSERT INTO to_data VALUES (2, E'it\\'s; rollback'), (3, 'it''s');" >> $to1
+echo "-- psv: to +2 to index" >> $to2
+echo "CREATE INDEX to_data_id" >> $to2
+echo "  ON to_data(id);" >> $to2
+# tokens longer than the lexer guard
+long=$(printf "%0200d" 0)
+echo "-- psv: to +2 to long tokens" > $to3
+echo "-- $long commit;" >> $to3
+echo "/* $long /* commit; */ $long */" >> $to3
+echo "SELECT '$long commit; ''$long', E'$long \\' commit; $long', \"$long\";" >> $to3
+echo "ALTER TABLE \"to_data\" ADD COLUMN data2 TEXT DEFAULT \$\$ $long commit; $long \$\$;" >> $to3
+
+# no false positives in comments, strings and bodies
+check_psv "O.0" 0 to $to1 $to2
+check_nop "O.1"
+
+# actual backslash and transaction commands, unterminated string
+echo "-- psv: to +2 to backslash" > $tox
+echo "SELECT 1 AS one \\gset" >> $tox
+check_psv "O.2" 4 to $to1 $tox
+echo "-- psv: to +2 to transaction" > $tox
+echo "SELECT 1; savepoint here;" >> $tox
+check_psv "O.3" 5 to $to1 $tox
+echo "-- psv: to +2 to unterminated" > $tox
+echo "SELECT \$\$ oops;" >> $tox
+check_psv "O.4" 13 to $to1 $tox
+check_psv "O.5" 0 to -T $to1 $tox
+
+# same checks and lock analysis with tokens spanning small chunks
+check_psv "O.5a" 0 to --locks=tmp_o_$$.json $to1 $to3
+check_psv "O.5b" 0 to --chunk-size 7 --locks=tmp_o7_$$.json $to1 $to3
+test_result "lexer O.5c chunks" "$(cmp tmp_o_$$.json tmp_o7_$$.json && echo same)" same
+echo "-- psv: to +2 to long unterminated" > $tox
+echo "SELECT 'oops $long;" >> $tox
+check_psv "O.5d" 13 to --chunk-size 7 $to1 $tox
+check_psv "O.5e" 1 to --chunk-size 0 $to1
+rm -f tmp_o_$$.json tmp_o7_$$.json
+
+# apply steps
+check_run "O.6" 0 to "create:wet" $to1 $to2
+check_ver "O.7" to 2
+check_que "O.8" 2 "SELECT COUNT(*) FROM to_data"
+
+check_run "O.9" 0 to "remove:wet"
+check_nop "O.a"
+$pg -c "DROP TABLE to_data" -c "DROP PROCEDURE to_proc" $db > /dev/null
+
+rm -f $to1 $to2 $to3 $tox
+
+echo "passed: $OK/$TEST"
+exit $KO
@@ -0,0 +1,54 @@
+#! /bin/bash
+
+source psv-test-infra.sh
+
+tp1=./tmp_p1_$$.sql tp2=./tmp_p2_$$.sql tp3=./tmp_p3_$$.sql tp4=./tmp_p4_$$.sql tpj=./tmp_pj_$$.json
+echo "-- psv: tp +1 tp table" > $tp1
+echo "CREATE TABLE tp(id INTEGER PRIMARY KEY, data TEXT);" >> $tp1
+echo "CREATE INDEX tp_data ON tp(data);" >> $tp1
+echo "-- psv: tp +2 transaction=off tp concurrent index" > $tp2
+echo "CREATE INDEX CONCURRENTLY tp_id_data ON tp(id, data);" >> $tp2
+echo "-- psv: tp +3 tp rewrite" > $tp3
+echo "ALTER TABLE tp" >> $tp3
+echo "  ADD COLUMN flag BOOLEAN DEFAULT FALSE," >> $tp3
+echo "  ALTER COLUMN data TYPE VARCHAR(100);" >> $tp3
+echo "-- psv: tp +4 tp many locks" > $tp4
+echo "ALTER TABLE tp ADD COLUMN created TIMESTAMP DEFAULT clock_timestamp();" >> $tp4
+echo "ALTER TABLE tp ADD CONSTRAINT tp_data_nn CHECK (data IS NOT NULL) NOT VALID;" >> $tp4
+echo "ALTER TABLE tp VALIDATE CONSTRAINT tp_data_nn;" >> $tp4
+echo "ALTER TABLE tp ALTER COLUMN data SET NOT NULL;" >> $tp4
+echo "LOCK TABLE tp IN SHARE MODE;" >> $tp4
+echo "LOCK tp;" >> $tp4
+for i in $(seq 1 100) ; do echo "VACUUM tp;" >> $tp4 ; done
+
+# lock analysis, tables created in the same step are ignored
+check_psv "P.0" 0 tp --max-lock share_update_exclusive $tp1 $tp2
+check_psv "P.1" 14 tp --max-lock share_update_exclusive $tp1 $tp2 $tp3
+check_psv "P.2" 0 tp --max-lock access_exclusive $tp1 $tp2 $tp3
+check_psv "P.3" 2 tp --max-lock nope $tp1 2> /dev/null
+check_psv "P.4" 0 tp --locks=$tpj $tp1 $tp2 $tp3
+test_result "P.5" "$(grep -c '"rewrite": true' $tpj)" 1
+
+# human-readable analysis, with volatile defaults, validated constraints,
+# explicit locks and a bounded number of reported statements
+locks=$($psv -a tp $tp1 $tp2 $tp3 $tp4 --locks 2>&1 > /dev/null)
+test_result "P.5a" "$(echo "$locks" | head -1)" "psv locks: 4 steps, strongest lock ACCESS EXCLUSIVE"
+test_result "P.5b" "$(echo "$locks" | grep -c ' REWRITE')" 2
+test_result "P.5c" "$(echo "$locks" | grep -c 'set not null tp$')" 1
+test_result "P.5d" "$(echo "$locks" | grep -c ': SHARE lock table tp$')" 1
+test_result "P.5e" "$(echo "$locks" | grep -c ': ACCESS EXCLUSIVE lock table tp$')" 1
+test_result "P.5f" "$(echo "$locks" | grep -c '… and 6 more$')" 1
+test_result "P.5g" "$(echo "$locks" | grep -c '(no transaction)$')" 1
+
+# analysis does not change the script
+check_run "P.6" 0 tp "create:wet" $tp1 $tp2 $tp3
+check_ver "P.7" tp 3
+
+check_run "P.8" 0 tp "remove:wet"
+check_nop "P.9"
+$pg -c "DROP TABLE tp" $db > /dev/null
+
+rm -f $tp1 $tp2 $tp3 $tp4 $tpj
+
+echo "passed: $OK/$TEST"
+exit $KO
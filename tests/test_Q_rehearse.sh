@@ -0,0 +1,84 @@
+#! /bin/bash
+
+source psv-test-infra.sh
+
+# check whether the tq table has a given column
+function check_col()
+{
+  local name="$1" number="$2" column="$3"
+  shift 3
+  check_que "column $name" "$number" \
+    "SELECT COUNT(*) FROM pg_catalog.pg_attribute WHERE attrelid = 'tq'::REGCLASS AND attname = '$column'"
+}
+
+# run psv script and count output lines matching a pattern
+function check_out()
+{
+  local name="$1" expect="$2" pattern="$3" cmd="$4"
+  shift 4
+  $psv -a tq "$@" > $tmp
+  n=$($pg -v psv=$cmd $db < $tmp 2>&1 | grep -c -- "$pattern")
+  test_result "output $name $cmd" "$n" "$expect"
+}
+
+tmp=./tmp_q_$$.sql
+tq1=./tmp_q1_$$.sql tq2=./tmp_q2_$$.sql tq3=./tmp_q3_$$.sql
+echo "-- psv: tq +1 tq table" > $tq1
+echo "CREATE TABLE tq(id INTEGER PRIMARY KEY, data TEXT);" >> $tq1
+echo "INSERT INTO tq SELECT i, 'data ' || i FROM generate_series(1, 10) AS i;" >> $tq1
+echo "-- psv: tq +2 tq more" > $tq2
+echo "ALTER TABLE tq ADD COLUMN more TEXT;" >> $tq2
+echo "UPDATE tq SET more = data WHERE id <= 4;" >> $tq2
+echo "DELETE FROM tq WHERE id > 8;" >> $tq2
+echo "-- psv: tq +3 transaction=off tq index" > $tq3
+echo "CREATE INDEX CONCURRENTLY tq_more ON tq(more);" >> $tq3
+
+# rehearsal requires the infra
+check_run "Q.0" 0 tq "create:rehearse" $tq1
+check_nop "Q.1"
+check_run "Q.2" 0 tq "init:wet"
+check_run "Q.3" 0 tq "register:wet"
+
+# steps are executed, then rolled back
+check_run "Q.4" 0 tq "apply:rehearse" $tq1 $tq2
+check_ver "Q.5" tq 0
+check_que "Q.6" 0 "SELECT COUNT(*) FROM pg_catalog.pg_tables WHERE tablename = 'tq'"
+check_out "Q.7" 1 "# psv rolled back 2 rehearsed steps for tq" "apply:rehearse" $tq1 $tq2
+check_out "Q.8" 1 "# psv rehearse apply for tq done" "apply:rehearse" $tq1 $tq2
+check_out "Q.9" 2 "^Time: " "apply:rehearse" $tq1
+
+# on an existing table, with row counts and locks
+check_run "Q.a" 0 tq "apply:wet" $tq1
+check_ver "Q.b" tq 1
+check_out "Q.c" 1 "AccessExclusiveLock" "apply:rehearse" $tq1 $tq2
+check_out "Q.d" 1 "| *0 | *4 | *2$" "apply:rehearse" $tq1 $tq2
+check_ver "Q.e" tq 1
+check_col "Q.f" 0 more
+check_que "Q.g" 10 "SELECT COUNT(*) FROM tq"
+
+# non transactional steps are not rehearsed, also with functions
+check_out "Q.h" 1 "# WARN psv cannot rehearse non transactional step tq 3" "apply:rehearse" $tq1 $tq2 $tq3
+check_out "Q.i" 1 "# psv rolled back 1 rehearsed steps" "apply:rehearse" --functions $tq1 $tq2 $tq3
+check_ver "Q.j" tq 1
+check_col "Q.k" 0 more
+
+# fleet runner
+$psv -a tq $tq1 $tq2 > $tmp
+$psv run --psql "$pg" -f $tmp -c apply:rehearse $db > /dev/null
+test_result "fleet Q.l" $? 0
+check_ver "Q.m" tq 1
+
+# then for real
+check_run "Q.n" 0 tq "apply:wet" $tq1 $tq2 $tq3
+check_ver "Q.o" tq 3
+check_col "Q.p" 1 more
+
+# cleanup
+check_run "Q.q" 0 tq "remove:wet"
+check_nop "Q.r"
+$pg -c "DROP TABLE tq" $db > /dev/null
+
+rm -f $tmp $tq1 $tq2 $tq3
+
+echo "passed: $OK/$TEST"
+exit $KO
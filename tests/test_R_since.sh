@@ -0,0 +1,53 @@
+#! /bin/bash
+
+source psv-test-infra.sh
+
+all_bla=$(echo bla_?.sql)
+all_m_bla=$(echo bla_m?.sql)
+
+# steps outside of the window are not read beyond their header
+tr1=./tmp_r1_$$.sql tr2=./tmp_r2_$$.sql
+echo "-- psv: bla +1 bla with a backslash" > $tr1
+echo "\\echo not read" >> $tr1
+echo "-- psv: bla +2 bla other second step" > $tr2
+echo "CREATE TABLE bla_other();" >> $tr2
+
+# options
+check_psv "R.0" 1 bla -S 0 $all_bla
+check_psv "R.1" 8 bla -S 5 $all_bla
+check_psv "R.2" 1 bla -m -S 2 $all_bla
+check_psv "R.3" 4 bla $tr1 bla_2.sql
+check_psv "R.4" 0 bla -S 2 $tr1 bla_2.sql bla_3.sql
+check_psv "R.5" 8 bla -S 2 $tr1 bla_3.sql
+check_nop "R.6"
+
+# guard on a fresh application
+check_run "R.7" 0 bla "create:wet" -S 2 $all_bla
+check_ver "R.8" bla 0
+
+# apply from the window
+check_run "R.9" 0 bla "apply:wet" bla_1.sql bla_2.sql
+check_ver "R.a" bla 2
+check_run "R.b" 0 bla "apply:wet" -S 2 $tr1 $tr2 bla_3.sql bla_4.sql
+check_ver "R.c" bla 2
+check_run "R.d" 0 bla "apply:wet" -S 2 $tr1 bla_2.sql bla_3.sql bla_4.sql
+check_ver "R.e" bla 4
+check_run "R.f" 0 bla "apply:wet" -S 3 $all_bla
+check_ver "R.g" bla 4
+
+# reverse within the window only
+check_run "R.h" 0 bla "reverse:1:wet" -S 2 $all_bla $all_m_bla
+check_ver "R.i" bla 4
+check_run "R.j" 0 bla "reverse:2:wet" -S 2 $all_bla $all_m_bla
+check_ver "R.k" bla 2
+check_run "R.l" 0 bla "apply:wet" -S 2 $all_bla $all_m_bla
+check_ver "R.m" bla 4
+
+# cleanup
+check_run "R.n" 0 bla "remove:wet"
+check_nop "R.o"
+
+rm -f $tr1 $tr2
+
+echo "passed: $OK/$TEST"
+exit $KO